@@ -0,0 +1,73 @@
+"""
+Direct HTTP client for the AIRR search API.
+
+Once a token has been obtained through the browser login, searches can go
+straight to api.orderonline.airr.com.au over a pooled keep-alive connection
+instead of through page.evaluate() and fetch() inside Chromium.
+"""
+import json
+import httpx
+
+SITE_URL = 'https://orderonline.airr.com.au/'
+SEARCH_API_URL = 'https://api.orderonline.airr.com.au/search'
+
+# Same headers the SPA sends, so the API sees the same request either way
+API_HEADERS = {
+    'Content-Type': 'application/json;charset=UTF-8',
+    'Accept': 'application/json, text/plain, */*',
+    'Origin': SITE_URL.rstrip('/'),
+    'Referer': SITE_URL
+}
+
+class AirrApiClient:
+    """Pooled async client returning the same result dicts as the in-page fetch"""
+    
+    def __init__(self, max_connections=8, timeout=30.0):
+        self.client = httpx.AsyncClient(
+            headers=API_HEADERS,
+            timeout=timeout,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections
+            )
+        )
+    
+    async def search(self, product_code, token, warehouse='SYD'):
+        """POST a product search; never raises, errors come back in the result"""
+        params = {
+            'token': token,
+            'warehouse': warehouse,
+            'page': 1,
+            'size': 20,
+            'isElders': 'false'
+        }
+        try:
+            response = await self.client.post(
+                SEARCH_API_URL,
+                params=params,
+                content=json.dumps({"search": product_code})
+            )
+            
+            if response.status_code == 200:
+                return {'success': True, 'data': response.json()}
+            
+            error_text = response.text
+            try:
+                error_json = json.loads(error_text)
+                error = error_json.get('error') if isinstance(error_json, dict) else None
+                return {'success': False, 'status': response.status_code, 'error': error or error_text}
+            except ValueError:
+                return {'success': False, 'status': response.status_code, 'error': error_text[:100]}
+        
+        except (httpx.HTTPError, ValueError) as e:
+            return {'success': False, 'error': str(e) or type(e).__name__}
+    
+    async def close(self):
+        """Close pooled connections"""
+        await self.client.aclose()
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, *exc_info):
+        await self.close()
@@ -0,0 +1,280 @@
+"""
+AIRR login: the SPA login form, plus a fast path that replays its login XHR.
+
+The first form login records the request the SPA sends to the API (with the
+credentials swapped for placeholders, so nothing secret is stored) and where
+the token sits in its response. Later logins replay that request directly -
+with fetch() from an existing page or as a plain HTTP POST - which is a single
+round trip instead of a page load, form fill and networkidle wait.
+"""
+import os
+import json
+from urllib.parse import parse_qsl, urlencode, quote_plus
+from airr_api import SITE_URL, API_HEADERS
+
+USERNAME_SELECTOR = 'input[type="text"], input[name*="user"], input[id*="user"]'
+PASSWORD_SELECTOR = 'input[type="password"]'
+SUBMIT_SELECTOR = 'button[type="submit"], input[type="submit"], button:has-text("Login")'
+
+USERNAME_PLACEHOLDER = '{{airr_USERNAME}}'
+PASSWORD_PLACEHOLDER = '{{airr_PASSWORD}}'
+
+LOGIN_REPLAY_JS = """
+    async ([url, method, headers, body]) => {
+        try {
+            const response = await fetch(url, { method: method, headers: headers, body: body });
+            return { status: response.status, text: await response.text() };
+        } catch (e) {
+            return { status: 0, text: e.message };
+        }
+    }
+"""
+
+STORE_TOKEN_JS = "(value) => localStorage.setItem('token', value)"
+
+def get_credentials():
+    """AIRR username and password from the environment"""
+    return os.getenv('airr_USERNAME'), os.getenv('airr_PASSWORD')
+
+def parse_token(token_raw):
+    """Unwrap a token stored as a JSON string in localStorage"""
+    try:
+        if token_raw.startswith('"') and token_raw.endswith('"'):
+            return json.loads(token_raw)
+    except:
+        pass
+    return token_raw
+
+def is_login_request(request, username):
+    """True for the POST the SPA sends with the username in its body"""
+    if request.method != 'POST' or not username:
+        return False
+    post_data = request.post_data or ''
+    return any(form in post_data for form in (username, json.dumps(username)[1:-1], quote_plus(username)))
+
+def _swap_values(value, replacements):
+    """Recursively replace exact string values inside parsed JSON"""
+    if isinstance(value, dict):
+        return {k: _swap_values(v, replacements) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_swap_values(v, replacements) for v in value]
+    if isinstance(value, str):
+        return replacements.get(value, value)
+    return value
+
+def _find_path(value, target, path=()):
+    """Key path to `target` inside parsed JSON, or None"""
+    if value == target:
+        return list(path)
+    if isinstance(value, dict):
+        items = value.items()
+    elif isinstance(value, list):
+        items = enumerate(value)
+    else:
+        return None
+    for key, child in items:
+        found = _find_path(child, target, path + (key,))
+        if found is not None:
+            return found
+    return None
+
+def build_login_capture(url, headers, post_data, response_json, token, token_raw, username, password):
+    """
+    Turn an observed login request/response into a replayable template.
+    
+    Returns None if the token cannot be located in the response body (for
+    example if the API hands it out in a cookie), in which case logins keep
+    going through the form.
+    """
+    token_path = _find_path(response_json, token)
+    if token_path is None:
+        return None
+    
+    hide = {username: USERNAME_PLACEHOLDER, password: PASSWORD_PLACEHOLDER}
+    try:
+        body = json.dumps(_swap_values(json.loads(post_data), hide))
+        body_format = 'json'
+    except ValueError:
+        pairs = parse_qsl(post_data, keep_blank_values=True)
+        if pairs:
+            body = urlencode([(k, hide.get(v, v)) for k, v in pairs])
+            body_format = 'form'
+        else:
+            return None
+    
+    return {
+        'url': url,
+        'method': 'POST',
+        'headers': {k: v for k, v in headers.items() if k.lower() in ('content-type', 'accept')},
+        'body': body,
+        'body_format': body_format,
+        'token_path': token_path,
+        # Keep localStorage in the same shape the SPA writes it
+        'token_quoted': token_raw.startswith('"')
+    }
+
+def render_login_body(capture, username, password):
+    """Fill the credentials back into a captured login body"""
+    fill = {USERNAME_PLACEHOLDER: username, PASSWORD_PLACEHOLDER: password}
+    if capture['body_format'] == 'json':
+        return json.dumps(_swap_values(json.loads(capture['body']), fill))
+    pairs = parse_qsl(capture['body'], keep_blank_values=True)
+    return urlencode([(k, fill.get(v, v)) for k, v in pairs])
+
+def token_from_response(capture, status, text):
+    """Pull the token out of a replayed login response, or None"""
+    if status != 200:
+        return None
+    try:
+        value = json.loads(text)
+        for key in capture['token_path']:
+            value = value[key]
+    except (ValueError, KeyError, IndexError, TypeError):
+        return None
+    return value if isinstance(value, str) and value else None
+
+def login_via_form(page, settle_ms=2000, credentials=None):
+    """Log in through the SPA form; returns (token, capture), either may be None"""
+    username, password = credentials or get_credentials()
+    
+    page.goto(SITE_URL, timeout=30000)
+    page.wait_for_timeout(2000)
+    
+    page.locator(USERNAME_SELECTOR).first.fill(username)
+    page.locator(PASSWORD_SELECTOR).first.fill(password)
+    
+    login_response = None
+    try:
+        with page.expect_response(lambda r: is_login_request(r.request, username), timeout=15000) as response_info:
+            page.locator(SUBMIT_SELECTOR).first.click()
+        login_response = response_info.value
+    except Exception:
+        pass
+    
+    page.wait_for_load_state('networkidle', timeout=30000)
+    page.wait_for_timeout(settle_ms)
+    
+    token_raw = page.evaluate('() => localStorage.getItem("token")')
+    if not token_raw:
+        return None, None
+    token = parse_token(token_raw)
+    
+    capture = None
+    if login_response:
+        try:
+            request = login_response.request
+            capture = build_login_capture(request.url, request.headers, request.post_data or '',
+                                          login_response.json(), token, token_raw, username, password)
+        except Exception:
+            pass
+    return token, capture
+
+async def login_via_form_async(page, settle_ms=2000, credentials=None):
+    """Async variant of login_via_form"""
+    username, password = credentials or get_credentials()
+    
+    await page.goto(SITE_URL, timeout=30000)
+    await page.wait_for_timeout(2000)
+    
+    await page.locator(USERNAME_SELECTOR).first.fill(username)
+    await page.locator(PASSWORD_SELECTOR).first.fill(password)
+    
+    login_response = None
+    try:
+        async with page.expect_response(lambda r: is_login_request(r.request, username), timeout=15000) as response_info:
+            await page.locator(SUBMIT_SELECTOR).first.click()
+        login_response = await response_info.value
+    except Exception:
+        pass
+    
+    await page.wait_for_load_state('networkidle', timeout=30000)
+    await page.wait_for_timeout(settle_ms)
+    
+    token_raw = await page.evaluate('() => localStorage.getItem("token")')
+    if not token_raw:
+        return None, None
+    token = parse_token(token_raw)
+    
+    capture = None
+    if login_response:
+        try:
+            request = login_response.request
+            capture = build_login_capture(request.url, request.headers, request.post_data or '',
+                                          await login_response.json(), token, token_raw, username, password)
+        except Exception:
+            pass
+    return token, capture
+
+class AirrAuthenticator:
+    """Logs in by replaying the captured login XHR, falling back to the form"""
+    
+    def __init__(self, capture=None, credentials=None):
+        self.capture = capture
+        # (username, password); the airr_USERNAME account unless given
+        self.credentials = credentials or get_credentials()
+    
+    def _replay_args(self):
+        username, password = self.credentials
+        return [self.capture['url'], self.capture['method'], self.capture['headers'],
+                render_login_body(self.capture, username, password)]
+    
+    def _stored_value(self, token):
+        return json.dumps(token) if self.capture.get('token_quoted') else token
+    
+    def _adopt_capture(self, capture):
+        if capture and capture != self.capture:
+            self.capture = capture
+            print("  ✓ Captured the login request - later logins will replay it")
+    
+    def login(self, page, settle_ms=2000):
+        """Sync login on `page`; returns the token or None"""
+        if self.capture:
+            if not page.url.startswith(SITE_URL):
+                page.goto(SITE_URL, timeout=30000)
+            result = page.evaluate(LOGIN_REPLAY_JS, self._replay_args())
+            token = token_from_response(self.capture, result['status'], result['text'])
+            if token:
+                page.evaluate(STORE_TOKEN_JS, self._stored_value(token))
+                return token
+            print(f"  ⚠ Login replay failed (HTTP {result['status']}), using the login form")
+        
+        token, capture = login_via_form(page, settle_ms, self.credentials)
+        self._adopt_capture(capture)
+        return token
+    
+    async def login_async(self, page=None, http_client=None, settle_ms=2000):
+        """
+        Async login; returns the token or None.
+        
+        With http_client (an httpx.AsyncClient) the captured request is replayed
+        without touching the browser; otherwise it is replayed from `page`.
+        """
+        if self.capture:
+            if http_client:
+                try:
+                    response = await http_client.request(
+                        self.capture['method'], self.capture['url'],
+                        headers={**API_HEADERS, **self.capture['headers']},
+                        content=self._replay_args()[3]
+                    )
+                    status, text = response.status_code, response.text
+                except Exception as e:
+                    status, text = 0, str(e)
+            else:
+                if not page.url.startswith(SITE_URL):
+                    await page.goto(SITE_URL, timeout=30000)
+                result = await page.evaluate(LOGIN_REPLAY_JS, self._replay_args())
+                status, text = result['status'], result['text']
+            
+            token = token_from_response(self.capture, status, text)
+            if token:
+                if page and not http_client:
+                    await page.evaluate(STORE_TOKEN_JS, self._stored_value(token))
+                return token
+            print(f"  ⚠ Login replay failed (HTTP {status}), using the login form")
+        
+        if page is None:
+            return None
+        token, capture = await login_via_form_async(page, settle_ms, self.credentials)
+        self._adopt_capture(capture)
+        return token
@@ -1,16 +1,17 @@
 #!/usr/bin/env python3
 """
-Clean all data - removes CSV files, checkpoints, and database table
+Clean all data - removes CSV files, checkpoints, and old database history
 Use this before starting a fresh scrape
+
+By default only partitions older than $AIRR_RETENTION_DAYS are removed from
+the database; --all drops the whole table, history included.
 """
 import os
+import glob
+import argparse
 import psycopg2
-from pathlib import Path
-from dotenv import load_dotenv
-
-# Load environment variables from .env file in script directory
-env_path = Path(__file__).parent / '.env'
-load_dotenv(dotenv_path=env_path)
+from db_schema import ensure_schema, apply_retention, RETENTION_DAYS
+from db_connection import get_database, close_database, missing_credentials
 
 def clean_files():
     """Remove local CSV and checkpoint files"""
@@ -18,9 +19,15 @@ def clean_files():
         'airr_product_data.csv',
         'airr_product_data_backup.csv',
         'scrape_checkpoint.json',
+        'scrape_journal.jsonl',
+        'upload_watermark.json',
+        'auth_token.json',
         'test_checkpoint.json'
     ]
     
+    # Token caches of extra AIRR accounts (see credential_pool)
+    files_to_remove += sorted(glob.glob('auth_token-*.json'))
+    
     print("📁 Cleaning local files...")
     removed = 0
     for file in files_to_remove:
@@ -34,48 +41,47 @@ def clean_files():
     else:
         print(f"  Total removed: {removed} files")
 
-def clean_database():
-    """Drop database table"""
-    has_db_creds = all([
-        os.getenv('SUPABASE_HOST'),
-        os.getenv('SUPABASE_DBNAME'),
-        os.getenv('SUPABASE_USER'),
-        os.getenv('SUPABASE_PASSWORD'),
-        os.getenv('SUPABASE_PORT')
-    ])
-    
-    if not has_db_creds:
+def clean_database(drop_all=False):
+    """Drop expired partitions, or the whole table with drop_all"""
+    if missing_credentials():
         print("\n🗄️  Database credentials not found - skipping database cleanup")
         return
     
     try:
         print("\n🗄️  Cleaning database...")
         
-        DB_CONFIG = {
-            'host': os.getenv('SUPABASE_HOST'),
-            'dbname': os.getenv('SUPABASE_DBNAME'),
-            'user': os.getenv('SUPABASE_USER'),
-            'password': os.getenv('SUPABASE_PASSWORD'),
-            'port': os.getenv('SUPABASE_PORT'),
-            'sslmode': 'require'
-        }
+        database = get_database()
+        conn = database.get_connection()
+        print(f"  ✓ Connected to {os.getenv('SUPABASE_HOST')}")
         
-        conn = psycopg2.connect(**DB_CONFIG)
-        print(f"  ✓ Connected to {DB_CONFIG['host']}")
+        if not drop_all:
+            ensure_schema(conn)
+            removed = apply_retention(conn)
+            print(f"  ✓ Removed {len(removed)} partitions older than {RETENTION_DAYS} days")
+            close_database()
+            return
         
         with conn.cursor() as cur:
             # Get row count before deletion
             cur.execute("SELECT COUNT(*) FROM airr_product_availability")
             count = cur.fetchone()[0]
             
-            # Drop table
+            # Drop table (partitions go with it)
             cur.execute("DROP TABLE IF EXISTS airr_product_availability CASCADE")
+            cur.execute("DROP TABLE IF EXISTS airr_product_current")
+            # Delta-mode change log and last-seen heartbeat
+            cur.execute("DROP TABLE IF EXISTS airr_product_changes, airr_product_last_seen")
+            # Normalized-mode history and its dimension tables (the view goes with them)
+            cur.execute("DROP TABLE IF EXISTS airr_availability_fact, airr_products, airr_locations CASCADE")
+            cur.execute("DROP TABLE IF EXISTS scrape_runs, scrape_queue")
+            # So the next ensure_schema() recreates everything from migration 1
+            cur.execute("DROP TABLE IF EXISTS schema_migrations")
             conn.commit()
             
             print(f"  ✓ Dropped table 'airr_product_availability' ({count:,} rows deleted)")
         
-        conn.close()
-        
+        close_database()
+    
     except psycopg2.OperationalError as e:
         print(f"  ✗ Database connection failed: {e}")
     except psycopg2.Error as e:
@@ -87,13 +93,22 @@ def clean_database():
         print(f"  ✗ Error: {e}")
 
 def main():
+    parser = argparse.ArgumentParser(description="Remove local scrape files and old database history")
+    parser.add_argument('--all', action='store_true',
+                        help="Drop the whole database table instead of only expired partitions")
+    args = parser.parse_args()
+    
     print("="*60)
     print("CLEAN ALL DATA - Fresh Start")
     print("="*60)
     print("\nThis will remove:")
     print("  - All CSV files (airr_product_data.csv)")
     print("  - All checkpoint files")
-    print("  - Database table (airr_product_availability)")
+    if args.all:
+        print("  - All database tables: history (airr_product_availability), current stock,")
+        print("    delta change log and last-seen, normalized facts, run log and work queue")
+    else:
+        print(f"  - Database partitions older than {RETENTION_DAYS} days")
     print()
     
     response = input("Are you sure you want to continue? (yes/no): ")
@@ -105,7 +120,7 @@ def main():
     print("\n" + "="*60)
     
     clean_files()
-    clean_database()
+    clean_database(drop_all=args.all)
     
     print("\n" + "="*60)
     print("✅ CLEANUP COMPLETE")
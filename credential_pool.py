@@ -0,0 +1,113 @@
+"""
+Several AIRR accounts scraping side by side.
+
+All searches used to run under the one airr_USERNAME/airr_PASSWORD account,
+so any per-account throttling capped the whole scrape. Extra accounts go
+in numbered pairs next to it in .env (numbering stops at the first gap):
+
+    airr_USERNAME_2=...
+    airr_PASSWORD_2=...
+
+Every account gets its own browser context, login, token (shared with other
+scraper processes through its own token cache file, see token_broker) and
+AimdRateLimiter. Each batch of SKUs goes to the active account whose limiter
+can start a request soonest, so accounts get work in proportion to the rate
+they are sustaining without errors. An account whose logins fail, or whose
+tokens keep being rejected, is taken out of rotation for the rest of the run.
+"""
+import os
+from rate_limiter import AimdRateLimiter
+from token_broker import TOKEN_CACHE_FILE
+
+# Authentication failures in a row that take an account out of rotation
+AUTH_FAILURE_LIMIT = int(os.getenv('AIRR_ACCOUNT_FAILURE_LIMIT', '3'))
+
+def load_credentials():
+    """[(name, username, password)]: the airr_USERNAME account, then airr_USERNAME_2, _3, ..."""
+    accounts = []
+    if os.getenv('airr_USERNAME') and os.getenv('airr_PASSWORD'):
+        accounts.append(('main', os.getenv('airr_USERNAME'), os.getenv('airr_PASSWORD')))
+    number = 2
+    while os.getenv(f'airr_USERNAME_{number}'):
+        password = os.getenv(f'airr_PASSWORD_{number}')
+        if password:
+            accounts.append((str(number), os.getenv(f'airr_USERNAME_{number}'), password))
+        else:
+            print(f"⚠️  airr_USERNAME_{number} has no airr_PASSWORD_{number} - skipping it")
+        number += 1
+    return accounts
+
+def token_cache_path(name):
+    """Token cache file of an account: auth_token.json for the main one, auth_token-2.json, ..."""
+    if not TOKEN_CACHE_FILE or name == 'main':
+        return TOKEN_CACHE_FILE
+    root, ext = os.path.splitext(TOKEN_CACHE_FILE)
+    return f"{root}-{name}{ext}"
+
+class Account:
+    """One set of credentials with its own session, token and request budget"""
+    
+    def __init__(self, name, username, password, limiter):
+        self.name = name
+        self.credentials = (username, password)
+        self.limiter = limiter
+        self.token_cache = token_cache_path(name)
+        self.auth_failures = 0
+        self.active = True
+        self.products = 0
+        # Filled in by the scraper once the account's session is open
+        self.tokens = None
+        self.login = None
+        self.page = None
+        self.api_client = None
+    
+    @property
+    def label(self):
+        return f"{self.name} ({self.credentials[0]})"
+    
+    def record_auth(self, ok):
+        """Count an authentication success or failure; False once the account is out of rotation"""
+        if ok:
+            self.auth_failures = 0
+            return self.active
+        self.auth_failures += 1
+        if self.auth_failures >= AUTH_FAILURE_LIMIT:
+            self.retire("keeps failing authentication")
+        return self.active
+    
+    def retire(self, reason):
+        """Take the account out of rotation for the rest of the run"""
+        if self.active:
+            self.active = False
+            print(f"  ⛔ Account {self.label} {reason} - taken out of rotation")
+
+class CredentialPool:
+    """The run's accounts and which of them are still in rotation"""
+    
+    def __init__(self, credentials, rate_limiter=None):
+        limiter = rate_limiter or AimdRateLimiter()
+        self.accounts = []
+        for position, (name, username, password) in enumerate(credentials):
+            # The first account keeps the caller's limiter; the others get one with the same ceiling
+            account_limiter = limiter if position == 0 else AimdRateLimiter(max_rate=limiter.max_rate)
+            self.accounts.append(Account(name, username, password, account_limiter))
+    
+    def active(self):
+        """Accounts still in rotation"""
+        return [account for account in self.accounts if account.active]
+    
+    def pick(self):
+        """
+        The active account whose rate limiter has the earliest free slot, or None.
+        
+        Booking a request moves a limiter's next slot on by 1/rate, so over time
+        each account is picked in proportion to its current healthy rate.
+        """
+        active = self.active()
+        if not active:
+            return None
+        return min(active, key=lambda account: account.limiter.next_slot)
+    
+    def refresh_count(self):
+        """Token refreshes across all accounts"""
+        return sum(account.tokens.refresh_count for account in self.accounts if account.tokens)
@@ -0,0 +1,121 @@
+"""
+Streaming CSV output for scraped products.
+
+Each finished product is flattened to one row per warehouse location and
+appended to airr_product_data.csv straight away, so writing the CSV costs the
+same per product no matter how big the run gets and nothing has to be kept
+in memory for it.
+"""
+import os
+import csv
+
+CSV_COLUMNS = [
+    'product_code',
+    'product_name',
+    'location_name',
+    'location_abbreviation',
+    'location_id',
+    'qty_available',
+    'qty_in_transit',
+    'qty_on_hand',
+    'qty_on_order',
+    'scrape_status',
+    'error_message',
+    'run_id',
+    'scraped_at'
+]
+
+def flatten_product(item):
+    """One CSV row per product-location (or a single row if no locations)"""
+    scraped_at = item.get('scraped_at')
+    stamp = {
+        'run_id': item.get('run_id'),
+        'scraped_at': scraped_at.isoformat() if scraped_at else None
+    }
+    
+    if not item['availability_locations']:
+        # No locations found - single row
+        return [{
+            'product_code': item['product_code'],
+            'product_name': item['product_name'],
+            'scrape_status': item['scrape_status'],
+            'error_message': item['error_message'],
+            **stamp
+        }]
+    
+    return [{
+        'product_code': item['product_code'],
+        'product_name': item['product_name'],
+        'location_name': location.get('location_name'),
+        'location_abbreviation': location.get('location_abbreviation'),
+        'location_id': location.get('location_id'),
+        'qty_available': location.get('qty_available'),
+        'qty_in_transit': location.get('qty_in_transit'),
+        'qty_on_hand': location.get('qty_on_hand'),
+        'qty_on_order': location.get('qty_on_order'),
+        'scrape_status': item['scrape_status'],
+        'error_message': item['error_message'],
+        **stamp
+    } for location in item['availability_locations']]
+
+class StreamingCsvWriter:
+    """Appends flattened product rows to the output CSV as products finish"""
+    
+    def __init__(self, path, append=False):
+        self.path = path
+        self.append = append
+        self.file = None
+        self.writer = None
+        self.rows_written = 0
+        self.products_written = 0
+        self.rows_before = 0
+    
+    def existing_rows(self):
+        """Data rows already in the file that a resumed run will append to"""
+        if not (self.append and os.path.exists(self.path)):
+            return 0
+        with open(self.path, 'r', encoding='utf-8', newline='') as f:
+            self.rows_before = max(0, sum(1 for _ in csv.reader(f)) - 1)
+        return self.rows_before
+    
+    def total_rows(self):
+        """Data rows in the file so far, including those from before a resume"""
+        return self.rows_before + self.rows_written
+    
+    def _open(self):
+        # Only keep existing rows when resuming a run into the same file
+        resume = self.append and os.path.exists(self.path) and os.path.getsize(self.path) > 0
+        fieldnames = CSV_COLUMNS
+        if resume:
+            # Keep the columns of the file being resumed (it may predate run_id/scraped_at)
+            with open(self.path, 'r', encoding='utf-8', newline='') as f:
+                fieldnames = next(csv.reader(f), None) or CSV_COLUMNS
+        self.file = open(self.path, 'a' if resume else 'w', newline='', encoding='utf-8')
+        self.writer = csv.DictWriter(self.file, fieldnames=fieldnames, extrasaction='ignore')
+        if not resume:
+            self.writer.writeheader()
+    
+    def write_product(self, product_data):
+        """Append one product's rows; returns how many rows were written"""
+        if self.file is None:
+            self._open()
+        rows = flatten_product(product_data)
+        self.writer.writerows(rows)
+        # Hand rows to the OS before the product is journaled as done
+        self.file.flush()
+        self.rows_written += len(rows)
+        self.products_written += 1
+        return len(rows)
+    
+    def flush(self):
+        """Push buffered rows to disk (called at checkpoints)"""
+        if self.file:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+    
+    def close(self):
+        """Flush and close the output file"""
+        if self.file:
+            self.flush()
+            self.file.close()
+            self.file = None
@@ -49,35 +49,31 @@ def run_command(command, description):
         
         log(f"✓ Completed: {description}")
         return True
-        
+    
     except Exception as e:
         log(f"✗ Exception in {description}: {e}")
         return False
 
 def clean_database():
-    """Clear old data from Supabase database"""
+    """Apply history retention: drop partitions older than $AIRR_RETENTION_DAYS"""
     try:
-        import psycopg2
+        from db_schema import ensure_schema, apply_retention, RETENTION_DAYS
+        from db_connection import get_database, close_database
         
-        DB_CONFIG = {
-            'host': os.getenv('SUPABASE_HOST'),
-            'dbname': os.getenv('SUPABASE_DBNAME'),
-            'user': os.getenv('SUPABASE_USER'),
-            'password': os.getenv('SUPABASE_PASSWORD'),
-            'port': os.getenv('SUPABASE_PORT'),
-            'sslmode': 'require'
-        }
+        def retention(conn):
+            ensure_schema(conn)
+            return apply_retention(conn)
         
-        conn = psycopg2.connect(**DB_CONFIG)
-        with conn.cursor() as cur:
-            cur.execute("DROP TABLE IF EXISTS airr_product_availability CASCADE")
-            conn.commit()
-        conn.close()
+        removed = get_database().run(retention)
+        close_database()
         
-        log("  ✓ Database table dropped (will be recreated on upload)")
+        if removed:
+            log(f"  ✓ Removed {len(removed)} partitions older than {RETENTION_DAYS} days: {', '.join(removed)}")
+        else:
+            log(f"  ✓ History kept (nothing older than {RETENTION_DAYS} days)")
         return True
     except Exception as e:
-        log(f"  ⚠️  Could not clear database: {e}")
+        log(f"  ⚠️  Could not apply database retention: {e}")
         return False
 
 def main():
@@ -86,9 +82,14 @@ def main():
     log("DAILY SCRAPING WORKFLOW STARTED - FRESH RUN")
     log("="*70)
     
+    # Shared by the scraper and the uploader (inherited by both subprocesses)
+    run_id = os.environ.setdefault('SCRAPE_RUN_ID', datetime.now().strftime('%Y%m%d-%H%M%S'))
+    log(f"Run ID: {run_id}")
+    
     # Clean up old data files
     log("\n📁 Cleaning up old data files...")
-    for file in ['airr_product_data.csv', 'airr_product_data_backup.csv', 'scrape_checkpoint.json']:
+    for file in ['airr_product_data.csv', 'airr_product_data_backup.csv', 'scrape_checkpoint.json', 'scrape_journal.jsonl',
+                 'upload_watermark.json']:
         if os.path.exists(file):
             os.remove(file)
             log(f"  Removed: {file}")
@@ -103,7 +104,7 @@ def main():
     ])
     
     if has_db_creds:
-        log("\n🗄️  Cleaning database...")
+        log("\n🗄️  Applying database retention...")
         clean_database()
     
     log("✓ Ready for fresh scrape from product #1")
@@ -128,7 +129,7 @@ def main():
     # Step 2: Run the scraping script
     log("\n🕷️  STEP 2: Scraping Products")
     log("-" * 70)
-    log("Starting scraper with auto-refresh every 100 products...")
+    log("Starting scraper with auto-refresh before token expiry...")
     
     if not run_command(
         "python scrape_products_with_cookies.py",
@@ -168,7 +169,7 @@ def main():
     ])
     
     if has_db_creds:
-        log("Database credentials found. Starting upload...")
+        log("Database credentials found. Uploading rows not already written during the scrape...")
         if run_command(
             "python upload_to_database.py",
             "Database upload"
@@ -0,0 +1,158 @@
+"""
+Shared PostgreSQL connections for the scraper, the uploader and the cleanup scripts.
+
+Settings come from the SUPABASE_* variables in .env. Connections are kept
+in a small thread-safe pool, so a process pays the SSL handshake once per
+connection instead of once per use. TCP keepalives notice a dead server
+and every connection gets a statement timeout, so a stuck query fails
+instead of hanging the run. Getting a connection retries with exponential
+backoff, and reconnect() swaps a broken connection for a fresh one, so a
+database blip mid-scrape costs a few seconds instead of the rows written
+meanwhile (see db_writer).
+"""
+import os
+import time
+from pathlib import Path
+from dotenv import load_dotenv
+from psycopg2 import pool, OperationalError, InterfaceError
+
+# Load environment variables from .env file in script directory
+env_path = Path(__file__).parent / '.env'
+load_dotenv(dotenv_path=env_path)
+
+CREDENTIAL_VARIABLES = ['SUPABASE_HOST', 'SUPABASE_DBNAME', 'SUPABASE_USER', 'SUPABASE_PASSWORD', 'SUPABASE_PORT']
+
+POOL_SIZE = int(os.getenv('AIRR_DB_POOL_SIZE', '4'))
+# 0 disables the timeout; migrations always run without one
+STATEMENT_TIMEOUT_MS = int(os.getenv('AIRR_DB_STATEMENT_TIMEOUT_MS', '300000'))
+CONNECT_ATTEMPTS = int(os.getenv('AIRR_DB_CONNECT_ATTEMPTS', '5'))
+BACKOFF_MAX = 30
+
+def missing_credentials():
+    """Names of the SUPABASE_* variables that are not set"""
+    return [name for name in CREDENTIAL_VARIABLES if not os.getenv(name)]
+
+def db_config():
+    """psycopg2.connect() keyword arguments, or None without credentials"""
+    if missing_credentials():
+        return None
+    config = {
+        'host': os.getenv('SUPABASE_HOST'),
+        'dbname': os.getenv('SUPABASE_DBNAME'),
+        'user': os.getenv('SUPABASE_USER'),
+        'password': os.getenv('SUPABASE_PASSWORD'),
+        'port': os.getenv('SUPABASE_PORT'),
+        'sslmode': os.getenv('AIRR_DB_SSLMODE', 'require'),
+        'connect_timeout': 10,
+        # Find out about a dead server within about a minute, not hours
+        'keepalives': 1,
+        'keepalives_idle': 30,
+        'keepalives_interval': 10,
+        'keepalives_count': 3,
+        'application_name': 'airr-scraper'
+    }
+    if STATEMENT_TIMEOUT_MS:
+        # A startup option rather than a session SET: behind a transaction-mode
+        # pooler (port 6543) a SET would stick to whichever server connection
+        # ran it and reach other clients, or be lost on the next transaction
+        config['options'] = f"-c statement_timeout={STATEMENT_TIMEOUT_MS}"
+    return config
+
+def connection_lost(conn, error=None):
+    """True if `conn` (rather than the last statement) is what failed"""
+    return conn is None or bool(conn.closed) or isinstance(error, InterfaceError)
+
+class Database:
+    """Pool of connections to one database, with retrying checkout"""
+    
+    def __init__(self, config, size=POOL_SIZE):
+        self.config = config
+        self.size = size
+        self.pool = None
+    
+    def _checkout(self):
+        if self.pool is None:
+            # minconn=0: nothing is opened until a connection is asked for
+            self.pool = pool.ThreadedConnectionPool(0, self.size, **self.config)
+        conn = self.pool.getconn()
+        if conn.closed:
+            self.pool.putconn(conn, close=True)
+            conn = self.pool.getconn()
+        return conn
+    
+    def get_connection(self, attempts=CONNECT_ATTEMPTS):
+        """A pooled connection; retries with exponential backoff"""
+        delay = 1
+        for attempt in range(1, attempts + 1):
+            try:
+                return self._checkout()
+            except OperationalError as e:
+                if attempt == attempts:
+                    raise
+                print(f"⚠️  Database connection failed ({str(e).strip()}); retrying in {delay}s...")
+                time.sleep(delay)
+                delay = min(delay * 2, BACKOFF_MAX)
+    
+    def release(self, conn):
+        """Return a connection to the pool (closing it if it is broken)"""
+        if self.pool and conn is not None:
+            self.pool.putconn(conn, close=bool(conn.closed))
+    
+    def reconnect(self, conn, attempts=None):
+        """
+        Drop a broken connection and check out a fresh one. The old connection
+        goes back to the pool even if no new one can be had.
+        """
+        if conn is not None:
+            try:
+                conn.close()
+            except Exception:
+                pass
+            self.release(conn)
+        return self.get_connection(attempts or CONNECT_ATTEMPTS)
+    
+    def run(self, work, attempts=CONNECT_ATTEMPTS):
+        """
+        Call work(conn) with a pooled connection and return its result. If the
+        connection drops, work is retried on a new one, so it must be safe
+        to repeat (all the writes here are upserts).
+        """
+        conn = self.get_connection()
+        try:
+            for attempt in range(1, attempts + 1):
+                try:
+                    return work(conn)
+                except (OperationalError, InterfaceError) as e:
+                    if attempt == attempts or not connection_lost(conn, e):
+                        raise
+                    print(f"⚠️  Database connection lost ({str(e).strip()}); reconnecting...")
+                    # reconnect() has released the old connection, even if it raises
+                    lost, conn = conn, None
+                    conn = self.reconnect(lost)
+        finally:
+            self.release(conn)
+    
+    def close(self):
+        """Close every pooled connection"""
+        if self.pool:
+            self.pool.closeall()
+            self.pool = None
+
+_database = None
+
+def get_database():
+    """The process-wide Database, or None if no credentials are configured"""
+    global _database
+    if _database is None:
+        config = db_config()
+        if config is None:
+            return None
+        _database = Database(config)
+    return _database
+
+def close_database():
+    """Close the process-wide pool, if one was opened"""
+    global _database
+    if _database:
+        _database.close()
+        _database = None
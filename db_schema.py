@@ -0,0 +1,547 @@
+"""
+Schema for the airr_product_availability history table.
+
+The table is partitioned by scraped_at (one partition per day, or per week
+with AIRR_PARTITION_INTERVAL=week), so history can be kept instead of
+dropping the table before every run: queries filtered on scraped_at only
+touch the partitions they need, and retention removes whole old partitions
+(AIRR_RETENTION_DAYS, default 90) rather than deleting rows.
+
+Partitions are created on demand by ensure_partitions() before rows for a
+new period are written. A plain table left by older versions of the
+scraper is converted in place the first time ensure_schema() runs.
+
+Schema changes are versioned: MIGRATIONS lists them in order and
+schema_migrations records which have been applied, so ensure_schema() -
+called by the scraper, the uploader and the cleanup scripts alike - only
+does real work when the code is newer than the database.
+
+Next to the history, airr_product_current keeps one row per
+(product_code, location_id) with the latest successfully scraped
+quantities. Every write path upserts it in the same transaction as the
+history rows, so current stock is a primary-key read however much history
+is kept.
+
+With AIRR_STORAGE_MODE=delta the history table is replaced by a change log
+(airr_product_changes) plus a per-product heartbeat (airr_product_last_seen);
+see delta_store.
+
+With AIRR_STORAGE_MODE=normalized the history goes to airr_availability_fact
+instead: product and location strings live once in the airr_products and
+airr_locations dimension tables and each fact row is two integer keys, the
+four quantities and scraped_at (also partitioned by day or week). The
+airr_availability_history view joins them back into the familiar shape;
+see dimensions.
+
+scrape_runs holds one row of totals per run, kept up to date as rows are
+written (see run_log). scrape_queue holds the SKUs of runs that several
+workers share (see work_queue).
+"""
+import os
+import re
+from datetime import datetime, date, timedelta
+from psycopg2 import sql
+
+TABLE_NAME = 'airr_product_availability'
+CURRENT_TABLE_NAME = 'airr_product_current'
+CHANGES_TABLE_NAME = 'airr_product_changes'
+SEEN_TABLE_NAME = 'airr_product_last_seen'
+PRODUCTS_TABLE_NAME = 'airr_products'
+LOCATIONS_TABLE_NAME = 'airr_locations'
+FACT_TABLE_NAME = 'airr_availability_fact'
+FACT_VIEW_NAME = 'airr_availability_history'
+RUNS_TABLE_NAME = 'scrape_runs'
+MIGRATIONS_TABLE_NAME = 'schema_migrations'
+QUEUE_TABLE_NAME = 'scrape_queue'
+
+# Tables partitioned by scraped_at (and subject to retention)
+PARTITIONED_TABLES = [TABLE_NAME, FACT_TABLE_NAME]
+
+# 'history' writes a full row per product-location per run, 'delta' only changes,
+# 'normalized' a compact integer-keyed row per product-location per run
+STORAGE_MODE = os.getenv('AIRR_STORAGE_MODE', 'history')
+
+PARTITION_INTERVAL = os.getenv('AIRR_PARTITION_INTERVAL', 'day')
+RETENTION_DAYS = int(os.getenv('AIRR_RETENTION_DAYS', '90'))
+# 'drop' deletes expired partitions, 'detach' keeps them as standalone tables
+RETENTION_MODE = os.getenv('AIRR_RETENTION_MODE', 'drop')
+
+# Arbitrary key for pg_advisory_xact_lock, so concurrent migrations don't race
+SCHEMA_LOCK_ID = 7233001
+
+CREATE_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS {table} (
+    id SERIAL,
+    product_code VARCHAR(50) NOT NULL,
+    product_name TEXT,
+    location_name VARCHAR(100),
+    location_abbreviation VARCHAR(20),
+    location_id VARCHAR(20),
+    qty_available INTEGER DEFAULT 0,
+    qty_in_transit INTEGER DEFAULT 0,
+    qty_on_hand INTEGER DEFAULT 0,
+    qty_on_order INTEGER DEFAULT 0,
+    scrape_status VARCHAR(20),
+    error_message TEXT,
+    scraped_at TIMESTAMP NOT NULL,
+    uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    run_id VARCHAR(32),
+    PRIMARY KEY (id, scraped_at),
+    UNIQUE (product_code, location_id, scraped_at)
+) PARTITION BY RANGE (scraped_at)
+"""
+
+CREATE_INDEXES_QUERY = """
+CREATE INDEX IF NOT EXISTS idx_product_code ON {table}(product_code);
+CREATE INDEX IF NOT EXISTS idx_location_id ON {table}(location_id);
+CREATE INDEX IF NOT EXISTS idx_scraped_at ON {table}(scraped_at);
+CREATE INDEX IF NOT EXISTS idx_run_id ON {table}(run_id);
+"""
+
+CREATE_CURRENT_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS {table} (
+    product_code VARCHAR(50) NOT NULL,
+    location_id VARCHAR(20) NOT NULL,
+    product_name TEXT,
+    location_name VARCHAR(100),
+    location_abbreviation VARCHAR(20),
+    qty_available INTEGER DEFAULT 0,
+    qty_in_transit INTEGER DEFAULT 0,
+    qty_on_hand INTEGER DEFAULT 0,
+    qty_on_order INTEGER DEFAULT 0,
+    scraped_at TIMESTAMP NOT NULL,
+    run_id VARCHAR(32),
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (product_code, location_id)
+)
+"""
+
+CREATE_DELTA_TABLES_QUERY = """
+CREATE TABLE IF NOT EXISTS {changes} (
+    id BIGSERIAL PRIMARY KEY,
+    product_code VARCHAR(50) NOT NULL,
+    location_id VARCHAR(20) NOT NULL,
+    product_name TEXT,
+    location_name VARCHAR(100),
+    location_abbreviation VARCHAR(20),
+    qty_available INTEGER DEFAULT 0,
+    qty_in_transit INTEGER DEFAULT 0,
+    qty_on_hand INTEGER DEFAULT 0,
+    qty_on_order INTEGER DEFAULT 0,
+    scraped_at TIMESTAMP NOT NULL,
+    run_id VARCHAR(32),
+    UNIQUE (product_code, location_id, scraped_at)
+);
+
+CREATE TABLE IF NOT EXISTS {seen} (
+    product_code VARCHAR(50) PRIMARY KEY,
+    last_seen_at TIMESTAMP NOT NULL,
+    run_id VARCHAR(32),
+    scrape_status VARCHAR(20)
+);
+"""
+
+CREATE_DIMENSION_TABLES_QUERY = """
+CREATE TABLE IF NOT EXISTS {products} (
+    product_key SERIAL PRIMARY KEY,
+    product_code VARCHAR(50) NOT NULL UNIQUE,
+    product_name TEXT
+);
+
+CREATE TABLE IF NOT EXISTS {locations} (
+    location_key SMALLSERIAL PRIMARY KEY,
+    location_id VARCHAR(20) NOT NULL UNIQUE,
+    location_name VARCHAR(100),
+    location_abbreviation VARCHAR(20)
+);
+"""
+
+# The primary key doubles as the per-SKU history index
+CREATE_FACT_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS {fact} (
+    product_key INTEGER NOT NULL REFERENCES {products},
+    location_key SMALLINT NOT NULL REFERENCES {locations},
+    qty_available INTEGER NOT NULL DEFAULT 0,
+    qty_in_transit INTEGER NOT NULL DEFAULT 0,
+    qty_on_hand INTEGER NOT NULL DEFAULT 0,
+    qty_on_order INTEGER NOT NULL DEFAULT 0,
+    scraped_at TIMESTAMP NOT NULL,
+    PRIMARY KEY (product_key, location_key, scraped_at)
+) PARTITION BY RANGE (scraped_at)
+"""
+
+CREATE_FACT_VIEW_QUERY = """
+CREATE OR REPLACE VIEW {view} AS
+SELECT p.product_code, p.product_name, l.location_id, l.location_name, l.location_abbreviation,
+       f.qty_available, f.qty_in_transit, f.qty_on_hand, f.qty_on_order, f.scraped_at
+FROM {fact} f
+JOIN {products} p ON p.product_key = f.product_key
+JOIN {locations} l ON l.location_key = f.location_key
+"""
+
+CREATE_RUNS_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS {runs} (
+    run_id VARCHAR(32) PRIMARY KEY,
+    started_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    finished_at TIMESTAMP,
+    status VARCHAR(20) NOT NULL DEFAULT 'running',
+    storage_mode VARCHAR(20),
+    sku_count INTEGER DEFAULT 0,
+    products INTEGER DEFAULT 0,
+    success_count INTEGER DEFAULT 0,
+    error_count INTEGER DEFAULT 0,
+    location_rows INTEGER DEFAULT 0,
+    db_rows INTEGER DEFAULT 0,
+    reauth_count INTEGER DEFAULT 0,
+    active_seconds DOUBLE PRECISION DEFAULT 0,
+    products_per_sec DOUBLE PRECISION,
+    uploaded_rows INTEGER,
+    upload_seconds DOUBLE PRECISION,
+    uploaded_at TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_scrape_runs_started_at ON {runs}(started_at);
+"""
+
+CREATE_QUEUE_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS {queue} (
+    run_id VARCHAR(32) NOT NULL,
+    product_code VARCHAR(50) NOT NULL,
+    position INTEGER NOT NULL,
+    status VARCHAR(10) NOT NULL DEFAULT 'pending',
+    worker VARCHAR(100),
+    lease_until TIMESTAMP,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    scrape_status VARCHAR(20),
+    finished_at TIMESTAMP,
+    PRIMARY KEY (run_id, product_code)
+);
+
+CREATE INDEX IF NOT EXISTS idx_scrape_queue_open ON {queue}(run_id, position) WHERE status <> 'done';
+"""
+
+CURRENT_COLUMNS = [
+    'product_code', 'location_id', 'product_name', 'location_name', 'location_abbreviation',
+    'qty_available', 'qty_in_transit', 'qty_on_hand', 'qty_on_order', 'scraped_at', 'run_id'
+]
+
+# Older snapshots (a late upload of an earlier run) never overwrite newer ones
+UPSERT_CURRENT_CONFLICT = f"""
+ON CONFLICT (product_code, location_id) DO UPDATE SET
+    product_name = EXCLUDED.product_name,
+    location_name = EXCLUDED.location_name,
+    location_abbreviation = EXCLUDED.location_abbreviation,
+    qty_available = EXCLUDED.qty_available,
+    qty_in_transit = EXCLUDED.qty_in_transit,
+    qty_on_hand = EXCLUDED.qty_on_hand,
+    qty_on_order = EXCLUDED.qty_on_order,
+    scraped_at = EXCLUDED.scraped_at,
+    run_id = EXCLUDED.run_id,
+    updated_at = CURRENT_TIMESTAMP
+WHERE {CURRENT_TABLE_NAME}.scraped_at <= EXCLUDED.scraped_at
+"""
+
+UPSERT_CURRENT_QUERY = f"""
+INSERT INTO {CURRENT_TABLE_NAME} ({', '.join(CURRENT_COLUMNS)})
+VALUES %s
+{UPSERT_CURRENT_CONFLICT}
+"""
+
+COLUMNS = [
+    'product_code', 'product_name', 'location_name', 'location_abbreviation', 'location_id',
+    'qty_available', 'qty_in_transit', 'qty_on_hand', 'qty_on_order',
+    'scrape_status', 'error_message', 'scraped_at', 'uploaded_at', 'run_id'
+]
+
+PARTITION_UPPER_BOUND_RE = re.compile(r"TO \('([^']+)'\)")
+
+# (table, start date) of partitions known to exist, so per-batch checks cost nothing
+_ensured = set()
+
+def _as_date(moment):
+    return moment.date() if isinstance(moment, datetime) else moment
+
+def partition_bounds(moment, interval=None):
+    """(start, end) dates of the partition that holds `moment`"""
+    interval = interval or PARTITION_INTERVAL
+    day = _as_date(moment)
+    if interval == 'week':
+        start = day - timedelta(days=day.weekday())
+        return start, start + timedelta(days=7)
+    return day, day + timedelta(days=1)
+
+def partition_name(start, table=TABLE_NAME):
+    """Partition table name for a period starting on `start`"""
+    return f"{table}_p{start:%Y%m%d}"
+
+def ensure_partitions(conn, first, last=None, table=TABLE_NAME):
+    """Create any missing partitions of `table` covering first..last (datetimes or dates)"""
+    start, end = partition_bounds(first)
+    last_day = _as_date(last or first)
+    
+    with conn.cursor() as cur:
+        while start <= last_day:
+            if (table, start) not in _ensured:
+                cur.execute(sql.SQL(
+                    "CREATE TABLE IF NOT EXISTS {} PARTITION OF {} FOR VALUES FROM (%s) TO (%s)"
+                ).format(sql.Identifier(partition_name(start, table)), sql.Identifier(table)), (start, end))
+                _ensured.add((table, start))
+            start, end = partition_bounds(end)
+
+def reset_partition_cache():
+    """Forget which partitions exist (after a rollback may have undone a CREATE)"""
+    _ensured.clear()
+
+def _table_kind(cur):
+    """'p' for a partitioned table, 'r' for a plain one, None if missing"""
+    cur.execute("""
+        SELECT c.relkind FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE c.relname = %s AND n.nspname = current_schema()
+    """, (TABLE_NAME,))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+def _convert_plain_table(conn, cur):
+    """Move a pre-partitioning table's rows into the new partitioned table"""
+    legacy = f"{TABLE_NAME}_legacy"
+    print(f"  Converting '{TABLE_NAME}' to a partitioned table...")
+    cur.execute(sql.SQL("ALTER TABLE {} RENAME TO {}").format(sql.Identifier(TABLE_NAME), sql.Identifier(legacy)))
+    # Free the index and constraint names for the new table
+    cur.execute("SELECT indexrelid::regclass::text FROM pg_index WHERE indrelid = %s::regclass", (legacy,))
+    for number, (index,) in enumerate(cur.fetchall()):
+        cur.execute(sql.SQL("ALTER INDEX {} RENAME TO {}").format(
+            sql.Identifier(index), sql.Identifier(f"{legacy}_idx{number}")))
+    cur.execute(sql.SQL("ALTER SEQUENCE IF EXISTS {} RENAME TO {}").format(
+        sql.Identifier(f"{TABLE_NAME}_id_seq"), sql.Identifier(f"{legacy}_id_seq")))
+    cur.execute(sql.SQL("ALTER TABLE {} ADD COLUMN IF NOT EXISTS run_id VARCHAR(32)").format(sql.Identifier(legacy)))
+    cur.execute(sql.SQL(CREATE_TABLE_QUERY).format(table=sql.Identifier(TABLE_NAME)))
+    
+    # Old rows may lack scraped_at; they need one to land in a partition
+    scraped_at = sql.SQL("COALESCE(scraped_at, uploaded_at, CURRENT_TIMESTAMP)")
+    cur.execute(sql.SQL("SELECT DISTINCT ({0})::DATE FROM {1}").format(scraped_at, sql.Identifier(legacy)))
+    for (day,) in cur.fetchall():
+        ensure_partitions(conn, day)
+    
+    columns = sql.SQL(', ').join(sql.Identifier(column) for column in COLUMNS)
+    values = sql.SQL(', ').join(
+        scraped_at if column == 'scraped_at' else sql.Identifier(column) for column in COLUMNS
+    )
+    cur.execute(sql.SQL("INSERT INTO {} ({}) SELECT {} FROM {} ON CONFLICT DO NOTHING").format(
+        sql.Identifier(TABLE_NAME), columns, values, sql.Identifier(legacy)))
+    print(f"  ✓ Moved {cur.rowcount:,} rows into partitions")
+    cur.execute(sql.SQL("DROP TABLE {}").format(sql.Identifier(legacy)))
+
+def _migrate_baseline(conn, cur):
+    """Tables as they stood before versioned migrations (all idempotent)"""
+    kind = _table_kind(cur)
+    if kind == 'r':
+        _convert_plain_table(conn, cur)
+    elif kind is None:
+        cur.execute(sql.SQL(CREATE_TABLE_QUERY).format(table=sql.Identifier(TABLE_NAME)))
+    
+    cur.execute(sql.SQL(CREATE_INDEXES_QUERY).format(table=sql.Identifier(TABLE_NAME)))
+    cur.execute(sql.SQL(CREATE_CURRENT_TABLE_QUERY).format(table=sql.Identifier(CURRENT_TABLE_NAME)))
+    cur.execute(sql.SQL(CREATE_DELTA_TABLES_QUERY).format(
+        changes=sql.Identifier(CHANGES_TABLE_NAME), seen=sql.Identifier(SEEN_TABLE_NAME)))
+    
+    names = {
+        'products': sql.Identifier(PRODUCTS_TABLE_NAME),
+        'locations': sql.Identifier(LOCATIONS_TABLE_NAME),
+        'fact': sql.Identifier(FACT_TABLE_NAME),
+        'view': sql.Identifier(FACT_VIEW_NAME)
+    }
+    cur.execute(sql.SQL(CREATE_DIMENSION_TABLES_QUERY).format(**names))
+    cur.execute(sql.SQL(CREATE_FACT_TABLE_QUERY).format(**names))
+    cur.execute(sql.SQL(CREATE_FACT_VIEW_QUERY).format(**names))
+    cur.execute(sql.SQL(CREATE_RUNS_TABLE_QUERY).format(runs=sql.Identifier(RUNS_TABLE_NAME)))
+
+def _migrate_history_indexes(conn, cur):
+    """
+    Per-SKU history and time-range indexes.
+    
+    The (product_code, location_id, scraped_at) unique constraint becomes a
+    unique index with scraped_at descending, so the one index both enforces
+    uniqueness (and serves ON CONFLICT) and returns a SKU's newest rows
+    first. The single-column product_code B-tree is a prefix of it and goes;
+    the scraped_at B-tree is replaced by a BRIN index, which is tiny because
+    rows arrive in scraped_at order.
+    """
+    table = sql.Identifier(TABLE_NAME)
+    cur.execute(sql.SQL(
+        "CREATE UNIQUE INDEX IF NOT EXISTS {} ON {} (product_code, location_id, scraped_at DESC)"
+    ).format(sql.Identifier('idx_availability_sku_history'), table))
+    cur.execute("""
+        SELECT conname FROM pg_constraint
+        WHERE conrelid = %s::regclass AND contype = 'u'
+    """, (TABLE_NAME,))
+    for (constraint,) in cur.fetchall():
+        cur.execute(sql.SQL("ALTER TABLE {} DROP CONSTRAINT {}").format(table, sql.Identifier(constraint)))
+    cur.execute("DROP INDEX IF EXISTS idx_product_code, idx_scraped_at")
+    cur.execute(sql.SQL(
+        "CREATE INDEX IF NOT EXISTS {} ON {} USING BRIN (scraped_at)"
+    ).format(sql.Identifier('idx_availability_scraped_at_brin'), table))
+    cur.execute(sql.SQL(
+        "CREATE INDEX IF NOT EXISTS {} ON {} USING BRIN (scraped_at)"
+    ).format(sql.Identifier('idx_availability_fact_scraped_at_brin'), sql.Identifier(FACT_TABLE_NAME)))
+
+def _migrate_work_queue(conn, cur):
+    """Shared SKU queue for multi-worker runs"""
+    cur.execute(sql.SQL(CREATE_QUEUE_TABLE_QUERY).format(queue=sql.Identifier(QUEUE_TABLE_NAME)))
+
+def _migrate_location_id_not_null(conn, cur):
+    """
+    Rows without a location (errors, products with no stock locations) use
+    location_id '' instead of NULL.
+    
+    The uploader always staged them as '' while the live writer inserted
+    NULL, and NULL never conflicts, so every re-sent error row was inserted
+    again. Duplicates are removed (keeping the newest row), NULLs become ''
+    and the column is made NOT NULL so the key always collides.
+    """
+    table = sql.Identifier(TABLE_NAME)
+    cur.execute(sql.SQL("""
+        DELETE FROM {0} a USING {0} b
+        WHERE a.location_id IS NULL
+          AND a.product_code = b.product_code AND a.scraped_at = b.scraped_at
+          AND ((b.location_id IS NULL AND b.id > a.id) OR b.location_id = '')
+    """).format(table))
+    if cur.rowcount:
+        print(f"  ✓ Removed {cur.rowcount:,} duplicate rows without a location")
+    cur.execute(sql.SQL("UPDATE {} SET location_id = '' WHERE location_id IS NULL").format(table))
+    cur.execute(sql.SQL(
+        "ALTER TABLE {} ALTER COLUMN location_id SET DEFAULT '', ALTER COLUMN location_id SET NOT NULL"
+    ).format(table))
+
+def _migrate_backfill_current(conn, cur):
+    """
+    Fill airr_product_current from the history table for product-locations it
+    does not have yet.
+    
+    History written before airr_product_current existed never reached it, so
+    the first delta-mode run on such a database compared every location with
+    nothing and logged all of them as changes. Each missing product-location
+    gets its newest successful history row; rows already there are kept.
+    """
+    columns = sql.SQL(', ').join(map(sql.Identifier, CURRENT_COLUMNS))
+    cur.execute(sql.SQL("""
+        INSERT INTO {current} ({columns})
+        SELECT DISTINCT ON (product_code, location_id) {columns}
+        FROM {history}
+        WHERE scrape_status = 'success' AND location_id <> ''
+        ORDER BY product_code, location_id, scraped_at DESC
+        ON CONFLICT (product_code, location_id) DO NOTHING
+    """).format(current=sql.Identifier(CURRENT_TABLE_NAME), history=sql.Identifier(TABLE_NAME), columns=columns))
+    if cur.rowcount:
+        print(f"  ✓ Filled in {cur.rowcount:,} product-locations of {CURRENT_TABLE_NAME} from the history")
+
+# (version, description, function). Append new migrations; never change applied ones.
+MIGRATIONS = [
+    (1, 'baseline tables', _migrate_baseline),
+    (2, 'SKU history and BRIN scraped_at indexes', _migrate_history_indexes),
+    (3, 'scrape_queue work queue', _migrate_work_queue),
+    (4, "location_id '' instead of NULL for rows without a location", _migrate_location_id_not_null),
+    (5, 'airr_product_current filled in from the history', _migrate_backfill_current),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+CREATE_MIGRATIONS_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS {migrations} (
+    version INTEGER PRIMARY KEY,
+    description TEXT,
+    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+def schema_version(conn):
+    """Highest migration applied to the database (0 for none)"""
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass(%s)", (MIGRATIONS_TABLE_NAME,))
+        if cur.fetchone()[0] is None:
+            return 0
+        cur.execute(sql.SQL("SELECT COALESCE(MAX(version), 0) FROM {}").format(
+            sql.Identifier(MIGRATIONS_TABLE_NAME)))
+        return cur.fetchone()[0]
+
+def migrate(conn):
+    """
+    Apply every pending migration, in order, in one transaction. Returns the
+    versions applied. Commits.
+    """
+    applied = []
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_advisory_xact_lock(%s)", (SCHEMA_LOCK_ID,))
+        # Index builds on a big history can outlast the connection's statement timeout
+        cur.execute("SET LOCAL statement_timeout = 0")
+        cur.execute(sql.SQL(CREATE_MIGRATIONS_TABLE_QUERY).format(
+            migrations=sql.Identifier(MIGRATIONS_TABLE_NAME)))
+        # Another process may have migrated while we waited for the lock
+        current = schema_version(conn)
+        for version, description, apply in MIGRATIONS:
+            if version <= current:
+                continue
+            print(f"  Applying schema migration {version}: {description}")
+            apply(conn, cur)
+            cur.execute(sql.SQL("INSERT INTO {} (version, description) VALUES (%s, %s)").format(
+                sql.Identifier(MIGRATIONS_TABLE_NAME)), (version, description))
+            applied.append(version)
+    conn.commit()
+    reset_partition_cache()
+    return applied
+
+def ensure_schema(conn, now=None):
+    """
+    Bring the schema up to SCHEMA_VERSION and make sure partitions exist for
+    the current and next period. On an up-to-date database this is one
+    version lookup plus the partition checks. Commits.
+    """
+    now = now or datetime.now()
+    if schema_version(conn) < SCHEMA_VERSION:
+        migrate(conn)
+    reset_partition_cache()
+    for table in PARTITIONED_TABLES:
+        ensure_partitions(conn, now, partition_bounds(now)[1], table)
+    conn.commit()
+
+def list_partitions(conn, table=TABLE_NAME):
+    """(name, upper bound) of every partition of `table`, oldest first"""
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            JOIN pg_class p ON p.oid = i.inhparent
+            WHERE p.relname = %s
+            ORDER BY c.relname
+        """, (table,))
+        partitions = []
+        for name, bound in cur.fetchall():
+            match = PARTITION_UPPER_BOUND_RE.search(bound or '')
+            if match:
+                partitions.append((name, datetime.fromisoformat(match.group(1))))
+        return partitions
+
+def apply_retention(conn, keep_days=None, mode=None):
+    """
+    Detach (and, in 'drop' mode, drop) partitions whose whole period is older
+    than keep_days. Returns the names of the partitions removed. Commits.
+    """
+    keep_days = RETENTION_DAYS if keep_days is None else keep_days
+    mode = mode or RETENTION_MODE
+    cutoff = datetime.combine(date.today() - timedelta(days=keep_days), datetime.min.time())
+    
+    removed = []
+    with conn.cursor() as cur:
+        for table in PARTITIONED_TABLES:
+            for name, upper_bound in list_partitions(conn, table):
+                if upper_bound > cutoff:
+                    continue
+                cur.execute(sql.SQL("ALTER TABLE {} DETACH PARTITION {}").format(
+                    sql.Identifier(table), sql.Identifier(name)))
+                if mode == 'drop':
+                    cur.execute(sql.SQL("DROP TABLE {}").format(sql.Identifier(name)))
+                removed.append(name)
+    conn.commit()
+    reset_partition_cache()
+    return removed
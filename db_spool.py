@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Local spool for live database writes that could not be delivered.
+
+When the database is unreachable (at start-up or mid-run) the background
+writer appends each batch it cannot commit to a segment file under
+db_spool/ instead of dropping it: one JSON line per batch, flushed and
+fsynced, segments rolled at AIRR_SPOOL_SEGMENT_MB. Once a connection is
+back the writer replays the segments oldest first, in large batches, and
+deletes each segment after all of its rows have committed. Every write
+path is keyed on (product, location, scraped_at), so rows replayed twice
+after a crash mid-replay are absorbed rather than duplicated, and only rows
+actually written count towards db_rows of the run that scraped them.
+
+Run this file directly to drain a spool left behind by an earlier run.
+"""
+import os
+import json
+import time
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:
+    # No cross-process locking on Windows; only one scraper should share a spool there
+    fcntl = None
+
+SPOOL_DIR = os.getenv('AIRR_SPOOL_DIR', 'db_spool')
+SEGMENT_BYTES = int(float(os.getenv('AIRR_SPOOL_SEGMENT_MB', '16')) * 1024 * 1024)
+
+# Position of scraped_at in db_writer.product_rows tuples
+SCRAPED_AT_INDEX = 11
+
+def _encode(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+class DbSpool:
+    """Append-only segment files of product rows waiting for the database"""
+    
+    def __init__(self, directory=SPOOL_DIR, segment_bytes=SEGMENT_BYTES):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.file = None
+        self.path = None
+        self.rows_spooled = 0
+    
+    def segments(self):
+        """Segment files, oldest first"""
+        if not os.path.isdir(self.directory):
+            return []
+        names = sorted(name for name in os.listdir(self.directory)
+                       if name.startswith('segment-') and name.endswith('.jsonl'))
+        return [os.path.join(self.directory, name) for name in names]
+    
+    def pending(self):
+        """True if anything is waiting to be replayed"""
+        return bool(self.segments())
+    
+    def _open_segment(self):
+        os.makedirs(self.directory, exist_ok=True)
+        # Time-ordered names keep replay in spool order across processes
+        name = f"segment-{time.time_ns():020d}-{os.getpid()}.jsonl"
+        self.path = os.path.join(self.directory, name)
+        self.file = open(f"{self.path}.tmp", 'a', encoding='utf-8')
+        if fcntl:
+            # Held while appending, so another process's replay leaves this segment alone
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+        # Only visible to replay once locked
+        os.rename(f"{self.path}.tmp", self.path)
+    
+    def append(self, rows, csv_ranges=None, run_id=None):
+        """Durably add one batch of product rows"""
+        if self.file is None or self.file.tell() >= self.segment_bytes:
+            self.close()
+            self._open_segment()
+        self.file.write(json.dumps({
+            'run_id': run_id,
+            'csv_ranges': csv_ranges or [],
+            'rows': [[_encode(value) for value in row] for row in rows]
+        }) + '\n')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.rows_spooled += len(rows)
+    
+    def close(self):
+        """Finish the segment being appended to (the next append starts a new one)"""
+        if self.file:
+            self.file.close()
+            self.file = None
+            self.path = None
+    
+    def claim(self, path):
+        """
+        Open a segment for replay, or return None if another process is still
+        appending to it. The returned file holds the segment's lock.
+        """
+        try:
+            handle = open(path, 'r', encoding='utf-8')
+        except FileNotFoundError:
+            return None
+        if fcntl:
+            try:
+                fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                handle.close()
+                return None
+        return handle
+    
+    def read(self, handle):
+        """Batches of a claimed segment as (run_id, csv_ranges, rows); a torn last line is skipped"""
+        batches = []
+        for line in handle:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            rows = []
+            for row in record['rows']:
+                if row[SCRAPED_AT_INDEX]:
+                    row[SCRAPED_AT_INDEX] = datetime.fromisoformat(row[SCRAPED_AT_INDEX])
+                rows.append(tuple(row))
+            batches.append((record.get('run_id'), [tuple(r) for r in record.get('csv_ranges', [])], rows))
+        return batches
+    
+    def remove(self, path, handle):
+        """Delete a fully replayed segment and release it"""
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        handle.close()
+
+def main():
+    """Replay a spool left behind by an earlier run"""
+    from db_schema import ensure_schema, STORAGE_MODE
+    from db_connection import get_database, close_database
+    from db_writer import create_db_writer
+    
+    spool = DbSpool()
+    if not spool.pending():
+        print(f"Nothing to replay in {spool.directory}/")
+        return
+    database = get_database()
+    if not database:
+        print("✗ Database credentials not found - cannot replay the spool")
+        return
+    
+    conn = database.get_connection()
+    ensure_schema(conn)
+    print(f"Replaying {len(spool.segments())} spool segment(s) ({STORAGE_MODE} storage)...")
+    # The writer replays the spool as soon as it starts; closing it waits for that
+    writer = create_db_writer(conn, None, STORAGE_MODE, database=database, spool=spool)
+    writer.close()
+    close_database()
+    left = len(spool.segments())
+    print("✓ Spool drained" if not left else f"⚠️  {left} segment(s) still waiting")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,537 @@
+"""
+Background writer for the live database updates.
+
+Scrape loops hand finished products to a bounded queue and carry on; one
+thread drains it and inserts the rows of many products with a single
+multi-row INSERT and commit, once enough rows are waiting or the oldest has
+waited long enough. A full queue makes submit() wait, so a slow database
+throttles the scrape instead of filling memory. close() flushes whatever is
+left. The CSV remains the complete record - a batch that fails is retried
+one product at a time, and products that still fail are reported and
+skipped, as the old per-product upload did; the upload watermark (see
+upload_watermark) stops short of them so the post-scrape upload fills them in.
+Batches that fail only because the database is unreachable are spooled to
+disk and replayed once it is back (see db_spool).
+"""
+import os
+import time
+import queue
+import asyncio
+import threading
+from datetime import datetime
+from psycopg2.extras import execute_values
+from db_schema import ensure_schema, ensure_partitions, reset_partition_cache, UPSERT_CURRENT_QUERY, FACT_TABLE_NAME
+from delta_store import INSERT_CHANGES_QUERY, UPSERT_SEEN_QUERY, seen_rows, DeltaTracker
+from dimensions import INSERT_FACT_QUERY, located_rows, DimensionCache
+from db_connection import connection_lost
+from run_log import credit_rows
+
+INSERT_QUERY = """
+INSERT INTO airr_product_availability 
+(product_code, product_name, location_name, location_abbreviation, location_id,
+ qty_available, qty_in_transit, qty_on_hand, qty_on_order,
+ scrape_status, error_message, scraped_at, run_id)
+VALUES %s
+ON CONFLICT (product_code, location_id, scraped_at) DO NOTHING
+"""
+
+# Position of run_id in product_rows tuples
+RUN_ID_INDEX = 12
+
+def quantity(value):
+    """A stock quantity as an int, truncated like the uploader does; 0 if it is not a number"""
+    try:
+        return int(float(value)) if value else 0
+    except (TypeError, ValueError, OverflowError):
+        return 0
+
+def product_rows(product_data):
+    """Database rows for one product, one per warehouse location"""
+    scraped_at = product_data.get('scraped_at') or datetime.now()
+    run_id = product_data.get('run_id')
+    
+    # No locations - insert single row. location_id is '' (as the uploader
+    # stages it), not NULL, so the row has the same key on every path.
+    if not product_data['availability_locations']:
+        return [(
+            product_data['product_code'],
+            product_data['product_name'],
+            None, None, '', None, None, None, None,
+            product_data['scrape_status'],
+            product_data.get('error_message'),
+            scraped_at,
+            run_id
+        )]
+    
+    return [(
+        product_data['product_code'],
+        product_data['product_name'],
+        location.get('location_name'),
+        location.get('location_abbreviation'),
+        location.get('location_id') or '',
+        quantity(location.get('qty_available')),
+        quantity(location.get('qty_in_transit')),
+        quantity(location.get('qty_on_hand')),
+        quantity(location.get('qty_on_order')),
+        product_data['scrape_status'],
+        product_data.get('error_message'),
+        scraped_at,
+        run_id
+    ) for location in product_data['availability_locations']]
+
+def batch_rows(items):
+    """All rows and CSV ranges of a list of (rows, csv_range) items"""
+    rows = [row for item_rows, _ in items for row in item_rows]
+    csv_ranges = [csv_range for _, csv_range in items if csv_range]
+    return rows, csv_ranges
+
+def product_codes(items):
+    """Product codes of a list of (rows, csv_range) items, for error messages"""
+    return [item_rows[0][0] for item_rows, _ in items if item_rows]
+
+def current_rows(rows):
+    """
+    Rows for airr_product_current from product rows: successful locations
+    only, the newest per (product_code, location_id).
+    """
+    latest = {}
+    for row in rows:
+        code, name, location_name, abbreviation, location_id = row[:5]
+        if row[9] != 'success' or not location_id:
+            continue
+        key = (code, location_id)
+        if key not in latest or latest[key][9] <= row[11]:
+            latest[key] = (code, location_id, name, location_name, abbreviation,
+                           row[5], row[6], row[7], row[8], row[11], row[12])
+    return list(latest.values())
+
+class BackgroundDbWriter:
+    """
+    Group-commits product rows to airr_product_availability from a worker thread.
+    
+    With a delta_store.DeltaTracker as `delta`, only changed rows are written
+    (to the change log) plus a last-seen heartbeat per product. With a
+    dimensions.DimensionCache as `dimensions`, history goes to the compact
+    airr_availability_fact table instead. With a run_log.RunLog as `run_log`,
+    every commit also brings the run's scrape_runs row up to date. Given the
+    db_connection.Database the connection came from, a batch that fails
+    because the connection dropped is retried on a new one.
+    
+    With a db_spool.DbSpool as `spool`, batches that cannot reach the
+    database (no connection at start, or a reconnect that fails) are spooled
+    to disk; the writer keeps trying to connect every `retry_interval`
+    seconds and replays the spool before writing anything new.
+    """
+    
+    _STOP = object()
+    
+    def __init__(self, db_conn, batch_rows=500, flush_interval=2.0, max_pending=200, watermark=None, delta=None,
+                 dimensions=None, run_log=None, database=None, reconnect_attempts=3, spool=None,
+                 retry_interval=30.0, replay_batch_rows=5000):
+        self.db_conn = db_conn
+        self.watermark = watermark
+        self.delta = delta
+        self.dimensions = dimensions
+        self.run_log = run_log
+        # A db_connection.Database to get a new connection from if this one drops
+        self.database = database
+        self.reconnect_attempts = reconnect_attempts
+        self.spool = spool if database else None
+        self.retry_interval = retry_interval
+        self.replay_batch_rows = replay_batch_rows
+        self.next_connect = 0.0
+        self.batch_rows = batch_rows
+        self.flush_interval = flush_interval
+        # Bounded in products; submit() blocks once this many are waiting
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.rows_written = 0
+        self.rows_failed = 0
+        self.rows_replayed = 0
+        self.commits = 0
+        self.thread = None
+        if db_conn:
+            self._prepare(db_conn)
+        if db_conn or self.spool:
+            self.thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+            self.thread.start()
+    
+    def _prepare(self, conn):
+        """Per-run setup that needs the database: run row, last known stock, dimension keys"""
+        if self.run_log and not self.run_log.started:
+            try:
+                self.run_log.start(conn)
+            except Exception as e:
+                conn.rollback()
+                print(f"⚠️  Could not record the run in scrape_runs ({e})")
+        if self.delta and not self.delta.loaded:
+            try:
+                self.delta.load(conn)
+            except Exception as e:
+                conn.rollback()
+                print(f"⚠️  Could not load last known stock ({e}) - every row counts as changed")
+        if self.dimensions and not self.dimensions.loaded:
+            try:
+                self.dimensions.load(conn)
+            except Exception as e:
+                conn.rollback()
+                print(f"⚠️  Could not load product/location keys ({e}) - they will be looked up as needed")
+    
+    def submit(self, product_data, csv_end=None, block=True):
+        """
+        Queue one product's rows. csv_end is where the product's rows end in the
+        CSV (for the watermark). Returns False only if block=False and the queue
+        is full; without a database this is a no-op.
+        """
+        thread = self.thread
+        if not thread:
+            return True
+        try:
+            rows = product_rows(product_data)
+        except Exception as e:
+            # Only this product is lost to the live update; the CSV still has it
+            self.rows_failed += 1
+            print(f"    ⚠️  Database upload skipped for {product_data.get('product_code')}: {e}")
+            return True
+        while True:
+            try:
+                self.queue.put((rows, csv_end), block=block, timeout=1.0 if block else None)
+                return True
+            except queue.Full:
+                if not block:
+                    return False
+                # A writer thread that died would never make room again
+                if not thread.is_alive():
+                    self.rows_failed += len(rows)
+                    return True
+    
+    async def submit_async(self, product_data, csv_end=None):
+        """submit() for the async engine: waits for queue space off the event loop"""
+        if not self.submit(product_data, csv_end, block=False):
+            await asyncio.to_thread(self.submit, product_data, csv_end)
+    
+    def _write_history(self, cur, rows):
+        # A run that crosses midnight needs the next day's partition
+        scraped = [row[11] for row in rows]
+        ensure_partitions(self.db_conn, min(scraped), max(scraped))
+        execute_values(cur, INSERT_QUERY, rows, page_size=len(rows))
+        # Rows that were already there (a resend) are not counted
+        written = cur.rowcount
+        current = current_rows(rows)
+        if current:
+            execute_values(cur, UPSERT_CURRENT_QUERY, current, page_size=len(current))
+        return written, []
+    
+    def _write_delta(self, cur, rows):
+        changes = self.delta.changes(current_rows(rows), rows)
+        written = 0
+        if changes:
+            execute_values(cur, INSERT_CHANGES_QUERY, changes, page_size=len(changes))
+            written = cur.rowcount
+            execute_values(cur, UPSERT_CURRENT_QUERY, changes, page_size=len(changes))
+        seen = seen_rows(rows)
+        execute_values(cur, UPSERT_SEEN_QUERY, seen, page_size=len(seen))
+        return written, changes
+    
+    def _write_normalized(self, cur, rows):
+        located = located_rows(rows)
+        if not located:
+            return 0, []
+        # Commits any new dimension rows before the facts refer to them
+        self.dimensions.resolve(self.db_conn, located)
+        facts = self.dimensions.fact_rows(located)
+        scraped = [row[6] for row in facts]
+        ensure_partitions(self.db_conn, min(scraped), max(scraped), FACT_TABLE_NAME)
+        execute_values(cur, INSERT_FACT_QUERY, facts, page_size=len(facts))
+        written = cur.rowcount
+        current = current_rows(located)
+        execute_values(cur, UPSERT_CURRENT_QUERY, current, page_size=len(current))
+        return written, []
+    
+    def _commit_batch(self, rows, replayed=False):
+        """
+        Write and commit one batch; returns the rows actually written. New rows
+        count towards this run's scrape_runs row; replayed ones (all from one
+        run) towards the run in their run_id column.
+        """
+        run_totals = None
+        with self.db_conn.cursor() as cur:
+            if self.delta:
+                written, changes = self._write_delta(cur, rows)
+            elif self.dimensions:
+                written, changes = self._write_normalized(cur, rows)
+            else:
+                written, changes = self._write_history(cur, rows)
+            if replayed:
+                credit_rows(cur, rows[0][RUN_ID_INDEX], written)
+            elif self.run_log:
+                run_totals = self.run_log.push(cur, written)
+        self.db_conn.commit()
+        if run_totals:
+            self.run_log.pushed(run_totals)
+        if self.delta:
+            self.delta.commit(changes)
+        return written
+    
+    def _connect(self):
+        """Try (at most every retry_interval) to get a connection back after an outage"""
+        if time.monotonic() < self.next_connect:
+            return False
+        try:
+            conn = self.database.get_connection(attempts=1)
+        except Exception:
+            self.next_connect = time.monotonic() + self.retry_interval
+            return False
+        try:
+            ensure_schema(conn)
+        except Exception as e:
+            print(f"    ⚠️  Database reachable but not ready ({e})")
+            self.database.release(conn)
+            self.next_connect = time.monotonic() + self.retry_interval
+            return False
+        print("    🔌 Database connection established")
+        self.db_conn = conn
+        self._prepare(conn)
+        return True
+    
+    def _spool_batch(self, rows, csv_ranges):
+        self.spool.append(rows, csv_ranges, self.watermark.run_id if self.watermark else None)
+        print(f"    📼 Database unreachable - spooled {len(rows)} rows to {self.spool.directory}/")
+    
+    def _replay(self):
+        """
+        Write spooled batches, oldest segment first, in replay_batch_rows
+        batches. Returns False if the connection failed along the way.
+        """
+        self.spool.close()
+        for path in self.spool.segments():
+            handle = self.spool.claim(path)
+            if handle is None:
+                continue
+            try:
+                batches = self.spool.read(handle)
+                pending = []
+                pending_ranges = []
+                for index, (run_id, csv_ranges, rows) in enumerate(batches):
+                    pending.extend(rows)
+                    # Ranges only mean something to the watermark of the same run
+                    if self.watermark and run_id == self.watermark.run_id:
+                        pending_ranges.extend(csv_ranges)
+                    # Each commit holds rows of a single run, so they are credited to it
+                    last = index == len(batches) - 1
+                    if last or len(pending) >= self.replay_batch_rows or batches[index + 1][0] != run_id:
+                        self.rows_replayed += self._commit_batch(pending, replayed=True)
+                        if self.watermark:
+                            for start, end in pending_ranges:
+                                self.watermark.committed(start, end)
+                        pending = []
+                        pending_ranges = []
+            except Exception as e:
+                handle.close()
+                try:
+                    self.db_conn.rollback()
+                except Exception:
+                    pass
+                reset_partition_cache()
+                print(f"    ⚠️  Spool replay stopped at {os.path.basename(path)}: {e}")
+                if connection_lost(self.db_conn, e):
+                    self._drop_connection()
+                return False
+            self.spool.remove(path, handle)
+            print(f"    📼 Replayed {len(batches)} spooled batches from {os.path.basename(path)}")
+        return True
+    
+    def _drop_connection(self):
+        self.database.release(self.db_conn)
+        self.db_conn = None
+        self.next_connect = time.monotonic() + self.retry_interval
+    
+    def _write(self, items):
+        """Write one group-commit batch of (rows, csv_range) items, one per product"""
+        rows, csv_ranges = batch_rows(items)
+        products = len(items)
+        # No connection: the last reconnect failed, or the database was down from the start
+        if self.db_conn is None and not self._connect():
+            if self.spool:
+                self._spool_batch(rows, csv_ranges)
+            else:
+                self.rows_failed += len(rows)
+                print(f"    ⚠️  Database unreachable - {len(rows)} rows not uploaded")
+            return
+        if self.spool:
+            if self.spool.pending() and not self._replay():
+                self._spool_batch(rows, csv_ranges)
+                return
+        
+        attempts = self.reconnect_attempts + 1 if self.database else 1
+        for attempt in range(1, attempts + 1):
+            try:
+                written = self._commit_batch(rows)
+                break
+            except Exception as e:
+                try:
+                    self.db_conn.rollback()
+                except Exception:
+                    pass
+                reset_partition_cache()
+                lost = connection_lost(self.db_conn, e)
+                # A dropped connection is replaced and the batch retried (the writes are idempotent)
+                if attempt < attempts and lost:
+                    print(f"    🔌 Database connection lost ({str(e).strip()}) - reconnecting...")
+                    # reconnect() releases the old connection even if it fails
+                    lost_conn, self.db_conn = self.db_conn, None
+                    try:
+                        # With a spool to fall back on, don't hold up the scrape with long backoffs
+                        self.db_conn = self.database.reconnect(lost_conn, attempts=1 if self.spool else None)
+                        continue
+                    except Exception as reconnect_error:
+                        e = reconnect_error
+                        self.next_connect = time.monotonic() + self.retry_interval
+                if lost and self.spool:
+                    if self.db_conn is not None:
+                        self._drop_connection()
+                    self._spool_batch(rows, csv_ranges)
+                    return
+                if not lost and products > 1:
+                    # Most likely one bad product: don't let it take the rest of the batch down
+                    print(f"    ⚠️  Database upload failed for {len(rows)} rows ({str(e).strip()}) - retrying product by product")
+                    self._write_each(items)
+                    return
+                # Don't fail the scrape if database upload fails
+                self.rows_failed += len(rows)
+                print(f"    ⚠️  Database upload failed for {len(rows)} rows of "
+                      f"{', '.join(product_codes(items))}: {str(e).strip()}")
+                return
+        
+        self.rows_written += written
+        self.commits += 1
+        if self.delta:
+            print(f"    💾 Pushed {written} changed of {len(rows)} rows ({products} products) to database")
+        elif self.dimensions:
+            print(f"    💾 Pushed {written} fact rows ({products} products) to database")
+        else:
+            print(f"    💾 Pushed {written} rows ({products} products) to database")
+        if self.watermark:
+            for start, end in csv_ranges:
+                self.watermark.committed(start, end)
+    
+    def _write_each(self, items):
+        """Commit a batch that failed as a whole one product at a time"""
+        pushed = 0
+        for index, (rows, csv_range) in enumerate(items):
+            try:
+                written = self._commit_batch(rows)
+            except Exception as e:
+                try:
+                    self.db_conn.rollback()
+                except Exception:
+                    pass
+                reset_partition_cache()
+                if connection_lost(self.db_conn, e):
+                    rest_rows, rest_ranges = batch_rows(items[index:])
+                    if self.spool:
+                        self._drop_connection()
+                        self._spool_batch(rest_rows, rest_ranges)
+                    else:
+                        self.rows_failed += len(rest_rows)
+                        print(f"    ⚠️  Database connection lost - {len(rest_rows)} rows of "
+                              f"{', '.join(product_codes(items[index:]))} not uploaded")
+                    break
+                self.rows_failed += len(rows)
+                print(f"    ⚠️  Database upload failed for {rows[0][0]}: {str(e).strip()}")
+                continue
+            pushed += 1
+            self.rows_written += written
+            self.commits += 1
+            if self.watermark and csv_range:
+                self.watermark.committed(*csv_range)
+        print(f"    💾 Pushed {pushed} of {len(items)} products to database one by one")
+    
+    def _run(self):
+        # Leftovers from an earlier run go in before anything new
+        if self.spool and self.db_conn and self.spool.pending():
+            try:
+                self._replay()
+            except Exception as e:
+                print(f"    ⚠️  Spool replay failed: {e}")
+        
+        items = []
+        pending_rows = 0
+        deadline = None
+        stopping = False
+        while not stopping:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self.queue.get(timeout=timeout)
+                if item is self._STOP:
+                    stopping = True
+                else:
+                    item_rows, csv_end = item
+                    csv_range = (csv_end - len(item_rows), csv_end) if csv_end is not None else None
+                    items.append((item_rows, csv_range))
+                    pending_rows += len(item_rows)
+                    if deadline is None:
+                        deadline = time.monotonic() + self.flush_interval
+            except queue.Empty:
+                pass
+            
+            if items and (stopping or pending_rows >= self.batch_rows or time.monotonic() >= deadline):
+                try:
+                    self._write(items)
+                except Exception as e:
+                    # Keep draining the queue, or submit() and close() would wait forever
+                    self.rows_failed += pending_rows
+                    print(f"    ⚠️  Database writer error - {pending_rows} rows not uploaded: {str(e).strip()}")
+                items = []
+                pending_rows = 0
+                deadline = None
+    
+    def close(self, completed=False, failed=False):
+        """
+        Flush everything still queued and stop the writer thread; then mark the
+        run completed, failed (it gave up) or interrupted in scrape_runs.
+        """
+        if not self.thread:
+            return
+        # If the writer thread died, nothing would ever take the stop marker
+        while self.thread.is_alive():
+            try:
+                self.queue.put(self._STOP, timeout=1.0)
+                break
+            except queue.Full:
+                continue
+        else:
+            self.rows_failed += sum(len(item[0]) for item in list(self.queue.queue) if item is not self._STOP)
+            print("⚠️  Database writer stopped early - the rest of the run was not uploaded live")
+        self.thread.join()
+        self.thread = None
+        if self.spool:
+            self.spool.close()
+        if self.run_log and self.db_conn:
+            try:
+                self.run_log.finish(self.db_conn, completed, failed)
+            except Exception as e:
+                print(f"⚠️  Could not update run totals: {e}")
+                try:
+                    self.db_conn.rollback()
+                except Exception:
+                    pass
+        if self.database and self.db_conn:
+            self.database.release(self.db_conn)
+        if self.rows_written or self.rows_failed or self.rows_replayed:
+            print(f"✓ Database writer: {self.rows_written} rows in {self.commits} commits"
+                  + (f", {self.rows_replayed} replayed from the spool" if self.rows_replayed else "")
+                  + (f", {self.rows_failed} rows failed" if self.rows_failed else ""))
+        if self.spool and self.spool.pending():
+            print(f"⚠️  {self.spool.rows_spooled} rows left in {self.spool.directory}/ - they are replayed "
+                  f"on the next run (or with: python db_spool.py)")
+
+def create_db_writer(db_conn, watermark, storage_mode, run_log=None, database=None, spool=None):
+    """
+    Background writer for live updates; in delta mode it only writes changed
+    stock, in normalized mode compact fact rows keyed through a DimensionCache.
+    It also keeps the run's scrape_runs row current through run_log.
+    """
+    delta = DeltaTracker() if storage_mode == 'delta' else None
+    dimensions = DimensionCache() if storage_mode == 'normalized' else None
+    return BackgroundDbWriter(db_conn, watermark=watermark, delta=delta, dimensions=dimensions, run_log=run_log,
+                              database=database, spool=spool)
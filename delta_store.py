@@ -0,0 +1,111 @@
+"""
+Change-only storage (AIRR_STORAGE_MODE=delta).
+
+Most product-locations report the same four quantities run after run, so in
+delta mode the history table is not written at all. Instead each scraped
+location is compared with the last known quantities (loaded once per run
+from airr_product_current into a dict) and only rows that differ go to the
+airr_product_changes log; airr_product_last_seen gets one cheap heartbeat
+row per product. A location that a successfully scraped product no longer
+reports is logged once as a change to zero stock. The state at any time T is
+the newest change at or before T for each product-location (see
+DATABASE_SETUP.md).
+"""
+from db_schema import CHANGES_TABLE_NAME, SEEN_TABLE_NAME, CURRENT_TABLE_NAME, CURRENT_COLUMNS
+
+INSERT_CHANGES_QUERY = f"""
+INSERT INTO {CHANGES_TABLE_NAME} ({', '.join(CURRENT_COLUMNS)})
+VALUES %s
+ON CONFLICT (product_code, location_id, scraped_at) DO NOTHING
+"""
+
+UPSERT_SEEN_QUERY = f"""
+INSERT INTO {SEEN_TABLE_NAME} (product_code, last_seen_at, run_id, scrape_status)
+VALUES %s
+ON CONFLICT (product_code) DO UPDATE SET
+    last_seen_at = EXCLUDED.last_seen_at,
+    run_id = EXCLUDED.run_id,
+    scrape_status = EXCLUDED.scrape_status
+WHERE {SEEN_TABLE_NAME}.last_seen_at <= EXCLUDED.last_seen_at
+"""
+
+def seen_rows(rows):
+    """One heartbeat row per product (newest wins) from product rows"""
+    latest = {}
+    for row in rows:
+        code, status, scraped_at, run_id = row[0], row[9], row[11], row[12]
+        if code not in latest or latest[code][1] <= scraped_at:
+            latest[code] = (code, scraped_at, run_id, status)
+    return list(latest.values())
+
+NO_STOCK = (0, 0, 0, 0)
+
+class DeltaTracker:
+    """Last known quantities per (product_code, location_id) for the current run"""
+    
+    def __init__(self):
+        self.last = {}
+        # Known location ids per product, to notice the ones that disappear
+        self.locations = {}
+        # (location_name, location_abbreviation) per location_id, for the rows of vanished locations
+        self.location_names = {}
+        self.loaded = False
+    
+    def load(self, conn):
+        """Seed the map from airr_product_current"""
+        with conn.cursor() as cur:
+            cur.execute(f"""
+                SELECT product_code, location_id, qty_available, qty_in_transit, qty_on_hand, qty_on_order,
+                       location_name, location_abbreviation
+                FROM {CURRENT_TABLE_NAME}
+            """)
+            self.last = {}
+            self.locations = {}
+            for row in cur:
+                self.last[(row[0], row[1])] = tuple(row[2:6])
+                self.locations.setdefault(row[0], set()).add(row[1])
+                if row[6] is not None:
+                    self.location_names[row[1]] = (row[6], row[7])
+        self.loaded = True
+        print(f"✓ Delta mode: loaded last known stock for {len(self.last):,} product-locations")
+        return len(self.last)
+    
+    def changes(self, current, rows=()):
+        """
+        Rows (in airr_product_current shape) whose quantities differ from the
+        last known ones, plus a zero-stock row for each known location that a
+        successfully scraped product in `rows` (product rows) no longer reports
+        """
+        changed = [row for row in current if self.last.get((row[0], row[1])) != tuple(row[5:9])]
+        return changed + self.gone(rows)
+    
+    def gone(self, rows):
+        """Zero-stock rows for the known locations missing from successfully scraped products"""
+        # Newest successful row and reported location ids per product
+        reported = {}
+        for row in rows:
+            if row[9] != 'success':
+                continue
+            newest, location_ids = reported.get(row[0], (None, None))
+            if newest is None or newest[11] < row[11]:
+                reported[row[0]] = (row, {row[4]})
+            elif newest[11] == row[11]:
+                location_ids.add(row[4])
+        
+        gone = []
+        for code, (newest, location_ids) in reported.items():
+            for location_id in self.locations.get(code, ()):
+                if location_id in location_ids or self.last.get((code, location_id)) == NO_STOCK:
+                    continue
+                location_name, abbreviation = self.location_names.get(location_id, (None, None))
+                gone.append((code, location_id, newest[1], location_name, abbreviation,
+                             *NO_STOCK, newest[11], newest[12]))
+        return gone
+    
+    def commit(self, changes):
+        """Remember changes once they are safely in the database"""
+        for row in changes:
+            self.last[(row[0], row[1])] = tuple(row[5:9])
+            self.locations.setdefault(row[0], set()).add(row[1])
+            if row[3] is not None:
+                self.location_names[row[1]] = (row[3], row[4])
@@ -0,0 +1,114 @@
+"""
+Normalized storage (AIRR_STORAGE_MODE=normalized).
+
+The history table repeats the product name and three location strings on
+every row of every run. In normalized mode each product and location is
+stored once, in airr_products and airr_locations, and a history row in
+airr_availability_fact is just their integer keys, the four quantities and
+scraped_at - a fraction of the width, with a primary key index to match.
+
+The live writer resolves codes to keys through DimensionCache: the
+dimension tables are loaded once per run, so a key lookup is a dict hit
+and only products or locations never seen before (or renamed) touch the
+database. The uploader does the same resolution set-based, by joining the
+staging table to the dimension tables.
+"""
+from psycopg2.extras import execute_values
+from db_schema import PRODUCTS_TABLE_NAME, LOCATIONS_TABLE_NAME, FACT_TABLE_NAME
+
+UPSERT_PRODUCTS_QUERY = f"""
+INSERT INTO {PRODUCTS_TABLE_NAME} (product_code, product_name)
+VALUES %s
+ON CONFLICT (product_code) DO UPDATE SET product_name = EXCLUDED.product_name
+RETURNING product_key, product_code, product_name
+"""
+
+UPSERT_LOCATIONS_QUERY = f"""
+INSERT INTO {LOCATIONS_TABLE_NAME} (location_id, location_name, location_abbreviation)
+VALUES %s
+ON CONFLICT (location_id) DO UPDATE SET
+    location_name = EXCLUDED.location_name,
+    location_abbreviation = EXCLUDED.location_abbreviation
+RETURNING location_key, location_id, location_name, location_abbreviation
+"""
+
+INSERT_FACT_QUERY = f"""
+INSERT INTO {FACT_TABLE_NAME}
+(product_key, location_key, qty_available, qty_in_transit, qty_on_hand, qty_on_order, scraped_at)
+VALUES %s
+ON CONFLICT (product_key, location_key, scraped_at) DO NOTHING
+"""
+
+def located_rows(rows):
+    """Successful product rows that have a warehouse location (the ones with stock to keep)"""
+    return [row for row in rows if row[9] == 'success' and row[4]]
+
+class DimensionCache:
+    """Product and location keys by code, kept in step with the dimension tables"""
+    
+    def __init__(self):
+        # product_code -> (product_key, product_name)
+        self.products = {}
+        # location_id -> (location_key, location_name, location_abbreviation)
+        self.locations = {}
+        self.loaded = False
+    
+    def load(self, conn):
+        """Seed the cache with every known product and location"""
+        with conn.cursor() as cur:
+            cur.execute(f"SELECT product_code, product_key, product_name FROM {PRODUCTS_TABLE_NAME}")
+            self.products = {row[0]: (row[1], row[2]) for row in cur}
+            cur.execute(f"""
+                SELECT location_id, location_key, location_name, location_abbreviation
+                FROM {LOCATIONS_TABLE_NAME}
+            """)
+            self.locations = {row[0]: tuple(row[1:]) for row in cur}
+        self.loaded = True
+        print(f"✓ Normalized mode: {len(self.products):,} products and "
+              f"{len(self.locations):,} locations cached")
+    
+    def resolve(self, conn, rows):
+        """
+        Make sure every product and location in `rows` (product rows) has a key.
+        New or renamed ones are upserted and committed on their own, so a key
+        is only cached once it is durable. Returns how many were upserted.
+        """
+        products = {}
+        locations = {}
+        for row in rows:
+            code, name, location_name, abbreviation, location_id = row[:5]
+            cached = self.products.get(code)
+            if cached is None or cached[1] != name:
+                products[code] = (code, name)
+            cached = self.locations.get(location_id)
+            if cached is None or cached[1:] != (location_name, abbreviation):
+                locations[location_id] = (location_id, location_name, abbreviation)
+        
+        if not products and not locations:
+            return 0
+        
+        with conn.cursor() as cur:
+            new_products = []
+            new_locations = []
+            if products:
+                new_products = execute_values(cur, UPSERT_PRODUCTS_QUERY, list(products.values()),
+                                              page_size=len(products), fetch=True)
+            if locations:
+                new_locations = execute_values(cur, UPSERT_LOCATIONS_QUERY, list(locations.values()),
+                                               page_size=len(locations), fetch=True)
+        conn.commit()
+        
+        for key, code, name in new_products:
+            self.products[code] = (key, name)
+        for key, location_id, location_name, abbreviation in new_locations:
+            self.locations[location_id] = (key, location_name, abbreviation)
+        return len(products) + len(locations)
+    
+    def fact_rows(self, rows):
+        """airr_availability_fact rows for already resolved product rows"""
+        return [(
+            self.products[row[0]][0],
+            self.locations[row[4]][0],
+            row[5], row[6], row[7], row[8],
+            row[11]
+        ) for row in rows]
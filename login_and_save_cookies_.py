@@ -5,6 +5,7 @@ import sys
 from pathlib import Path
 from playwright.sync_api import sync_playwright
 from dotenv import load_dotenv
+from airr_auth import is_login_request, build_login_capture, parse_token
 
 # Load environment variables from .env file in script directory
 env_path = Path(__file__).parent / '.env'
@@ -97,10 +98,16 @@ def login_and_save_cookies():
             password_field = page.locator('input[type="password"]').first
             password_field.fill(PASSWORD)
             
-            # Click login button
+            # Click login button, recording the login XHR so the scraper can replay it
             print("Clicking login button...")
             login_button = page.locator('button[type="submit"], input[type="submit"], button:has-text("Login"), button:has-text("Sign in")').first
-            login_button.click()
+            login_response = None
+            try:
+                with page.expect_response(lambda r: is_login_request(r.request, USERNAME), timeout=15000) as response_info:
+                    login_button.click()
+                login_response = response_info.value
+            except Exception:
+                print("⚠️  Login request not observed - the scraper will use the login form")
             
             # Wait for navigation after login
             print("Waiting for login to complete...")
@@ -135,12 +142,25 @@ def login_and_save_cookies():
             # Get sessionStorage data as well
             session_storage = page.evaluate('() => Object.assign({}, window.sessionStorage)')
             
+            # Template of the login request (credentials replaced by placeholders)
+            login_request = None
+            if login_response and local_storage.get('token'):
+                try:
+                    request = login_response.request
+                    token_raw = local_storage['token']
+                    login_request = build_login_capture(request.url, request.headers, request.post_data or '',
+                                                        login_response.json(), parse_token(token_raw), token_raw,
+                                                        USERNAME, PASSWORD)
+                except Exception as e:
+                    print(f"⚠️  Could not capture login request: {e}")
+            
             # Save all authentication data to a JSON file
             auth_data = {
                 'cookies': cookies,
                 'localStorage': local_storage,
                 'sessionStorage': session_storage,
-                'url': current_url
+                'url': current_url,
+                'loginRequest': login_request
             }
             
             auth_file = 'cookies.json'
@@ -152,6 +172,7 @@ def login_and_save_cookies():
             print(f"  - Cookies: {len(cookies)}")
             print(f"  - localStorage items: {len(local_storage)}")
             print(f"  - sessionStorage items: {len(session_storage)}")
+            print(f"  - Login request captured: {'yes' if login_request else 'no'}")
             
             if local_storage:
                 print(f"\nlocalStorage keys: {', '.join(local_storage.keys())}")
@@ -0,0 +1,111 @@
+"""
+Adaptive request pacing for the AIRR search API.
+
+AIMD (additive increase, multiplicative decrease): while responses come back
+healthy the request rate creeps up by about `increase` requests/sec every
+second; a 429, a 5xx, a network error or a latency spike cuts it by
+`decrease`. Until the first cut the rate grows exponentially (slow start, as
+in TCP) so a healthy run reaches its ceiling within seconds. Works for the
+sequential loop (acquire) and for the concurrent engine (acquire_async),
+which shares one limiter across all workers.
+"""
+import re
+import time
+import asyncio
+
+HTTP_STATUS_RE = re.compile(r'^HTTP (\d{3})\b')
+
+def http_status(product_data):
+    """HTTP status of a failed scrape from its error message, or None"""
+    match = HTTP_STATUS_RE.match(str(product_data.get('error_message') or ''))
+    return int(match.group(1)) if match else None
+
+class AimdRateLimiter:
+    """Paces request starts and adapts the pace to how the API is coping"""
+    
+    def __init__(self, initial_rate=2.0, min_rate=0.2, max_rate=20.0, increase=0.5, decrease=0.5,
+                 spike_factor=3.0, cooldown=1.0):
+        self.rate = initial_rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.spike_factor = spike_factor
+        self.cooldown = cooldown
+        self.latency_baseline = None
+        self.latency_samples = 0
+        self.next_slot = 0.0
+        self.last_decrease = 0.0
+        self.started = None
+        self.requests = 0
+        self.slowdowns = 0
+        self.slow_start = True
+    
+    def _reserve(self, count):
+        """Book `count` request slots and return how long to wait for them"""
+        now = time.monotonic()
+        if self.started is None:
+            self.started = now
+        start = max(now, self.next_slot)
+        self.next_slot = start + count / self.rate
+        self.requests += count
+        return start - now
+    
+    def acquire(self, count=1):
+        """Block until `count` requests may start"""
+        delay = self._reserve(count)
+        if delay > 0:
+            time.sleep(delay)
+    
+    async def acquire_async(self, count=1):
+        """Wait (without blocking the event loop) until `count` requests may start"""
+        delay = self._reserve(count)
+        if delay > 0:
+            await asyncio.sleep(delay)
+    
+    def _slow_down(self, reason):
+        now = time.monotonic()
+        # One cut per cooldown, so a burst of concurrent failures counts once
+        if now - self.last_decrease < self.cooldown:
+            return
+        self.last_decrease = now
+        self.slow_start = False
+        self.rate = max(self.min_rate, self.rate * self.decrease)
+        self.slowdowns += 1
+        print(f"  🐢 {reason} - slowing to {self.rate:.1f} req/s")
+    
+    def record(self, product_data, latency):
+        """Feed back the outcome of one request that took `latency` seconds"""
+        status = http_status(product_data)
+        
+        if status == 429 or (status and status >= 500):
+            self._slow_down(f"HTTP {status}")
+            return
+        if str(product_data.get('error_message') or '').startswith('HTTP N/A'):
+            # No HTTP response at all (network error / timeout)
+            self._slow_down("Request failed")
+            return
+        
+        if self.latency_baseline is not None and self.latency_samples >= 10 and \
+                latency > self.latency_baseline * self.spike_factor:
+            self._slow_down(f"Latency spike ({latency:.1f}s vs {self.latency_baseline:.1f}s)")
+            return
+        
+        # Healthy response (including 401 / not-found, which are not load signals)
+        self.latency_baseline = latency if self.latency_baseline is None else \
+            0.9 * self.latency_baseline + 0.1 * latency
+        self.latency_samples += 1
+        step = 0.5 if self.slow_start else self.increase / self.rate
+        self.rate = min(self.max_rate, self.rate + step)
+    
+    def effective_rate(self):
+        """Average request starts per second since the first request"""
+        if self.started is None:
+            return 0.0
+        elapsed = time.monotonic() - self.started
+        return self.requests / elapsed if elapsed > 0 else 0.0
+    
+    def summary(self):
+        """One-line report of where the rate settled"""
+        return (f"settled at {self.rate:.1f} req/s, averaged {self.effective_rate():.1f} req/s "
+                f"({self.slowdowns} slowdowns)")
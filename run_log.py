@@ -0,0 +1,103 @@
+"""
+Run metadata in the scrape_runs table.
+
+Each run gets one row keyed by run_id: when it started and finished, how
+many SKUs it was given, products scraped (success / error), location rows,
+rows committed to the database, re-logins and products per second. The
+live database writer adds what changed since its last commit to that row
+in the same transaction as every batch, so the row is current while the
+run is going and reading run statistics is a primary-key lookup. A resumed
+run keeps adding to the row of the run it resumes. The uploader records
+its own rows and timing on the same row (see upload_to_database).
+"""
+import time
+from datetime import datetime
+from db_schema import RUNS_TABLE_NAME
+
+START_RUN_QUERY = f"""
+INSERT INTO {RUNS_TABLE_NAME} (run_id, started_at, status, storage_mode, sku_count)
+VALUES (%s, %s, 'running', %s, %s)
+ON CONFLICT (run_id) DO UPDATE SET
+    status = 'running',
+    finished_at = NULL,
+    storage_mode = EXCLUDED.storage_mode,
+    sku_count = EXCLUDED.sku_count,
+    updated_at = CURRENT_TIMESTAMP
+"""
+
+ADD_TOTALS_QUERY = f"""
+UPDATE {RUNS_TABLE_NAME} SET
+    products = products + %(products)s,
+    success_count = success_count + %(success)s,
+    error_count = error_count + %(errors)s,
+    location_rows = location_rows + %(locations)s,
+    db_rows = db_rows + %(db_rows)s,
+    reauth_count = reauth_count + %(reauths)s,
+    active_seconds = active_seconds + %(seconds)s,
+    products_per_sec = (products + %(products)s) / NULLIF(active_seconds + %(seconds)s, 0),
+    updated_at = CURRENT_TIMESTAMP
+WHERE run_id = %(run_id)s
+"""
+
+CREDIT_ROWS_QUERY = f"""
+UPDATE {RUNS_TABLE_NAME} SET db_rows = db_rows + %s, updated_at = CURRENT_TIMESTAMP
+WHERE run_id = %s
+"""
+
+FINISH_RUN_QUERY = f"""
+UPDATE {RUNS_TABLE_NAME} SET status = %s, finished_at = %s, updated_at = CURRENT_TIMESTAMP
+WHERE run_id = %s
+"""
+
+COUNTERS = ['products', 'success', 'errors', 'locations', 'reauths']
+
+def credit_rows(cur, run_id, db_rows):
+    """Add rows written later on a run's behalf (spool replay) to its row, inside the caller's transaction"""
+    if run_id and db_rows:
+        cur.execute(CREDIT_ROWS_QUERY, (db_rows, run_id))
+
+class RunLog:
+    """Pushes a run's ScrapeStats counters to its scrape_runs row as they grow"""
+    
+    def __init__(self, run_id, sku_count, storage_mode, stats):
+        self.run_id = run_id
+        self.sku_count = sku_count
+        self.storage_mode = storage_mode
+        self.stats = stats
+        self.sent = {counter: 0 for counter in COUNTERS}
+        self.sent_at = time.monotonic()
+        self.started = False
+    
+    def start(self, conn):
+        """Create (or reopen, when resuming) the run's row. Commits."""
+        with conn.cursor() as cur:
+            cur.execute(START_RUN_QUERY, (self.run_id, datetime.now(), self.storage_mode, self.sku_count))
+        conn.commit()
+        self.sent_at = time.monotonic()
+        self.started = True
+    
+    def push(self, cur, db_rows=0):
+        """
+        Add the counts gained since the last push (and db_rows written) to the
+        run's row, inside the caller's transaction. Returns a snapshot to pass
+        to pushed() once that transaction has committed.
+        """
+        now = time.monotonic()
+        snapshot = {counter: getattr(self.stats, counter) for counter in COUNTERS}
+        params = {counter: snapshot[counter] - self.sent[counter] for counter in COUNTERS}
+        params.update(run_id=self.run_id, db_rows=db_rows, seconds=now - self.sent_at)
+        cur.execute(ADD_TOTALS_QUERY, params)
+        return snapshot, now
+    
+    def pushed(self, snapshot):
+        """Record a committed push, so the next one only sends what is new"""
+        self.sent, self.sent_at = snapshot
+    
+    def finish(self, conn, completed, failed=False):
+        """Push the last counts and mark the run completed, failed or interrupted. Commits."""
+        status = 'completed' if completed else 'failed' if failed else 'interrupted'
+        with conn.cursor() as cur:
+            snapshot = self.push(cur)
+            cur.execute(FINISH_RUN_QUERY, (status, datetime.now(), self.run_id))
+        conn.commit()
+        self.pushed(snapshot)
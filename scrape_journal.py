@@ -0,0 +1,98 @@
+"""
+Append-only journal of finished products, used to resume an interrupted run.
+
+Every product that finishes (success or error) is appended as one JSON line
+keyed by product code, so progress survives a crash product by product, does
+not depend on the order of airr_sku_rows.csv, and works when products finish
+out of order under concurrency. Lines are flushed immediately and fsynced in
+small groups to keep the cost of durability low.
+"""
+import os
+import json
+import time
+from datetime import datetime
+
+LEGACY_CHECKPOINT_FILE = 'scrape_checkpoint.json'
+
+class ScrapeJournal:
+    """JSONL file of completed product codes"""
+    
+    def __init__(self, path='scrape_journal.jsonl', fsync_every=20, fsync_interval=1.0, before_sync=None):
+        self.path = path
+        # Lets the output files reach disk before the journal claims their products
+        self.before_sync = before_sync
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.file = None
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+    
+    def load(self, product_codes=None):
+        """
+        Return the set of product codes already finished.
+        
+        A torn last line from a crash is ignored. If only an old index-based
+        checkpoint exists, the products before its last_index count as done.
+        """
+        done = set()
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        done.add(json.loads(line)['product_code'])
+                    except (ValueError, KeyError, TypeError):
+                        continue
+        elif product_codes and os.path.exists(LEGACY_CHECKPOINT_FILE):
+            try:
+                with open(LEGACY_CHECKPOINT_FILE, 'r') as f:
+                    last_index = json.load(f).get('last_index', -1)
+                done.update(product_codes[:last_index + 1])
+            except (ValueError, OSError):
+                pass
+        
+        if done:
+            print(f"Resuming: {len(done)} products already done according to {self.path}")
+        return done
+    
+    def record(self, product_code, status):
+        """Append one finished product"""
+        if self.file is None:
+            self.file = open(self.path, 'a+', encoding='utf-8')
+            # Terminate a line torn by a crash so the next record starts clean
+            if self.file.tell() > 0:
+                self.file.seek(self.file.tell() - 1)
+                if self.file.read(1) != '\n':
+                    self.file.write('\n')
+        self.file.write(json.dumps({
+            'product_code': product_code,
+            'status': status,
+            'finished_at': datetime.now().isoformat()
+        }) + '\n')
+        self.file.flush()
+        self.unsynced += 1
+        
+        if self.unsynced >= self.fsync_every or time.monotonic() - self.last_sync >= self.fsync_interval:
+            self.sync()
+    
+    def sync(self):
+        """Force everything recorded so far to disk"""
+        if self.file and self.unsynced:
+            if self.before_sync:
+                self.before_sync()
+            os.fsync(self.file.fileno())
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+    
+    def close(self):
+        """Sync and close the journal file"""
+        if self.file:
+            self.sync()
+            self.file.close()
+            self.file = None
+    
+    def remove(self):
+        """Delete the journal once the whole run has completed"""
+        self.close()
+        for path in (self.path, LEGACY_CHECKPOINT_FILE):
+            if os.path.exists(path):
+                os.remove(path)
@@ -2,13 +2,31 @@ import os
 import sys
 import json
 import time
+import asyncio
+import argparse
 from datetime import datetime
 from pathlib import Path
 from playwright.sync_api import sync_playwright
+from playwright.async_api import async_playwright
 import pandas as pd
-import psycopg2
-from psycopg2.extras import execute_values
 from dotenv import load_dotenv
+from airr_api import AirrApiClient, SEARCH_API_URL, SITE_URL
+from token_manager import TokenManager
+from token_broker import TokenBroker
+from credential_pool import CredentialPool, load_credentials
+from airr_auth import AirrAuthenticator, parse_token
+from rate_limiter import AimdRateLimiter
+from scrape_journal import ScrapeJournal
+from csv_writer import StreamingCsvWriter
+from scrape_stats import ScrapeStats
+from db_writer import create_db_writer
+from db_spool import DbSpool
+from upload_watermark import UploadWatermark
+from db_schema import ensure_schema, STORAGE_MODE
+from run_log import RunLog
+from work_queue import WorkQueue, POLL_SECONDS as QUEUE_POLL_SECONDS
+from shard_workers import search_in_processes
+from db_connection import get_database, close_database
 
 # Load environment variables from .env file in script directory
 env_path = Path(__file__).parent / '.env'
@@ -50,222 +68,362 @@ def load_product_codes(csv_file='airr_sku_rows.csv'):
         print(f"Error loading product codes: {e}")
         return []
 
-def refresh_authentication(page):
-    """Refresh authentication by re-logging in"""
+BROWSER_ARGS = [
+    '--no-sandbox',
+    '--disable-setuid-sandbox',
+    '--disable-dev-shm-usage',
+    '--disable-gpu'
+]
+
+def refresh_authentication(page, authenticator=None, settle_ms=2000):
+    """Refresh authentication by re-logging in (replaying the login XHR when captured)"""
     print("\n🔄 Refreshing authentication...")
     try:
-        USERNAME = os.getenv('airr_USERNAME')
-        PASSWORD = os.getenv('airr_PASSWORD')
+        authenticator = authenticator or AirrAuthenticator()
+        USERNAME, PASSWORD = authenticator.credentials
         
         if not USERNAME or not PASSWORD:
             print("  ✗ Credentials not found")
             return False
         
-        page.goto('https://orderonline.airr.com.au/', timeout=30000)
-        page.wait_for_timeout(2000)
-        
-        username_field = page.locator('input[type="text"], input[name*="user"], input[id*="user"]').first
-        username_field.fill(USERNAME)
-        
-        password_field = page.locator('input[type="password"]').first
-        password_field.fill(PASSWORD)
+        started = time.time()
+        new_token = authenticator.login(page, settle_ms)
+        if new_token:
+            print(f"  ✓ Authentication refreshed in {time.time() - started:.1f}s, new token: {new_token[:20]}...")
+            return new_token
         
-        login_button = page.locator('button[type="submit"], input[type="submit"], button:has-text("Login")').first
-        login_button.click()
+        print("  ✗ No token in localStorage after login")
+        return False
+    
+    except Exception as e:
+        print(f"  ✗ Failed to refresh: {str(e)[:100]}")
+        return False
+
+async def refresh_authentication_async(page, settle_ms=2000, authenticator=None, http_client=None):
+    """Async variant of refresh_authentication; returns the new token or None"""
+    print("\n🔄 Refreshing authentication...")
+    try:
+        authenticator = authenticator or AirrAuthenticator()
+        USERNAME, PASSWORD = authenticator.credentials
         
-        page.wait_for_load_state('networkidle', timeout=30000)
-        page.wait_for_timeout(2000)
+        if not USERNAME or not PASSWORD:
+            print("  ✗ Credentials not found")
+            return None
         
-        # Update token after refresh
-        new_token = page.evaluate('() => localStorage.getItem("token")')
+        started = time.time()
+        new_token = await authenticator.login_async(page, http_client, settle_ms)
         if new_token:
-            try:
-                if new_token.startswith('"') and new_token.endswith('"'):
-                    new_token = json.loads(new_token)
-            except:
-                pass
-            print(f"  ✓ Authentication refreshed, new token: {new_token[:20]}...")
+            print(f"  ✓ Authentication refreshed in {time.time() - started:.1f}s, new token: {new_token[:20]}...")
             return new_token
         
-        print("  ✓ Authentication refreshed successfully")
-        return True
-        
+        print("  ✗ No token in localStorage after login")
+        return None
+    
     except Exception as e:
         print(f"  ✗ Failed to refresh: {str(e)[:100]}")
-        return False
+        return None
 
-def scrape_product_via_api(page, product_code, token, warehouse='SYD', max_retries=3):
-    """Scrape product using the search API endpoint"""
-    product_data = {
+def describe_refresh_policy(refresh_interval):
+    """Describe when authentication gets refreshed"""
+    if refresh_interval:
+        return f"before token expiry and every {refresh_interval} products"
+    return "before token expiry"
+
+# Installed once per page (and re-installed on navigation by add_init_script) so
+# each search only ships its arguments instead of a freshly compiled script
+SEARCH_HELPER_JS = """
+(() => {
+    if (window.__airrSearch) return;
+    
+    window.__airrSearch = async (apiUrl, searchData) => {
+        try {
+            const response = await fetch(apiUrl, {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json;charset=UTF-8',
+                    'Accept': 'application/json, text/plain, */*'
+                },
+                body: searchData
+            });
+            const status = response.status;
+            
+            if (status === 200) {
+                const data = await response.json();
+                return { success: true, data: data };
+            } else {
+                const errorText = await response.text();
+                try {
+                    const errorJson = JSON.parse(errorText);
+                    return { success: false, status: status, error: errorJson.error || errorText };
+                } catch {
+                    return { success: false, status: status, error: errorText.substring(0, 100) };
+                }
+            }
+        } catch (e) {
+            return { success: false, error: e.message };
+        }
+    };
+    
+    // Run [apiUrl, searchData] pairs with at most `limit` fetches in flight
+    window.__airrSearchBatch = async (requests, limit) => {
+        const results = new Array(requests.length);
+        let next = 0;
+        const worker = async () => {
+            while (next < requests.length) {
+                const i = next++;
+                results[i] = await window.__airrSearch(requests[i][0], requests[i][1]);
+            }
+        };
+        const workers = Math.max(1, Math.min(limit, requests.length));
+        await Promise.all(Array.from({ length: workers }, worker));
+        return results;
+    };
+})()
+"""
+
+SEARCH_FETCH_JS = "([apiUrl, searchData]) => window.__airrSearch(apiUrl, searchData)"
+
+SEARCH_BATCH_JS = "([requests, limit]) => window.__airrSearchBatch(requests, limit)"
+
+def parse_warehouse(auth_data):
+    """Get the current warehouse LocationID from localStorage"""
+    warehouse_raw = auth_data.get('localStorage', {}).get('currentWarehouse', 'SYD')
+    try:
+        warehouse_data = json.loads(warehouse_raw) if isinstance(warehouse_raw, str) else warehouse_raw
+        if isinstance(warehouse_data, dict):
+            return warehouse_data.get('LocationID', 'SYD')
+        return warehouse_data
+    except:
+        return 'SYD'
+
+def build_search_request(product_code, token, warehouse='SYD'):
+    """Build the search API URL and POST body for a product code"""
+    api_url = f"{SEARCH_API_URL}?token={token}&warehouse={warehouse}&page=1&size=20&isElders=false"
+    search_data = json.dumps({"search": product_code})
+    return api_url, search_data
+
+def new_product_record(product_code):
+    """Create an empty per-product record"""
+    return {
         'product_code': product_code,
         'product_name': None,
         'availability_locations': [],
         'scrape_status': 'pending',
         'error_message': None
     }
+
+def parse_search_result(product_data, result):
+    """Fill product_data from a search API result, raising on any failure"""
+    if not result or not result.get('success'):
+        error_msg = result.get('error', 'Unknown error') if result else 'No response'
+        status = result.get('status', 'N/A') if result else 'N/A'
+        raise Exception(f"HTTP {status}: {error_msg}")
+    
+    # Extract data from successful response
+    data = result.get('data', {})
+    if not data:
+        raise Exception("No data in response")
+    
+    # Search API returns an array of products directly
+    products = data if isinstance(data, list) else [data]
     
+    if not products or len(products) == 0:
+        raise Exception("No products found in search results")
+    
+    # Get the first matching product (should be exact match for product code)
+    first_product = products[0]
+    
+    # Extract product name
+    product_data['product_name'] = first_product.get('Description') or first_product.get('FullDescription1')
+    
+    # Collect all warehouse locations
+    all_locations = []
+    
+    # Add current warehouse from 'Availability'
+    current_warehouse = first_product.get('Availability')
+    if current_warehouse:
+        all_locations.append(current_warehouse)
+    
+    # Add all other warehouses from 'AvailabilityOther'
+    other_warehouses = first_product.get('AvailabilityOther', [])
+    if isinstance(other_warehouses, list):
+        all_locations.extend(other_warehouses)
+    
+    # Extract data from each location
+    for location in all_locations:
+        if not location:
+            continue
+        location_data = {
+            'location_name': location.get('DESCRIPTION', ''),
+            'location_abbreviation': location.get('Abbreviation', ''),
+            'location_id': location.get('LocationID', ''),
+            'qty_available': location.get('QtyAvail', 0),
+            'qty_in_transit': location.get('QtyInTransit', 0),
+            'qty_on_hand': location.get('QtyOnHand', 0),
+            'qty_on_order': location.get('QtyOnOrder', 0)
+        }
+        product_data['availability_locations'].append(location_data)
+    
+    product_data['scrape_status'] = 'success'
+    return product_data
+
+def product_from_result(product_code, result):
+    """Build a product record from one search API result"""
+    product_data = new_product_record(product_code)
     try:
-        # Use the search API endpoint (POST request)
-        api_url = f"https://api.orderonline.airr.com.au/search?token={token}&warehouse={warehouse}&page=1&size=20&isElders=false"
-        search_data = json.dumps({"search": product_code})
-        
-        # Use page.evaluate to fetch from within the page context
-        result = page.evaluate(f"""
-            async () => {{
-                try {{
-                    const response = await fetch('{api_url}', {{
-                        method: 'POST',
-                        headers: {{
-                            'Content-Type': 'application/json;charset=UTF-8',
-                            'Accept': 'application/json, text/plain, */*'
-                        }},
-                        body: '{search_data}'
-                    }});
-                    const status = response.status;
-                    
-                    if (status === 200) {{
-                        const data = await response.json();
-                        return {{ success: true, data: data }};
-                    }} else {{
-                        const errorText = await response.text();
-                        try {{
-                            const errorJson = JSON.parse(errorText);
-                            return {{ success: false, status: status, error: errorJson.error || errorText }};
-                        }} catch {{
-                            return {{ success: false, status: status, error: errorText.substring(0, 100) }};
-                        }}
-                    }}
-                }} catch (e) {{
-                    return {{ success: false, error: e.message }};
-                }}
-            }}
-        """)
-        
-        if not result or not result.get('success'):
-            error_msg = result.get('error', 'Unknown error') if result else 'No response'
-            status = result.get('status', 'N/A') if result else 'N/A'
-            raise Exception(f"HTTP {status}: {error_msg}")
-        
-        # Extract data from successful response
-        data = result.get('data', {})
-        if not data:
-            raise Exception("No data in response")
-        
-        # Search API returns an array of products directly
-        products = data if isinstance(data, list) else [data]
-        
-        if not products or len(products) == 0:
-            raise Exception("No products found in search results")
-        
-        # Get the first matching product (should be exact match for product code)
-        first_product = products[0]
-        
-        # Extract product name
-        product_data['product_name'] = first_product.get('Description') or first_product.get('FullDescription1')
-        
-        # Collect all warehouse locations
-        all_locations = []
-        
-        # Add current warehouse from 'Availability'
-        current_warehouse = first_product.get('Availability')
-        if current_warehouse:
-            all_locations.append(current_warehouse)
-        
-        # Add all other warehouses from 'AvailabilityOther'
-        other_warehouses = first_product.get('AvailabilityOther', [])
-        if isinstance(other_warehouses, list):
-            all_locations.extend(other_warehouses)
-        
-        # Extract data from each location
-        for location in all_locations:
-            if not location:
-                continue
-            location_data = {
-                'location_name': location.get('DESCRIPTION', ''),
-                'location_abbreviation': location.get('Abbreviation', ''),
-                'location_id': location.get('LocationID', ''),
-                'qty_available': location.get('QtyAvail', 0),
-                'qty_in_transit': location.get('QtyInTransit', 0),
-                'qty_on_hand': location.get('QtyOnHand', 0),
-                'qty_on_order': location.get('QtyOnOrder', 0)
-            }
-            product_data['availability_locations'].append(location_data)
-        
-        product_data['scrape_status'] = 'success'
+        parse_search_result(product_data, result)
+    except Exception as e:
+        record_error(product_data, e)
+    return product_data
+
+def stamp_product(product_data, run_id):
+    """Tag a finished product with its run and scrape time (shared by the CSV and DB rows)"""
+    product_data['run_id'] = run_id
+    product_data['scraped_at'] = datetime.now()
+    return product_data
+
+def record_error(product_data, error):
+    """Mark product_data as failed with a truncated error message"""
+    product_data['scrape_status'] = 'error'
+    product_data['error_message'] = str(error)[:200]
+    return product_data
+
+def describe_result(product_data):
+    """One-line summary of a scraped product for the log"""
+    if product_data['scrape_status'] == 'success':
         locations_count = len(product_data['availability_locations'])
-        print(f"  ✓ {product_data['product_name'] or product_code} - {locations_count} locations")
-        
+        return f"✓ {product_data['product_name'] or product_data['product_code']} - {locations_count} locations"
+    return f"✗ Error: {str(product_data.get('error_message'))[:100]}"
+
+def is_auth_error(product_data):
+    """True if the product failed because the token was rejected"""
+    return product_data['scrape_status'] == 'error' and '401' in str(product_data.get('error_message', ''))
+
+def register_search_helper(page):
+    """Install the in-page search helpers for this and every later document"""
+    page.add_init_script(SEARCH_HELPER_JS)
+    page.evaluate(SEARCH_HELPER_JS)
+
+async def register_search_helper_async(page):
+    """Async variant of register_search_helper"""
+    await page.add_init_script(SEARCH_HELPER_JS)
+    await page.evaluate(SEARCH_HELPER_JS)
+
+def scrape_product_via_api(page, product_code, token, warehouse='SYD', max_retries=3):
+    """Scrape product using the search API endpoint"""
+    product_data = new_product_record(product_code)
+    
+    try:
+        # Use the search API endpoint (POST request) from within the page context
+        api_url, search_data = build_search_request(product_code, token, warehouse)
+        result = page.evaluate(SEARCH_FETCH_JS, [api_url, search_data])
+        parse_search_result(product_data, result)
     except Exception as e:
-        product_data['scrape_status'] = 'error'
-        product_data['error_message'] = str(e)[:200]
-        print(f"  ✗ Error: {str(e)[:100]}")
+        record_error(product_data, e)
     
+    print(f"  {describe_result(product_data)}")
     return product_data
 
+def scrape_products_batch_via_api(page, product_codes, token, warehouse='SYD', concurrency=8):
+    """
+    Scrape several products in a single page.evaluate round trip.
+    
+    The fetches run in the page with at most `concurrency` in flight. Returns one
+    record per product code, in order, each with its own status and error text.
+    """
+    requests = [list(build_search_request(code, token, warehouse)) for code in product_codes]
+    try:
+        results = page.evaluate(SEARCH_BATCH_JS, [requests, concurrency])
+    except Exception as e:
+        results = [{'success': False, 'error': str(e)}] * len(product_codes)
+    
+    batch = [product_from_result(code, result) for code, result in zip(product_codes, results)]
+    for product_data in batch:
+        print(f"  {product_data['product_code']} {describe_result(product_data)}")
+    return batch
+
+async def scrape_product_via_api_async(page, product_code, token, warehouse='SYD', api_client=None):
+    """Async variant of scrape_product_via_api; uses api_client instead of the page if given"""
+    product_data = new_product_record(product_code)
+    
+    try:
+        if api_client:
+            result = await api_client.search(product_code, token, warehouse)
+        else:
+            api_url, search_data = build_search_request(product_code, token, warehouse)
+            result = await page.evaluate(SEARCH_FETCH_JS, [api_url, search_data])
+        parse_search_result(product_data, result)
+    except Exception as e:
+        record_error(product_data, e)
+    
+    return product_data
+
+async def scrape_products_batch_via_api_async(page, product_codes, token, warehouse='SYD', concurrency=8):
+    """Async variant of scrape_products_batch_via_api (records are not printed)"""
+    requests = [list(build_search_request(code, token, warehouse)) for code in product_codes]
+    try:
+        results = await page.evaluate(SEARCH_BATCH_JS, [requests, concurrency])
+    except Exception as e:
+        results = [{'success': False, 'error': str(e)}] * len(product_codes)
+    
+    return [product_from_result(code, result) for code, result in zip(product_codes, results)]
+
 def scrape_all_products(product_codes, auth_data, output_file='airr_product_data.csv', 
-                        checkpoint_file='scrape_checkpoint.json', batch_size=50, refresh_interval=100):
-    """Scrape all products with auto-refresh and checkpoint/resume"""
+                        checkpoint_file='scrape_journal.jsonl', batch_size=50, refresh_interval=None,
+                        rate_limiter=None, storage_mode=STORAGE_MODE, evaluate_batch=1):
+    """
+    Scrape all products with auto-refresh and checkpoint/resume.
+    
+    Each product is streamed to the CSV, the database and the journal and then
+    dropped; the returned ScrapeStats only holds counters. With
+    evaluate_batch > 1 that many SKUs are resolved per page.evaluate round
+    trip, and only the ones that came back 401 are retried after a re-login.
+    """
     print(f"\n{'='*60}")
     print(f"Starting product scraping session")
     print(f"Total products: {len(product_codes)}")
     print(f"Output file: {output_file}")
-    print(f"Auth refresh: every {refresh_interval} products")
+    if evaluate_batch > 1:
+        print(f"Evaluate batch: {evaluate_batch} SKUs per round trip")
+    print(f"Auth refresh: {describe_refresh_policy(refresh_interval)}")
+    print(f"Database storage: {storage_mode}")
     print(f"{'='*60}\n")
     
-    scraped_data = []
-    start_index = 0
+    stats = ScrapeStats()
     
-    # Load checkpoint if exists
-    if os.path.exists(checkpoint_file):
-        try:
-            with open(checkpoint_file, 'r') as f:
-                checkpoint = json.load(f)
-                start_index = checkpoint.get('last_index', 0) + 1
-                print(f"Resuming from checkpoint at product #{start_index}")
-        except:
-            pass
+    # Load the journal of products finished by an earlier, interrupted run
+    csv_output = StreamingCsvWriter(output_file)
+    journal = ScrapeJournal(checkpoint_file, before_sync=csv_output.flush)
+    done_codes = journal.load(product_codes)
+    csv_output.append = bool(done_codes)
+    
+    # One run_id for the CSV and live database rows, so the uploader can tell what is already in
+    watermark = UploadWatermark()
+    run_id = watermark.resolve_run_id(resuming=bool(done_codes))
+    watermark.start(run_id, output_file, csv_output.existing_rows())
+    print(f"Run ID: {run_id}")
     
     # Parse token from localStorage
     token_raw = auth_data.get('localStorage', {}).get('token')
     if not token_raw:
         print("✗ No token found in authentication data!")
-        return []
-    
-    try:
-        if token_raw.startswith('"') and token_raw.endswith('"'):
-            token = json.loads(token_raw)
-        else:
-            token = token_raw
-    except:
-        token = token_raw
+        return stats
     
-    # Parse warehouse
-    warehouse_raw = auth_data.get('localStorage', {}).get('currentWarehouse', 'SYD')
-    try:
-        warehouse_data = json.loads(warehouse_raw) if isinstance(warehouse_raw, str) else warehouse_raw
-        if isinstance(warehouse_data, dict):
-            warehouse = warehouse_data.get('LocationID', 'SYD')
-        else:
-            warehouse = warehouse_data
-    except:
-        warehouse = 'SYD'
+    token = parse_token(token_raw)
+    warehouse = parse_warehouse(auth_data)
     
     print(f"Using warehouse: {warehouse}")
     print(f"Initial token: {token[:20] if len(token) > 20 else token}...\n")
     
-    # Initialize database connection for live updates
+    # Initialize database connection for live updates (written from a background thread)
     db_conn = init_database()
+    run_log = RunLog(run_id, len(product_codes), storage_mode, stats)
+    # Without a connection (or if it drops for good) rows wait in the local spool
+    db_writer = create_db_writer(db_conn, watermark, storage_mode, run_log, get_database(), DbSpool())
+    completed = False
     
     with sync_playwright() as p:
-        browser = p.chromium.launch(
-            headless=True,
-            args=[
-                '--no-sandbox',
-                '--disable-setuid-sandbox',
-                '--disable-dev-shm-usage',
-                '--disable-gpu'
-            ]
-        )
+        browser = p.chromium.launch(headless=True, args=BROWSER_ARGS)
         context = browser.new_context()
         
         cookies = auth_data.get('cookies', [])
@@ -277,297 +435,594 @@ def scrape_all_products(product_codes, auth_data, output_file='airr_product_data
         try:
             # Perform fresh login to get active token
             print("Performing fresh login...")
-            USERNAME = os.getenv('airr_USERNAME')
-            PASSWORD = os.getenv('airr_PASSWORD')
-            
-            if not USERNAME or not PASSWORD:
-                print("✗ Credentials not found!")
-                return []
-            
-            page.goto('https://orderonline.airr.com.au/', timeout=30000)
-            page.wait_for_timeout(2000)
-            
-            # Fill login form
-            username_field = page.locator('input[type="text"], input[name*="user"], input[id*="user"]').first
-            username_field.fill(USERNAME)
-            
-            password_field = page.locator('input[type="password"]').first
-            password_field.fill(PASSWORD)
-            
-            login_button = page.locator('button[type="submit"], input[type="submit"], button:has-text("Login")').first
-            login_button.click()
-            
-            page.wait_for_load_state('networkidle', timeout=30000)
-            page.wait_for_timeout(3000)
-            
-            # Extract fresh token from localStorage
-            fresh_token = page.evaluate('() => localStorage.getItem("token")')
-            if fresh_token:
-                try:
-                    if fresh_token.startswith('"') and fresh_token.endswith('"'):
-                        token = json.loads(fresh_token)
-                    else:
-                        token = fresh_token
-                except:
-                    token = fresh_token
+            authenticator = AirrAuthenticator(auth_data.get('loginRequest'))
+            fresh_token = refresh_authentication(page, authenticator, settle_ms=3000)
+            if fresh_token and isinstance(fresh_token, str):
+                token = fresh_token
                 
                 print(f"✓ Fresh login successful!")
                 print(f"  New token: {token[:20]}...\n")
             else:
                 print("✗ Could not get fresh token!")
-                return []
+                return stats
             
-            # Scrape all products
-            for index, product_code in enumerate(product_codes[start_index:], start=start_index):
-                # Auto-refresh authentication every N products
-                if index > 0 and index % refresh_interval == 0:
-                    new_token = refresh_authentication(page)
+            register_search_helper(page)
+            
+            tokens = TokenManager(token)
+            print(f"  Token {tokens.describe()}\n")
+            limiter = rate_limiter or AimdRateLimiter()
+            
+            # Scrape all products, evaluate_batch SKUs per round trip
+            pending_products = [(index, product_code) for index, product_code in enumerate(product_codes)
+                                if product_code not in done_codes]
+            per_call = max(1, evaluate_batch)
+            for start in range(0, len(pending_products), per_call):
+                batch = pending_products[start:start + per_call]
+                
+                # Refresh authentication just before the token expires (or every N products if forced)
+                forced = refresh_interval and any(index > 0 and index % refresh_interval == 0 for index, _ in batch)
+                if forced or tokens.needs_refresh():
+                    new_token = refresh_authentication(page, authenticator)
                     if new_token and isinstance(new_token, str):
+                        tokens.set_token(new_token)
+                        stats.reauths += 1
                         token = new_token
                         print(f"  Continuing with refreshed token...\n")
                     else:
                         print("  ⚠ Warning: Could not refresh token, using existing one...\n")
                 
-                print(f"[{index + 1}/{len(product_codes)}] Scraping: {product_code}")
+                first_index, last_index = batch[0][0], batch[-1][0]
+                if per_call > 1:
+                    print(f"[{first_index + 1}-{last_index + 1}/{len(product_codes)}] Scraping {len(batch)} products")
+                else:
+                    print(f"[{first_index + 1}/{len(product_codes)}] Scraping: {batch[0][1]}")
                 
-                # Try scraping with automatic retry on 401
+                # Try scraping with automatic retry on 401, per product
                 max_retries = 2
-                product_data = None
+                results = {}
+                retry_batch = batch
                 for attempt in range(max_retries + 1):
-                    product_data = scrape_product_via_api(page, product_code, token, warehouse)
+                    codes = [product_code for _, product_code in retry_batch]
+                    limiter.acquire(len(codes))
+                    started = time.time()
+                    if per_call > 1:
+                        products = scrape_products_batch_via_api(page, codes, token, warehouse, per_call)
+                    else:
+                        products = [scrape_product_via_api(page, codes[0], token, warehouse)]
+                    latency = time.time() - started
                     
-                    # If 401 error, refresh auth and retry
-                    if product_data['scrape_status'] == 'error' and '401' in str(product_data.get('error_message', '')):
-                        if attempt < max_retries:
-                            print(f"  🔄 Auth expired, refreshing and retrying (attempt {attempt + 2}/{max_retries + 1})...")
-                            new_token = refresh_authentication(page)
-                            if new_token and isinstance(new_token, str):
-                                token = new_token
-                                continue  # Retry with new token
+                    retry = []
+                    for (index, product_code), product_data in zip(retry_batch, products):
+                        limiter.record(product_data, latency)
+                        results[index] = product_data
+                        # If 401 error, refresh auth and retry
+                        if is_auth_error(product_data):
+                            tokens.record_auth_failure(token)
+                            if attempt < max_retries:
+                                retry.append((index, product_code))
                             else:
-                                print(f"  ✗ Could not refresh token, skipping retry")
-                                break
-                        else:
-                            print(f"  ✗ Max retries reached, giving up on this product")
-                    else:
+                                print(f"  ✗ {product_code}: max retries reached, giving up on this product")
+                    
+                    if not retry:
                         # Success or non-401 error, move on
                         break
+                    print(f"  🔄 Auth expired for {len(retry)} product(s), refreshing and retrying "
+                          f"(attempt {attempt + 2}/{max_retries + 1})...")
+                    new_token = refresh_authentication(page, authenticator)
+                    if new_token and isinstance(new_token, str):
+                        tokens.set_token(new_token)
+                        stats.reauths += 1
+                        token = new_token
+                        retry_batch = retry  # Retry with new token
+                    else:
+                        print(f"  ✗ Could not refresh token, skipping retry")
+                        break
                 
-                if product_data:
-                    scraped_data.append(product_data)
-                    
-                    # Upload to database in real-time
-                    upload_to_database_realtime(db_conn, product_data)
-                
-                # Save checkpoint every batch_size products
-                if (index + 1) % batch_size == 0:
-                    save_results(scraped_data, output_file, start_index)
+                for index, product_code in batch:
+                    product_data = results[index]
+                    stamp_product(product_data, run_id)
+                    stats.add(product_data)
+                    csv_output.write_product(product_data)
                     
-                    with open(checkpoint_file, 'w') as f:
-                        json.dump({'last_index': index, 'timestamp': datetime.now().isoformat()}, f)
+                    # Queue for the database writer (blocks only if the DB falls far behind)
+                    db_writer.submit(product_data, csv_output.total_rows())
+                    journal.record(product_code, product_data['scrape_status'])
                     
-                    print(f"\n✓ Checkpoint saved at product #{index + 1}")
-                    print(f"  Progress: {((index + 1) / len(product_codes)) * 100:.1f}%\n")
-                
-                time.sleep(0.3)  # Small delay between requests
+                    # Save checkpoint every batch_size products
+                    if stats.products % batch_size == 0:
+                        journal.sync()
+                        print(f"  Saved {csv_output.rows_written} rows ({csv_output.products_written} products) to {output_file}")
+                        
+                        finished = len(done_codes) + stats.products
+                        print(f"\n✓ Checkpoint saved at product #{index + 1}")
+                        print(f"  Progress: {(finished / len(product_codes)) * 100:.1f}%\n")
             
             # Final save
-            save_results(scraped_data, output_file, start_index)
+            csv_output.close()
             
-            # Remove checkpoint file when complete
-            if os.path.exists(checkpoint_file):
-                os.remove(checkpoint_file)
+            # Remove the journal when complete
+            journal.remove()
+            completed = True
             
             print(f"\n{'='*60}")
             print(f"Scraping completed!")
-            print(f"Total products processed: {len(scraped_data)}")
+            print(f"Total products processed: {stats.products}")
+            print(f"Request rate: {limiter.summary()}")
             print(f"Results saved to: {output_file}")
             print(f"{'='*60}\n")
-            
+        
         except Exception as e:
             print(f"\n✗ Fatal error: {e}")
-            save_results(scraped_data, output_file, start_index)
             print(f"Partial results saved to: {output_file}")
-            
+        
         finally:
+            csv_output.close()
+            journal.close()
             browser.close()
-            # Close database connection
-            if db_conn:
-                try:
-                    db_conn.close()
-                    print("\n✓ Database connection closed")
-                except:
-                    pass
+            # Flush pending rows and record the run, then close database connection
+            db_writer.close(completed)
+            if get_database():
+                close_database()
+                print("\n✓ Database connection closed")
     
-    return scraped_data
+    return stats
 
-def init_database():
-    """Initialize database connection and create table if needed"""
-    try:
-        DB_CONFIG = {
-            'host': os.getenv('SUPABASE_HOST'),
-            'dbname': os.getenv('SUPABASE_DBNAME'),
-            'user': os.getenv('SUPABASE_USER'),
-            'password': os.getenv('SUPABASE_PASSWORD'),
-            'port': os.getenv('SUPABASE_PORT'),
-            'sslmode': 'require'
-        }
-        
-        # Check if credentials are available
-        if not all(DB_CONFIG.values()):
-            print("⚠️  Database credentials not found - skipping live database updates")
-            return None
-        
-        conn = psycopg2.connect(**DB_CONFIG)
+async def search_products_async(next_batch, auth_data, on_product, refresh_interval=None, concurrency=8,
+                                max_retries=2, mode='browser', evaluate_batch=1, rate_limiter=None):
+    """
+    Log in and search SKUs until next_batch(n) comes back empty.
+    
+    This is the browser, token and request-rate half of the concurrent
+    scraper. next_batch(n) is an async callable handing out up to n
+    (index, product_code) pairs; each finished product is passed to
+    `await on_product(index, product_code, product_data, refresh_count)`.
+    It runs inside the scraping process, or once in every worker process
+    of a --workers run (see shard_workers). Returns False if the login failed.
+    
+    Every account in the credential pool (see credential_pool) has its own
+    browser context, token and rate limiter; each batch goes to the account
+    that can start a request soonest, and a 401 retry may move to another
+    account. Once no account is left in rotation the search stops and
+    returns False; SKUs that could not be searched are not passed to
+    on_product, so they stay out of the journal and the next run picks them up.
+    """
+    warehouse = parse_warehouse(auth_data)
+    print(f"Using warehouse: {warehouse}")
+    
+    pool = CredentialPool(load_credentials(), rate_limiter)
+    if not pool.accounts:
+        print("✗ Credentials not found")
+        return False
+    if len(pool.accounts) > 1:
+        print(f"Credential pool: {', '.join(account.label for account in pool.accounts)}")
+    
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=True, args=BROWSER_ARGS)
+        refreshers = []
         
-        # Create table if it doesn't exist
-        create_table_query = """
-        CREATE TABLE IF NOT EXISTS airr_product_availability (
-            id SERIAL PRIMARY KEY,
-            product_code VARCHAR(50) NOT NULL,
-            product_name TEXT,
-            location_name VARCHAR(100),
-            location_abbreviation VARCHAR(20),
-            location_id VARCHAR(20),
-            qty_available INTEGER DEFAULT 0,
-            qty_in_transit INTEGER DEFAULT 0,
-            qty_on_hand INTEGER DEFAULT 0,
-            qty_on_order INTEGER DEFAULT 0,
-            scrape_status VARCHAR(20),
-            error_message TEXT,
-            scraped_at TIMESTAMP,
-            uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        );
+        async def open_session(account):
+            """Log the account in on its own browser context; False if it could not"""
+            context = await browser.new_context()
+            
+            # The saved cookies belong to the main account's session
+            cookies = auth_data.get('cookies', [])
+            if cookies and account is pool.accounts[0]:
+                await context.add_cookies(cookies)
+            
+            # Searches run on one page and logins on another, so a re-login never
+            # navigates away from the page that in-flight fetches are running in
+            account.page = await context.new_page() if mode == 'browser' else None
+            auth_page = await context.new_page()
+            account.api_client = AirrApiClient(max_connections=concurrency) if mode == 'http' else None
+            authenticator = AirrAuthenticator(auth_data.get('loginRequest'), account.credentials)
+            http_client = account.api_client.client if account.api_client else None
+            
+            async def first_login():
+                print(f"Performing fresh login{f' for account {account.label}' if len(pool.accounts) > 1 else ''}...")
+                return await refresh_authentication_async(auth_page, 3000, authenticator, http_client)
+            
+            async def login():
+                return await refresh_authentication_async(auth_page, 2000, authenticator, http_client)
+            
+            # Scrapers running side by side share each account's token (see token_broker)
+            broker = TokenBroker(account.token_cache) if account.token_cache else None
+            account.tokens = TokenManager(broker=broker)
+            account.login = login
+            if broker:
+                entry, logged_in = await broker.refresh(first_login)
+                if entry:
+                    account.tokens.adopt(entry)
+            else:
+                token, logged_in = await first_login(), True
+                if token:
+                    account.tokens.set_token(token)
+            if not account.tokens.token:
+                print("✗ Could not get fresh token!")
+                account.retire("could not log in")
+                return False
+            print("✓ Fresh login successful!\n" if logged_in else f"✓ Using the shared token in {broker.path}\n")
+            
+            # fetch() has to run from the app origin
+            if account.page:
+                await register_search_helper_async(account.page)
+                await account.page.goto(SITE_URL, timeout=30000)
+            
+            print(f"  Token {account.tokens.describe()}\n")
+            refreshers.append(asyncio.create_task(account.tokens.run_refresher(login)))
+            return True
         
-        CREATE INDEX IF NOT EXISTS idx_product_code ON airr_product_availability(product_code);
-        CREATE INDEX IF NOT EXISTS idx_location_id ON airr_product_availability(location_id);
-        CREATE INDEX IF NOT EXISTS idx_scraped_at ON airr_product_availability(scraped_at);
-        """
+        try:
+            for account in pool.accounts:
+                await open_session(account)
+            if not pool.active():
+                return False
+            
+            async def reauthenticate(account, seen_generation):
+                """Single-flight re-login; a no-op if another worker already refreshed"""
+                return await account.tokens.refresh(account.login, seen_generation)
+            
+            # Each worker pulls `per_call` SKUs at a time; in-page batches run them
+            # all at once, so fewer workers keep the same number of fetches in flight
+            per_call = max(1, min(evaluate_batch, concurrency)) if mode == 'browser' else 1
+            workers = max(1, concurrency // per_call)
+            finished_count = 0
+            unsearched = 0
+            
+            async def scrape_batch(account, batch):
+                codes = [product_code for _, product_code in batch]
+                token = account.tokens.token
+                if per_call > 1:
+                    return await scrape_products_batch_via_api_async(account.page, codes, token, warehouse, per_call)
+                return [await scrape_product_via_api_async(account.page, codes[0], token, warehouse, account.api_client)]
+            
+            async def worker():
+                nonlocal finished_count, unsearched
+                while pool.active():
+                    batch = await next_batch(per_call)
+                    if not batch:
+                        return
+                    
+                    # Try scraping with automatic retry on 401, per product
+                    results = {}
+                    pending = batch
+                    account = None
+                    for attempt in range(max_retries + 1):
+                        account = pool.pick()
+                        if account is None:
+                            break
+                        tokens = account.tokens
+                        generation = tokens.generation
+                        token = tokens.token
+                        await account.limiter.acquire_async(len(pending))
+                        started = time.time()
+                        products = await scrape_batch(account, pending)
+                        latency = time.time() - started
+                        for product_data in products:
+                            account.limiter.record(product_data, latency)
+                        account.products += len(products)
+                        
+                        retry = []
+                        for (index, product_code), product_data in zip(pending, products):
+                            results[index] = product_data
+                            if is_auth_error(product_data):
+                                tokens.record_auth_failure(token)
+                                if attempt < max_retries:
+                                    retry.append((index, product_code))
+                                else:
+                                    print(f"  ✗ {product_code}: max retries reached, giving up on this product")
+                        
+                        if not retry:
+                            account.record_auth(not any(is_auth_error(product_data) for product_data in products))
+                            break
+                        print(f"  🔄 {len(retry)} product(s): auth expired, refreshing and retrying (attempt {attempt + 2}/{max_retries + 1})...")
+                        if not await reauthenticate(account, generation):
+                            # Once the account is out of rotation another one may take the retry
+                            if account.record_auth(False) or not pool.active():
+                                print(f"  ✗ Could not refresh token, skipping retry")
+                                break
+                            print(f"  ✗ Could not refresh token, retrying with another account")
+                        pending = retry
+                    
+                    for index, product_code in batch:
+                        product_data = results.get(index)
+                        # Rejected because every account is gone: not a result, leave it for the next run
+                        if product_data is None or (not pool.active() and is_auth_error(product_data)):
+                            unsearched += 1
+                            continue
+                        await on_product(index, product_code, product_data, pool.refresh_count())
+                        finished_count += 1
+                        
+                        # Forced refresh every N products, on top of the expiry-driven one
+                        if refresh_interval and account and finished_count % refresh_interval == 0:
+                            await reauthenticate(account, account.tokens.generation)
+            
+            await asyncio.gather(*(worker() for _ in range(workers)))
+            if not pool.active():
+                print(f"\n✗ No AIRR account left in rotation - stopping the run "
+                      f"({unsearched} SKU(s) in flight left unsearched)")
+            for account in pool.accounts:
+                if len(pool.accounts) > 1:
+                    print(f"Account {account.label}: {account.products} searches"
+                          f"{'' if account.active else ' (out of rotation)'}")
+                if account.tokens:
+                    broker = account.tokens.broker
+                    print(f"Token refreshes: {account.tokens.refresh_count}" + (f" (shared via {broker.path})" if broker else ""))
+                print(f"Request rate: {account.limiter.summary()}")
+            return bool(pool.active())
         
-        with conn.cursor() as cur:
-            cur.execute(create_table_query)
-            conn.commit()
+        finally:
+            for refresher in refreshers:
+                refresher.cancel()
+            for account in pool.accounts:
+                if account.api_client:
+                    await account.api_client.close()
+            await browser.close()
+
+async def scrape_all_products_async(product_codes, auth_data, output_file='airr_product_data.csv',
+                                    checkpoint_file='scrape_journal.jsonl', batch_size=50,
+                                    refresh_interval=None, concurrency=8, max_retries=2, mode='browser',
+                                    evaluate_batch=1, rate_limiter=None, storage_mode=STORAGE_MODE,
+                                    queue_run_id=None, processes=1):
+    """
+    Scrape all products with up to `concurrency` search requests in flight.
+    
+    Streams products to the same sinks and returns the same ScrapeStats as
+    scrape_all_products. A background task
+    re-logs in shortly before the token expires (see token_manager.TokenManager), so
+    workers keep using the still-valid token meanwhile. A 401 triggers a single
+    shared re-login; workers that saw the old token just retry with the new one.
+    Finished products are journaled by product code (see scrape_journal), so the
+    order they complete in does not matter for resuming.
+    
+    mode='browser' runs each search as fetch() inside Chromium; mode='http' only
+    uses Chromium to log in and sends searches from Python over pooled keep-alive
+    connections (see airr_api.AirrApiClient).
+    
+    In browser mode, evaluate_batch > 1 resolves that many SKUs per page.evaluate
+    call; the total number of fetches in flight stays at `concurrency`.
+    
+    Request starts are paced by one shared AimdRateLimiter, so `concurrency` is the
+    ceiling and the limiter finds the rate the API is actually happy with.
+    
+    With queue_run_id, product_codes are enqueued for that run in the shared
+    scrape_queue table and this process is one of any number of workers
+    claiming batches from it (see work_queue); the run counts as completed
+    once every worker's SKUs are done.
+    
+    With processes > 1 the SKUs are hash-partitioned over that many worker
+    processes, each with its own browser, login and `concurrency` requests in
+    flight (see shard_workers). Their products all come back to this process
+    and go to the one CSV, journal and database writer.
+    """
+    print(f"\n{'='*60}")
+    print(f"Starting concurrent product scraping session")
+    print(f"Total products: {len(product_codes)}")
+    print(f"Output file: {output_file}")
+    if processes > 1:
+        print(f"Worker processes: {processes}")
+    print(f"Concurrency: {concurrency} requests in flight")
+    print(f"Search mode: {mode}")
+    if mode == 'browser' and evaluate_batch > 1:
+        print(f"Evaluate batch: {evaluate_batch} SKUs per round trip")
+    print(f"Auth refresh: {describe_refresh_policy(refresh_interval)}")
+    print(f"Database storage: {storage_mode}")
+    print(f"{'='*60}\n")
+    
+    stats = ScrapeStats()
+    csv_output = StreamingCsvWriter(output_file)
+    journal = ScrapeJournal(checkpoint_file, before_sync=csv_output.flush)
+    done_codes = journal.load(product_codes)
+    csv_output.append = bool(done_codes)
+    
+    # One run_id for the CSV and live database rows, so the uploader can tell what is already in
+    watermark = UploadWatermark()
+    run_id = queue_run_id or watermark.resolve_run_id(resuming=bool(done_codes))
+    watermark.start(run_id, output_file, csv_output.existing_rows())
+    print(f"Run ID: {run_id}")
+    
+    if not auth_data.get('localStorage', {}).get('token'):
+        print("✗ No token found in authentication data!")
+        return stats
+    
+    work_queue = None
+    if queue_run_id:
+        if not get_database():
+            print("✗ Work queue mode needs database credentials!")
+            return stats
+        work_queue = WorkQueue(get_database(), run_id)
+        print(f"Work queue: worker {work_queue.worker_id}")
+    
+    # Initialize database connection for live updates (written from a background thread)
+    db_conn = init_database()
+    run_log = RunLog(run_id, len(product_codes), storage_mode, stats)
+    # Without a connection (or if it drops for good) rows wait in the local spool
+    db_writer = create_db_writer(db_conn, watermark, storage_mode, run_log, get_database(), DbSpool())
+    completed = False
+    failed = False
+    
+    queue = asyncio.Queue()
+    pending_products = [(index, product_code) for index, product_code in enumerate(product_codes)
+                        if product_code not in done_codes]
+    if not work_queue:
+        for item in pending_products:
+            queue.put_nowait(item)
+    
+    # Work queue mode: finished SKUs are reported with the next claim
+    claim_lock = asyncio.Lock()
+    claim_size = max(evaluate_batch, concurrency * 2)
+    finished = []
+    
+    async def claim_more():
+        """Refill the local queue from scrape_queue; False once the run has nothing left"""
+        while True:
+            reported = finished[:]
+            finished.clear()
+            claimed = await asyncio.to_thread(work_queue.claim, claim_size, reported)
+            for item in claimed:
+                queue.put_nowait(item)
+            if claimed:
+                return True
+            # Stay around while other workers hold SKUs, in case their leases run out
+            counts = await asyncio.to_thread(work_queue.counts)
+            if not counts['pending'] and not counts['claimed_elsewhere']:
+                return False
+            await asyncio.sleep(QUEUE_POLL_SECONDS)
+    
+    async def next_batch(size):
+        if work_queue and queue.empty():
+            async with claim_lock:
+                if queue.empty():
+                    await claim_more()
+        batch = []
+        while len(batch) < size and not queue.empty():
+            batch.append(queue.get_nowait())
+        return batch
+    
+    async def finish_product(index, product_code, product_data, refresh_count):
+        print(f"[{index + 1}/{len(product_codes)}] {product_code} {describe_result(product_data)}")
+        stamp_product(product_data, run_id)
+        stats.add(product_data)
+        stats.reauths = refresh_count
+        csv_output.write_product(product_data)
         
-        print("✓ Database connected - live updates enabled\n")
-        return conn
+        # Queue for the database writer (waits only if the DB falls far behind)
+        await db_writer.submit_async(product_data, csv_output.total_rows())
+        journal.record(product_code, product_data['scrape_status'])
+        if work_queue:
+            finished.append((product_code, product_data['scrape_status']))
+        done = stats.products
         
-    except Exception as e:
-        print(f"⚠️  Database connection failed: {e}")
-        print("   Continuing with CSV-only mode...\n")
-        return None
-
-def upload_to_database_realtime(db_conn, product_data):
-    """Upload a single product's data to database immediately"""
-    if not db_conn:
-        return  # Skip if no database connection
+        # Save checkpoint every batch_size products
+        if done % batch_size == 0:
+            journal.sync()
+            
+            print(f"\n✓ Checkpoint saved after {done} products ({csv_output.rows_written} rows in {output_file})")
+            print(f"  Progress: {((len(done_codes) + done) / len(product_codes)) * 100:.1f}%\n")
     
     try:
-        scraped_at = datetime.now()
-        rows_to_insert = []
+        if work_queue:
+            added = await asyncio.to_thread(work_queue.enqueue, product_codes)
+            print(f"✓ Enqueued {added} new SKU(s) for run {run_id}\n")
         
-        # Process all warehouse locations for this product
-        if product_data['availability_locations']:
-            for location in product_data['availability_locations']:
-                row = (
-                    product_data['product_code'],
-                    product_data['product_name'],
-                    location.get('location_name'),
-                    location.get('location_abbreviation'),
-                    location.get('location_id'),
-                    int(location.get('qty_available', 0)) if location.get('qty_available') else 0,
-                    int(location.get('qty_in_transit', 0)) if location.get('qty_in_transit') else 0,
-                    int(location.get('qty_on_hand', 0)) if location.get('qty_on_hand') else 0,
-                    int(location.get('qty_on_order', 0)) if location.get('qty_on_order') else 0,
-                    product_data['scrape_status'],
-                    product_data.get('error_message'),
-                    scraped_at
-                )
-                rows_to_insert.append(row)
+        if processes > 1:
+            max_rate = rate_limiter.max_rate if rate_limiter else AimdRateLimiter().max_rate
+            searched = await search_in_processes(pending_products, auth_data, finish_product, processes, {
+                'refresh_interval': refresh_interval,
+                'concurrency': concurrency,
+                'max_retries': max_retries,
+                'mode': mode,
+                'evaluate_batch': evaluate_batch,
+                # --max-rate is per account for the whole scrape, not per process
+                'max_rate': max_rate / processes
+            })
         else:
-            # No locations - insert single row
-            row = (
-                product_data['product_code'],
-                product_data['product_name'],
-                None, None, None, None, None, None, None,
-                product_data['scrape_status'],
-                product_data.get('error_message'),
-                scraped_at
-            )
-            rows_to_insert.append(row)
+            searched = await search_products_async(next_batch, auth_data, finish_product, refresh_interval,
+                                                   concurrency, max_retries, mode, evaluate_batch, rate_limiter)
+        if not searched:
+            # The journal stays, so the next run resumes with the SKUs that were not searched
+            failed = True
+            print("\n✗ Scrape stopped before finishing - run it again to continue where it stopped")
+            return stats
         
-        # Insert all rows for this product
-        insert_query = """
-        INSERT INTO airr_product_availability 
-        (product_code, product_name, location_name, location_abbreviation, location_id,
-         qty_available, qty_in_transit, qty_on_hand, qty_on_order,
-         scrape_status, error_message, scraped_at)
-        VALUES %s
-        """
+        # Final save
+        csv_output.close()
         
-        with db_conn.cursor() as cur:
-            execute_values(cur, insert_query, rows_to_insert)
-            db_conn.commit()
-        
-        print(f"    💾 Pushed {len(rows_to_insert)} rows to database")
+        # Remove the journal when complete
+        journal.remove()
+        if work_queue:
+            await asyncio.to_thread(work_queue.complete, finished[:])
+            finished.clear()
+            counts = await asyncio.to_thread(work_queue.counts)
+            print(f"Work queue: {counts['done']} done, {counts['pending'] + counts['claimed']} left, "
+                  f"{work_queue.reclaimed} reclaimed from expired leases")
+            completed = not counts['pending'] and not counts['claimed']
+        else:
+            completed = True
         
+        print(f"\n{'='*60}")
+        print(f"Scraping completed!")
+        print(f"Total products processed: {stats.products}")
+        print(f"Results saved to: {output_file}")
+        print(f"{'='*60}\n")
+    
     except Exception as e:
-        print(f"    ⚠️  Database upload failed: {e}")
-        # Don't fail the scrape if database upload fails
-
-def save_results(scraped_data, output_file, start_index=0):
-    """Save scraped data to CSV - one row per product-location"""
-    if not scraped_data:
-        return
+        print(f"\n✗ Fatal error: {e}")
+        print(f"Partial results saved to: {output_file}")
     
-    flattened_rows = []
-    
-    for item in scraped_data:
-        if item['availability_locations']:
-            # One row per location
-            for location in item['availability_locations']:
-                row = {
-                    'product_code': item['product_code'],
-                    'product_name': item['product_name'],
-                    'location_name': location.get('location_name'),
-                    'location_abbreviation': location.get('location_abbreviation'),
-                    'location_id': location.get('location_id'),
-                    'qty_available': location.get('qty_available'),
-                    'qty_in_transit': location.get('qty_in_transit'),
-                    'qty_on_hand': location.get('qty_on_hand'),
-                    'qty_on_order': location.get('qty_on_order'),
-                    'scrape_status': item['scrape_status'],
-                    'error_message': item['error_message']
-                }
-                flattened_rows.append(row)
-        else:
-            # No locations found - single row
-            row = {
-                'product_code': item['product_code'],
-                'product_name': item['product_name'],
-                'location_name': None,
-                'location_abbreviation': None,
-                'location_id': None,
-                'qty_available': None,
-                'qty_in_transit': None,
-                'qty_on_hand': None,
-                'qty_on_order': None,
-                'scrape_status': item['scrape_status'],
-                'error_message': item['error_message']
-            }
-            flattened_rows.append(row)
+    finally:
+        csv_output.close()
+        journal.close()
+        # Flush pending rows and record the run, then close database connection
+        db_writer.close(completed, failed)
+        if get_database():
+            close_database()
+            print("\n✓ Database connection closed")
     
-    df = pd.DataFrame(flattened_rows)
+    return stats
+
+def init_database():
+    """Check out a pooled database connection and bring the schema up to date"""
+    database = get_database()
+    if not database:
+        print("⚠️  Database credentials not found - skipping live database updates")
+        return None
     
-    # Append to existing file if resuming, otherwise create new
-    if start_index > 0 and os.path.exists(output_file):
-        df.to_csv(output_file, mode='a', header=False, index=False, encoding='utf-8')
-    else:
-        df.to_csv(output_file, index=False, encoding='utf-8')
+    conn = None
+    try:
+        conn = database.get_connection()
+        
+        # Create (or migrate) the tables if needed
+        ensure_schema(conn)
+        
+        print("✓ Database connected - live updates enabled\n")
+        return conn
     
-    print(f"  Saved {len(flattened_rows)} rows ({len(scraped_data)} products) to {output_file}")
+    except Exception as e:
+        # Don't keep a pool slot for a connection nobody will use
+        database.release(conn)
+        print(f"⚠️  Database connection failed: {e}")
+        print("   Rows will be spooled locally until the database is reachable again...\n")
+        return None
+
+def parse_args():
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(description="Scrape AIRR product availability")
+    parser.add_argument('--concurrency', type=int, default=int(os.getenv('SCRAPE_CONCURRENCY', '8')),
+                        help="Search requests kept in flight (default: $SCRAPE_CONCURRENCY or 8)")
+    parser.add_argument('--mode', choices=['browser', 'http'], default=os.getenv('SCRAPE_MODE', 'browser'),
+                        help="Send searches through Chromium or directly over HTTP (default: $SCRAPE_MODE or browser)")
+    parser.add_argument('--evaluate-batch', type=int, default=int(os.getenv('SCRAPE_EVALUATE_BATCH', '1')),
+                        help="SKUs resolved per page.evaluate call in browser mode (default: $SCRAPE_EVALUATE_BATCH or 1)")
+    parser.add_argument('--max-rate', type=float, default=float(os.getenv('SCRAPE_MAX_RATE', '20')),
+                        help="Ceiling for the adaptive request rate of each AIRR account in req/s, shared "
+                             "by all --workers (default: $SCRAPE_MAX_RATE or 20)")
+    parser.add_argument('--refresh-interval', type=int, default=None,
+                        help="Also force a re-login every N products (default: only refresh before token expiry)")
+    parser.add_argument('--storage', choices=['history', 'delta', 'normalized'], default=STORAGE_MODE,
+                        help="Write a full row per product-location, only changed stock, or compact "
+                             "integer-keyed rows "
+                             "(default: $AIRR_STORAGE_MODE or history; set the variable for the uploader too)")
+    parser.add_argument('--queue', metavar='RUN_ID', default=os.getenv('SCRAPE_QUEUE_RUN'),
+                        help="Share run RUN_ID's SKUs with other workers through the scrape_queue table; "
+                             "start every worker with the same RUN_ID (default: $SCRAPE_QUEUE_RUN)")
+    parser.add_argument('--workers', type=int, default=int(os.getenv('SCRAPE_WORKERS', '1')),
+                        help="Worker processes, each with its own browser and login, that split the SKUs "
+                             "between them (default: $SCRAPE_WORKERS or 1)")
+    parser.add_argument('--sequential', action='store_true',
+                        help="Use the original one-product-at-a-time loop")
+    args = parser.parse_args()
+    if args.queue and args.sequential:
+        parser.error("--queue needs the concurrent scraper (drop --sequential)")
+    if args.workers > 1 and args.sequential:
+        parser.error("--workers needs the concurrent scraper (drop --sequential)")
+    if args.workers > 1 and args.queue:
+        parser.error("--workers and --queue don't combine; start one --queue process per worker instead")
+    return args
 
 def main():
     """Main execution"""
+    args = parse_args()
+    
     print("Loading authentication data...")
     auth_data = load_auth_data('cookies.json')
     if not auth_data:
@@ -582,25 +1037,37 @@ def main():
     if not product_codes:
         return
     
-    scraped_data = scrape_all_products(
-        product_codes=product_codes,
-        auth_data=auth_data,
-        output_file='airr_product_data.csv',
-        checkpoint_file='scrape_checkpoint.json',
-        batch_size=50,
-        refresh_interval=10  # Refresh auth every 10 products (more frequent due to short token expiry)
-    )
-    
-    if scraped_data:
-        success_count = sum(1 for item in scraped_data if item['scrape_status'] == 'success')
-        error_count = sum(1 for item in scraped_data if item['scrape_status'] == 'error')
-        total_locations = sum(len(item['availability_locations']) for item in scraped_data)
-        
-        print("\nSummary:")
-        print(f"  Successful: {success_count}")
-        print(f"  Errors: {error_count}")
-        print(f"  Total products: {len(scraped_data)}")
-        print(f"  Total location records: {total_locations}")
+    if args.sequential:
+        stats = scrape_all_products(
+            product_codes=product_codes,
+            auth_data=auth_data,
+            output_file='airr_product_data.csv',
+            checkpoint_file='scrape_journal.jsonl',
+            batch_size=50,
+            refresh_interval=args.refresh_interval,
+            rate_limiter=AimdRateLimiter(max_rate=args.max_rate),
+            storage_mode=args.storage,
+            evaluate_batch=args.evaluate_batch
+        )
+    else:
+        stats = asyncio.run(scrape_all_products_async(
+            product_codes=product_codes,
+            auth_data=auth_data,
+            output_file='airr_product_data.csv',
+            checkpoint_file='scrape_journal.jsonl',
+            batch_size=50,
+            refresh_interval=args.refresh_interval,
+            concurrency=args.concurrency,
+            mode=args.mode,
+            evaluate_batch=args.evaluate_batch,
+            rate_limiter=AimdRateLimiter(max_rate=args.max_rate),
+            storage_mode=args.storage,
+            queue_run_id=args.queue,
+            processes=args.workers
+        ))
+    
+    if stats.products:
+        stats.print_summary()
 
 if __name__ == "__main__":
     main()
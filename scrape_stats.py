@@ -0,0 +1,35 @@
+"""
+Running totals for a scrape run.
+
+The engines hand each finished product to its sinks (CSV, database, journal)
+and then only count it here, so memory use does not grow with the number of
+products scraped.
+"""
+
+class ScrapeStats:
+    """Counts finished products"""
+    
+    def __init__(self):
+        self.products = 0
+        self.success = 0
+        self.errors = 0
+        self.locations = 0
+        # Re-logins during the run (set by the engines)
+        self.reauths = 0
+    
+    def add(self, product_data):
+        """Count one finished product"""
+        self.products += 1
+        if product_data['scrape_status'] == 'success':
+            self.success += 1
+        elif product_data['scrape_status'] == 'error':
+            self.errors += 1
+        self.locations += len(product_data['availability_locations'])
+    
+    def print_summary(self):
+        """Print the end-of-run summary"""
+        print("\nSummary:")
+        print(f"  Successful: {self.success}")
+        print(f"  Errors: {self.errors}")
+        print(f"  Total products: {self.products}")
+        print(f"  Total location records: {self.locations}")
@@ -0,0 +1,109 @@
+"""
+Single-host multi-process scraping (--workers N).
+
+One Python process spends most of its time waiting on its one page. A
+--workers run therefore hash-partitions the SKU list over N worker
+processes. Each worker runs its own Chromium, logs in with its own token
+and searches its shard with the usual concurrency and rate limiting (see
+scrape_products_with_cookies.search_products_async). Finished products
+travel back over a multiprocessing queue to the parent process. The parent
+owns the CSV, the journal and the single database writer, so a --workers
+run leaves exactly what a one-process run would.
+
+Shards come from the CRC32 of the product code, so a SKU lands in the
+same shard on every run whatever PYTHONHASHSEED is.
+"""
+import zlib
+import queue
+import asyncio
+import multiprocessing
+
+def shard_of(product_code, shards):
+    """Shard number of a product code"""
+    return zlib.crc32(str(product_code).encode('utf-8')) % shards
+
+def partition(items, shards):
+    """Split (index, product_code) pairs into `shards` lists, keeping their order"""
+    parts = [[] for _ in range(shards)]
+    for index, product_code in items:
+        parts[shard_of(product_code, shards)].append((index, product_code))
+    return parts
+
+def _run_shard(shard, items, auth_data, options, results):
+    """Worker process: search one shard and send every product back to the parent"""
+    from scrape_products_with_cookies import search_products_async
+    from rate_limiter import AimdRateLimiter
+    
+    pending = list(items)
+    
+    async def next_batch(size):
+        batch = pending[:size]
+        del pending[:size]
+        return batch
+    
+    async def on_product(index, product_code, product_data, refresh_count):
+        results.put(('product', shard, index, product_code, product_data, refresh_count))
+    
+    try:
+        options = dict(options)
+        limiter = AimdRateLimiter(max_rate=options.pop('max_rate'))
+        searched = asyncio.run(search_products_async(next_batch, auth_data, on_product,
+                                                     rate_limiter=limiter, **options))
+        results.put(('finished', shard, searched, None))
+    except Exception as e:
+        results.put(('finished', shard, False, str(e)))
+
+async def search_in_processes(items, auth_data, on_product, processes, options):
+    """
+    Search (index, product_code) `items` in `processes` worker processes and
+    pass every product to on_product in this process, like
+    search_products_async does. `options` holds search_products_async's
+    keyword arguments, plus max_rate for each worker's rate limiter. Returns
+    True only if every worker finished its shard.
+    """
+    # spawn, not fork: Playwright and the database pool don't survive a fork
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    parts = partition(items, processes)
+    workers = []
+    for shard, part in enumerate(parts):
+        if part:
+            worker = context.Process(target=_run_shard, args=(shard, part, auth_data, options, results),
+                                     name=f"scrape-worker-{shard}", daemon=True)
+            worker.start()
+            workers.append(worker)
+    print(f"✓ Started {len(workers)} worker processes "
+          f"(SKUs per worker: {', '.join(str(len(part)) for part in parts)})\n")
+    
+    refreshes = {}
+    running = len(workers)
+    failed = 0
+    try:
+        while running:
+            try:
+                message = await asyncio.to_thread(results.get, True, 1.0)
+            except queue.Empty:
+                if not any(worker.is_alive() for worker in workers):
+                    print(f"✗ {running} worker process(es) exited without finishing")
+                    failed += running
+                    break
+                continue
+            
+            kind, shard = message[:2]
+            if kind == 'product':
+                index, product_code, product_data, refresh_count = message[2:]
+                refreshes[shard] = refresh_count
+                await on_product(index, product_code, product_data, sum(refreshes.values()))
+            else:
+                searched, error = message[2:]
+                running -= 1
+                if not searched:
+                    failed += 1
+                    print(f"✗ Worker {shard} did not finish its shard{f': {error}' if error else ''}")
+    finally:
+        for worker in workers:
+            worker.join(timeout=5)
+            if worker.is_alive():
+                worker.terminate()
+    
+    return failed == 0
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Test the local spool for live database writes (no database needed)
+"""
+import tempfile
+from datetime import datetime
+from db_spool import DbSpool
+from db_writer import product_rows
+
+def sample_rows(code):
+    """Database rows of one product, as the live writer builds them"""
+    return product_rows({
+        'product_code': code,
+        'product_name': f"Product {code}",
+        'availability_locations': [{'location_id': 'SYD', 'location_name': 'Sydney', 'qty_available': '3'}],
+        'scrape_status': 'success',
+        'error_message': None,
+        'scraped_at': datetime(2025, 1, 1, 17, 0, 5),
+        'run_id': 'run-1'
+    })
+
+def test_round_trip():
+    """Spooled batches read back exactly as they were written"""
+    print("Testing spool round trip...")
+    with tempfile.TemporaryDirectory() as directory:
+        spool = DbSpool(directory)
+        spool.append(sample_rows('A1'), [(0, 1)], 'run-1')
+        spool.append(sample_rows('A2'), [(1, 2)], 'run-1')
+        spool.close()
+        handle = spool.claim(spool.segments()[0])
+        batches = spool.read(handle)
+        spool.remove(spool.segments()[0], handle)
+        ok = (batches == [('run-1', [(0, 1)], sample_rows('A1')), ('run-1', [(1, 2)], sample_rows('A2'))]
+              and not spool.pending())
+    print(f"{'✓' if ok else '✗'} {len(batches)} batches back, spool empty")
+    return ok
+
+def test_torn_line():
+    """A batch cut short by a crash is skipped, the ones before it are kept"""
+    print("\nTesting a torn last line...")
+    with tempfile.TemporaryDirectory() as directory:
+        spool = DbSpool(directory)
+        spool.append(sample_rows('B1'), [], 'run-1')
+        spool.close()
+        with open(spool.segments()[0], 'a', encoding='utf-8') as f:
+            f.write('{"run_id": "run-1", "rows": [["B2", ')
+        handle = spool.claim(spool.segments()[0])
+        batches = spool.read(handle)
+        handle.close()
+        ok = len(batches) == 1 and batches[0][2] == sample_rows('B1')
+    print(f"{'✓' if ok else '✗'} {len(batches)} complete batch kept")
+    return ok
+
+def test_segment_in_use():
+    """A segment still being appended to cannot be claimed for replay"""
+    print("\nTesting a segment in use...")
+    with tempfile.TemporaryDirectory() as directory:
+        spool = DbSpool(directory)
+        spool.append(sample_rows('C1'), [], 'run-1')
+        busy = spool.claim(spool.segments()[0])
+        spool.close()
+        handle = spool.claim(spool.segments()[0])
+        ok = busy is None and handle is not None
+        if handle:
+            handle.close()
+    print(f"{'✓' if ok else '✗'} claimed only once closed")
+    return ok
+
+def test_segment_roll():
+    """A full segment is closed and the next batch starts a new one"""
+    print("\nTesting segment rolling...")
+    with tempfile.TemporaryDirectory() as directory:
+        spool = DbSpool(directory, segment_bytes=1)
+        for number in range(3):
+            spool.append(sample_rows(f"D{number}"), [], 'run-1')
+        spool.close()
+        ok = len(spool.segments()) == 3 and spool.rows_spooled == 3
+    print(f"{'✓' if ok else '✗'} {len(spool.segments())} segments")
+    return ok
+
+def main():
+    print("="*60)
+    print("Database Spool Test")
+    print("="*60)
+    print()
+    
+    results = {
+        'Round Trip': test_round_trip(),
+        'Torn Line': test_torn_line(),
+        'Segment In Use': test_segment_in_use(),
+        'Segment Roll': test_segment_roll()
+    }
+    
+    print()
+    print("="*60)
+    for test_name, result in results.items():
+        status = "✓ PASS" if result else "✗ FAIL"
+        print(f"{test_name:.<40} {status}")
+    print("="*60)
+    return 0 if all(results.values()) else 1
+
+if __name__ == '__main__':
+    exit(main())
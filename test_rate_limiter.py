@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Test the AIMD request pacing in rate_limiter (no network needed)
+"""
+from rate_limiter import AimdRateLimiter
+
+def healthy():
+    """A successful scrape, as the engines feed it back"""
+    return {'scrape_status': 'success', 'error_message': None}
+
+def failed(message):
+    """A failed scrape with the given error message"""
+    return {'scrape_status': 'error', 'error_message': message}
+
+def after_cooldown(limiter):
+    """Let the next failure cut the rate without waiting out the cooldown"""
+    limiter.last_decrease = -limiter.cooldown
+    return limiter
+
+def test_slow_start():
+    """Before the first cut every healthy response adds a fixed step"""
+    print("Testing slow start...")
+    limiter = AimdRateLimiter(initial_rate=2.0, max_rate=100.0)
+    for _ in range(10):
+        limiter.record(healthy(), 0.1)
+    ok = limiter.slow_start and abs(limiter.rate - 7.0) < 1e-9
+    print(f"{'✓' if ok else '✗'} 2.0 -> {limiter.rate:.1f} req/s after 10 responses")
+    return ok
+
+def test_additive_increase():
+    """After a cut the rate grows by about `increase` per second of requests"""
+    print("\nTesting additive increase...")
+    limiter = AimdRateLimiter(initial_rate=8.0, increase=0.5, max_rate=100.0)
+    limiter.record(failed('HTTP 429: Too Many Requests'), 0.1)
+    after_cut = limiter.rate
+    # One second's worth of responses at the current rate
+    for _ in range(int(after_cut)):
+        limiter.record(healthy(), 0.1)
+    gained = limiter.rate - after_cut
+    ok = not limiter.slow_start and 0.4 < gained < 0.6
+    print(f"{'✓' if ok else '✗'} {after_cut:.1f} -> {limiter.rate:.2f} req/s")
+    return ok
+
+def test_multiplicative_decrease():
+    """429s, 5xx and network errors each halve the rate; 401 and 404 do not"""
+    print("\nTesting multiplicative decrease...")
+    limiter = AimdRateLimiter(initial_rate=16.0, decrease=0.5)
+    rates = []
+    for message in ['HTTP 429: Too Many Requests', 'HTTP 503: Service Unavailable', 'HTTP N/A: timeout']:
+        after_cooldown(limiter).record(failed(message), 0.1)
+        rates.append(limiter.rate)
+    before = limiter.rate
+    after_cooldown(limiter).record(failed('HTTP 401: Unauthorized'), 0.1)
+    after_cooldown(limiter).record(failed('HTTP 404: Not Found'), 0.1)
+    ok = rates == [8.0, 4.0, 2.0] and limiter.rate > before and limiter.slowdowns == 3
+    print(f"{'✓' if ok else '✗'} 16 -> {' -> '.join(f'{rate:g}' for rate in rates)}, auth errors not counted")
+    return ok
+
+def test_cooldown():
+    """A burst of failures inside one cooldown counts as a single cut"""
+    print("\nTesting cooldown...")
+    limiter = AimdRateLimiter(initial_rate=10.0, cooldown=60.0)
+    for _ in range(5):
+        limiter.record(failed('HTTP 429: Too Many Requests'), 0.1)
+    ok = limiter.rate == 5.0 and limiter.slowdowns == 1
+    print(f"{'✓' if ok else '✗'} 5 failures, {limiter.slowdowns} cut")
+    return ok
+
+def test_bounds():
+    """The rate never leaves [min_rate, max_rate]"""
+    print("\nTesting bounds...")
+    limiter = AimdRateLimiter(initial_rate=1.0, min_rate=0.5, max_rate=4.0)
+    for _ in range(50):
+        limiter.record(healthy(), 0.1)
+    top = limiter.rate
+    for _ in range(10):
+        after_cooldown(limiter).record(failed('HTTP 500: Internal Server Error'), 0.1)
+    ok = top == 4.0 and limiter.rate == 0.5
+    print(f"{'✓' if ok else '✗'} capped at {top:g}, floored at {limiter.rate:g} req/s")
+    return ok
+
+def test_latency_spike():
+    """A response much slower than the running baseline counts as a failure"""
+    print("\nTesting latency spikes...")
+    limiter = AimdRateLimiter(initial_rate=8.0, max_rate=8.0, spike_factor=3.0)
+    for _ in range(10):
+        limiter.record(healthy(), 0.1)
+    limiter.record(healthy(), 1.0)
+    ok = limiter.rate == 4.0 and limiter.slowdowns == 1
+    print(f"{'✓' if ok else '✗'} 1.0s vs 0.1s baseline cut the rate to {limiter.rate:g}")
+    return ok
+
+def main():
+    print("="*60)
+    print("AIMD Rate Limiter Test")
+    print("="*60)
+    print()
+    
+    results = {
+        'Slow Start': test_slow_start(),
+        'Additive Increase': test_additive_increase(),
+        'Multiplicative Decrease': test_multiplicative_decrease(),
+        'Cooldown': test_cooldown(),
+        'Bounds': test_bounds(),
+        'Latency Spike': test_latency_spike()
+    }
+    
+    print()
+    print("="*60)
+    for test_name, result in results.items():
+        status = "✓ PASS" if result else "✗ FAIL"
+        print(f"{test_name:.<40} {status}")
+    print("="*60)
+    return 0 if all(results.values()) else 1
+
+if __name__ == '__main__':
+    exit(main())
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Test the resume journal in scrape_journal (no browser or database needed)
+"""
+import os
+import json
+import tempfile
+import scrape_journal
+from scrape_journal import ScrapeJournal
+
+def test_round_trip():
+    """Recorded products are reported as done by the next run"""
+    print("Testing journal round trip...")
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'journal.jsonl')
+        journal = ScrapeJournal(path)
+        journal.record('A1', 'success')
+        journal.record('A2', 'error')
+        journal.close()
+        done = ScrapeJournal(path).load()
+        ok = done == {'A1', 'A2'}
+    print(f"{'✓' if ok else '✗'} {len(done)} products done")
+    return ok
+
+def test_torn_line():
+    """A line torn by a crash is skipped, and the next record starts on a new line"""
+    print("\nTesting a torn last line...")
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'journal.jsonl')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({'product_code': 'B1', 'status': 'success'}) + '\n')
+            f.write('{"product_code": "B2", "sta')
+        journal = ScrapeJournal(path)
+        after_crash = journal.load()
+        journal.record('B3', 'success')
+        journal.close()
+        done = ScrapeJournal(path).load()
+        ok = after_crash == {'B1'} and done == {'B1', 'B3'}
+    print(f"{'✓' if ok else '✗'} torn B2 dropped, B3 readable after it")
+    return ok
+
+def test_output_synced_first():
+    """before_sync runs before the journal reaches disk"""
+    print("\nTesting output flush before sync...")
+    with tempfile.TemporaryDirectory() as directory:
+        calls = []
+        journal = ScrapeJournal(os.path.join(directory, 'journal.jsonl'), fsync_every=2,
+                                fsync_interval=3600, before_sync=lambda: calls.append(journal.unsynced))
+        journal.record('C1', 'success')
+        journal.record('C2', 'success')
+        journal.close()
+        ok = calls == [2]
+    print(f"{'✓' if ok else '✗'} flushed once, with {calls[0] if calls else 0} records pending")
+    return ok
+
+def test_legacy_checkpoint():
+    """An old index-based checkpoint marks the products up to last_index as done"""
+    print("\nTesting the legacy checkpoint...")
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            with open(scrape_journal.LEGACY_CHECKPOINT_FILE, 'w') as f:
+                json.dump({'last_index': 1}, f)
+            journal = ScrapeJournal('journal.jsonl')
+            done = journal.load(['D1', 'D2', 'D3'])
+            journal.remove()
+            ok = done == {'D1', 'D2'} and not os.path.exists(scrape_journal.LEGACY_CHECKPOINT_FILE)
+        finally:
+            os.chdir(cwd)
+    print(f"{'✓' if ok else '✗'} {sorted(done)} done, checkpoint removed with the journal")
+    return ok
+
+def main():
+    print("="*60)
+    print("Scrape Journal Test")
+    print("="*60)
+    print()
+    
+    results = {
+        'Round Trip': test_round_trip(),
+        'Torn Line': test_torn_line(),
+        'Output Synced First': test_output_synced_first(),
+        'Legacy Checkpoint': test_legacy_checkpoint()
+    }
+    
+    print()
+    print("="*60)
+    for test_name, result in results.items():
+        status = "✓ PASS" if result else "✗ FAIL"
+        print(f"{test_name:.<40} {status}")
+    print("="*60)
+    return 0 if all(results.values()) else 1
+
+if __name__ == '__main__':
+    exit(main())
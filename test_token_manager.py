@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Test the token lifetime tracking in token_manager (no network or browser needed)
+"""
+import json
+import time
+import base64
+from token_manager import TokenManager, MIN_LEARNED_LIFETIME, LEARN_AFTER_FAILURES
+
+def make_jwt(lifetime):
+    """An unsigned JWT whose claims give it `lifetime` seconds"""
+    now = int(time.time())
+    payload = base64.urlsafe_b64encode(json.dumps({'iat': now, 'exp': now + lifetime}).encode()).decode().rstrip('=')
+    return f"e30.{payload}.sig"
+
+def reject_at(tokens, token, age):
+    """Make the current token look `age` seconds old and report a 401 on it"""
+    tokens.issued_at = time.time() - age
+    tokens.record_auth_failure(token)
+
+def test_jwt_expiry():
+    """The expiry comes from the JWT claims"""
+    print("Testing JWT expiry...")
+    tokens = TokenManager(make_jwt(3600))
+    ok = abs(tokens.lifetime() - 3600) < 2 and not tokens.needs_refresh()
+    print(f"{'✓' if ok else '✗'} lifetime {tokens.lifetime():.0f}s")
+    return ok
+
+def test_single_401_is_not_learned():
+    """One stray 401 shortly after a login must not cap later tokens"""
+    print("\nTesting a single early 401...")
+    tokens = TokenManager('opaque-1')
+    reject_at(tokens, 'opaque-1', 2)
+    refresh_now = tokens.needs_refresh()
+    tokens.set_token('opaque-2')
+    ok = refresh_now and tokens.observed_lifetime is None and tokens.lifetime() is None
+    print(f"{'✓' if ok else '✗'} rejected token refreshed once, nothing learned")
+    return ok
+
+def test_repeated_401s_are_learned():
+    """Tokens rejected at a steady age teach the lifetime, never below the floor"""
+    print("\nTesting repeated 401s...")
+    tokens = TokenManager('opaque-0')
+    for number in range(LEARN_AFTER_FAILURES):
+        token = f"opaque-{number}"
+        tokens.set_token(token)
+        reject_at(tokens, token, 5 + number)
+    tokens.set_token('opaque-next')
+    ok = tokens.observed_lifetime == MIN_LEARNED_LIFETIME and abs(tokens.lifetime() - MIN_LEARNED_LIFETIME) < 2
+    print(f"{'✓' if ok else '✗'} learned {tokens.observed_lifetime}s (floor {MIN_LEARNED_LIFETIME}s)")
+    return ok
+
+def test_inconsistent_401s_are_not_learned():
+    """401s at very different ages are not a lifetime"""
+    print("\nTesting scattered 401s...")
+    tokens = TokenManager('opaque-0')
+    for number, age in enumerate([400, 1500, 3600]):
+        token = f"opaque-{number}"
+        tokens.set_token(token)
+        reject_at(tokens, token, age)
+    ok = tokens.observed_lifetime is None
+    print(f"{'✓' if ok else '✗'} nothing learned")
+    return ok
+
+def test_jwt_revocation_is_not_learned():
+    """401s before the JWT expiry are revocations, not a shorter lifetime"""
+    print("\nTesting 401s before the JWT expiry...")
+    tokens = TokenManager()
+    for number in range(LEARN_AFTER_FAILURES + 1):
+        token = make_jwt(3600) + str(number)
+        tokens.set_token(token)
+        reject_at(tokens, token, 600)
+    tokens.set_token(make_jwt(3600))
+    ok = tokens.observed_lifetime is None and abs(tokens.lifetime() - 3600) < 2
+    print(f"{'✓' if ok else '✗'} JWT lifetime kept")
+    return ok
+
+def test_learned_lifetime_recovers():
+    """A token that outlives the learned lifetime makes it forget it"""
+    print("\nTesting recovery...")
+    tokens = TokenManager('opaque-old')
+    tokens.observed_lifetime = 600
+    tokens.issued_at = time.time() - 900
+    tokens.set_token('opaque-new')
+    ok = tokens.observed_lifetime is None and tokens.lifetime() is None
+    print(f"{'✓' if ok else '✗'} learned lifetime forgotten")
+    return ok
+
+def main():
+    print("="*60)
+    print("Token Manager Test")
+    print("="*60)
+    print()
+    
+    results = {
+        'JWT Expiry': test_jwt_expiry(),
+        'Single 401': test_single_401_is_not_learned(),
+        'Repeated 401s': test_repeated_401s_are_learned(),
+        'Scattered 401s': test_inconsistent_401s_are_not_learned(),
+        'JWT Revocation': test_jwt_revocation_is_not_learned(),
+        'Recovery': test_learned_lifetime_recovers()
+    }
+    
+    print()
+    print("="*60)
+    for test_name, result in results.items():
+        status = "✓ PASS" if result else "✗ FAIL"
+        print(f"{test_name:.<40} {status}")
+    print("="*60)
+    return 0 if all(results.values()) else 1
+
+if __name__ == '__main__':
+    exit(main())
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Test the upload watermark and the row keys shared by the live writer and the
+uploader (no database needed)
+"""
+import os
+import tempfile
+from datetime import datetime
+from upload_watermark import UploadWatermark
+from db_writer import product_rows
+from csv_writer import flatten_product
+
+def test_contiguous_ranges():
+    """The watermark only moves past ranges committed without a gap"""
+    print("Testing out-of-order commits...")
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'watermark.json')
+        watermark = UploadWatermark(path)
+        watermark.start('run-1', 'out.csv', 0)
+        watermark.committed(10, 20)
+        behind = watermark.rows
+        watermark.committed(0, 10)
+        ok = behind == 0 and watermark.rows == 20 and UploadWatermark(path).rows == 20
+    print(f"{'✓' if ok else '✗'} waited at {behind}, then moved to 20 and was saved")
+    return ok
+
+def test_skip_rows():
+    """The uploader only skips rows of the same run and file"""
+    print("\nTesting skipped rows...")
+    with tempfile.TemporaryDirectory() as directory:
+        watermark = UploadWatermark(os.path.join(directory, 'watermark.json'))
+        watermark.mark_uploaded('run-1', '/data/out.csv', 42)
+        ok = (watermark.skip_rows('run-1', 'out.csv') == 42
+              and watermark.skip_rows('run-2', 'out.csv') == 0
+              and watermark.skip_rows('run-1', 'other.csv') == 0)
+    print(f"{'✓' if ok else '✗'} 42 rows for run-1/out.csv, none otherwise")
+    return ok
+
+def test_resume_mismatch():
+    """Resuming a file the watermark does not cover stops tracking"""
+    print("\nTesting resume of an uncovered file...")
+    with tempfile.TemporaryDirectory() as directory:
+        watermark = UploadWatermark(os.path.join(directory, 'watermark.json'))
+        watermark.mark_uploaded('run-1', 'out.csv', 30)
+        watermark.start('run-1', 'out.csv', 50)
+        watermark.committed(50, 60)
+        ok = not watermark.tracking and watermark.rows == 30
+    print(f"{'✓' if ok else '✗'} watermark left at 30")
+    return ok
+
+def test_error_row_key():
+    """A product without locations has the same key in the database and the CSV"""
+    print("\nTesting the key of error rows...")
+    product = {
+        'product_code': 'E1',
+        'product_name': None,
+        'availability_locations': [],
+        'scrape_status': 'error',
+        'error_message': 'HTTP 500',
+        'scraped_at': datetime(2025, 1, 1, 17, 0),
+        'run_id': 'run-1'
+    }
+    live_row = product_rows(product)[0]
+    csv_row = flatten_product(product)[0]
+    # The uploader reads missing CSV values as ''
+    ok = live_row[4] == '' and (csv_row.get('location_id') or '') == live_row[4]
+    print(f"{'✓' if ok else '✗'} location_id {live_row[4]!r} on both paths")
+    return ok
+
+def main():
+    print("="*60)
+    print("Upload Watermark Test")
+    print("="*60)
+    print()
+    
+    results = {
+        'Contiguous Ranges': test_contiguous_ranges(),
+        'Skipped Rows': test_skip_rows(),
+        'Resume Mismatch': test_resume_mismatch(),
+        'Error Row Key': test_error_row_key()
+    }
+    
+    print()
+    print("="*60)
+    for test_name, result in results.items():
+        status = "✓ PASS" if result else "✗ FAIL"
+        print(f"{test_name:.<40} {status}")
+    print("="*60)
+    return 0 if all(results.values()) else 1
+
+if __name__ == '__main__':
+    exit(main())
@@ -0,0 +1,117 @@
+"""
+One AIRR token shared by every scraper process on the machine.
+
+Each scraper logs in when it starts and again whenever its token runs out.
+With several running side by side (--workers, several --queue workers on
+one host, or overlapping cron runs) that used to mean one login per process
+per refresh, and a new login can end the other sessions. The TokenBroker
+keeps the current token in a small JSON file instead (AIRR_TOKEN_CACHE,
+default auth_token.json). A process reads its token from there and only
+logs in when the cached one is missing, expired or the one it saw
+rejected. That login runs under an exclusive file lock, and whoever waited
+on the lock finds the new token already there. So it is one login per
+refresh however many processes there are.
+"""
+import os
+import json
+import time
+import asyncio
+from token_manager import decode_jwt_claims
+
+try:
+    import fcntl
+except ImportError:
+    # No cross-process locking on Windows; processes there may log in side by side
+    fcntl = None
+
+TOKEN_CACHE_FILE = os.getenv('AIRR_TOKEN_CACHE', 'auth_token.json')
+# A cached token without a JWT expiry is only reused for this long
+REUSE_SECONDS = int(os.getenv('AIRR_TOKEN_REUSE_SECONDS', '300'))
+
+def token_expiry(token, issued_at):
+    """When a token issued at `issued_at` expires, from its JWT claims, or None"""
+    claims = decode_jwt_claims(token) or {}
+    expires, issued = claims.get('exp'), claims.get('iat')
+    if not isinstance(expires, (int, float)):
+        return None
+    if isinstance(issued, (int, float)) and expires > issued:
+        return issued_at + (expires - issued)
+    return expires
+
+class TokenBroker:
+    """File-locked cache of the current token; `serial` goes up with every login"""
+    
+    def __init__(self, path=TOKEN_CACHE_FILE, reuse_seconds=REUSE_SECONDS):
+        self.path = path
+        self.lock_path = f"{path}.lock"
+        self.reuse_seconds = reuse_seconds
+    
+    def load(self):
+        """The cached entry ({token, serial, issued_at, expires_at}), or None"""
+        try:
+            with open(self.path, 'r') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return entry if isinstance(entry, dict) and entry.get('token') else None
+    
+    def usable(self, entry):
+        """True if a cached entry has not expired"""
+        if not entry:
+            return False
+        now = time.time()
+        if entry.get('expires_at'):
+            return entry['expires_at'] > now
+        return now - entry.get('issued_at', 0) < self.reuse_seconds
+    
+    def _save(self, entry):
+        # Written atomically and readable by this user only: the token is a credential
+        tmp_path = f"{self.path}.tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, self.path)
+    
+    async def _lock(self):
+        handle = open(self.lock_path, 'a')
+        if fcntl:
+            try:
+                # Waiting for another process's login must not stall this event loop
+                await asyncio.to_thread(fcntl.flock, handle.fileno(), fcntl.LOCK_EX)
+            except BaseException:
+                # Cancelled (or failed) while waiting: the caller never gets the handle
+                handle.close()
+                raise
+        return handle
+    
+    async def refresh(self, login, stale_serial=None):
+        """
+        The shared token, as long as it is not the one numbered stale_serial.
+        
+        If the cached token is still good (and not stale) it is returned as is;
+        otherwise `login` (async, returns a token or None) runs under the file
+        lock and its token replaces the cached one. Returns (entry, logged_in);
+        entry is None if the login failed.
+        """
+        handle = await self._lock()
+        try:
+            entry = self.load()
+            if self.usable(entry) and entry.get('serial') != stale_serial:
+                return entry, False
+            
+            token = await login()
+            if not token:
+                return None, True
+            now = time.time()
+            entry = {
+                'token': token,
+                'serial': (entry or {}).get('serial', 0) + 1,
+                'issued_at': now,
+                'expires_at': token_expiry(token, now),
+                'pid': os.getpid()
+            }
+            self._save(entry)
+            return entry, True
+        finally:
+            # Closing the file releases the lock
+            handle.close()
@@ -0,0 +1,200 @@
+"""
+Token lifetime tracking for the AIRR API token.
+
+Instead of re-logging in every N products, the scraper asks the TokenManager
+when the current token will expire and refreshes shortly before that. The
+expiry comes from the JWT 'exp' claim when the token is a JWT. Otherwise it
+is learned from the age of tokens at their 401s, but only once several tokens
+in a row were rejected at about the same age: a single 401 can just as well
+come from a concurrent login or a server hiccup. A learned lifetime is never
+below MIN_LEARNED_LIFETIME and is forgotten again once a token outlives it.
+
+With a TokenBroker (see token_broker) refreshes go through the token shared
+by every scraper process on the machine, so only one of them logs in.
+"""
+import os
+import json
+import time
+import base64
+import asyncio
+
+def decode_jwt_claims(token):
+    """Return the payload claims of a JWT, or None if the token is not one"""
+    try:
+        parts = token.split('.')
+        if len(parts) != 3:
+            return None
+        payload = parts[1] + '=' * (-len(parts[1]) % 4)
+        claims = json.loads(base64.urlsafe_b64decode(payload))
+        return claims if isinstance(claims, dict) else None
+    except (ValueError, AttributeError):
+        return None
+
+# Tokens in a row rejected at a similar age before their lifetime is learned
+LEARN_AFTER_FAILURES = 3
+# Shortest token lifetime that can be learned from 401s
+MIN_LEARNED_LIFETIME = int(os.getenv('AIRR_TOKEN_MIN_LIFETIME', '300'))
+
+class TokenManager:
+    """Holds the current token and decides when it should be refreshed"""
+    
+    def __init__(self, token=None, refresh_margin=60, idle_check=30, broker=None):
+        self.refresh_margin = refresh_margin
+        self.idle_check = idle_check
+        self.broker = broker
+        # Broker serial of the current token
+        self.serial = None
+        self.token = None
+        self.generation = 0
+        self.issued_at = None
+        self.expires_at = None
+        # Lifetime from the JWT claims of the current token, if it has them
+        self.claimed_lifetime = None
+        self.observed_lifetime = None
+        # Ages at which recent tokens were rejected, and whether the current one was
+        self.failure_ages = []
+        self.rejected = False
+        self.refresh_count = 0
+        self._lock = None
+        if token:
+            self.set_token(token)
+    
+    def set_token(self, token, issued_at=None):
+        """Adopt a freshly issued token and work out when it expires"""
+        now = issued_at or time.time()
+        claims = decode_jwt_claims(token) or {}
+        self._retire_token(now)
+        
+        self.token = token
+        self.generation += 1
+        self.issued_at = now
+        self.expires_at = None
+        self.claimed_lifetime = None
+        self.rejected = False
+        
+        if isinstance(claims.get('exp'), (int, float)):
+            self.expires_at = claims['exp']
+            # Trust our own clock for the lifetime in case the server's is skewed
+            if isinstance(claims.get('iat'), (int, float)) and claims['exp'] > claims['iat']:
+                self.expires_at = now + (claims['exp'] - claims['iat'])
+            self.claimed_lifetime = self.expires_at - now
+        
+        if self.observed_lifetime:
+            learned_expiry = now + self.observed_lifetime
+            self.expires_at = min(self.expires_at or learned_expiry, learned_expiry)
+    
+    def adopt(self, entry):
+        """Switch to the broker's token entry"""
+        if entry['token'] != self.token:
+            self.set_token(entry['token'], entry.get('issued_at'))
+        self.serial = entry.get('serial')
+    
+    def _retire_token(self, now):
+        # A token that was replaced without a 401 breaks any run of rejections
+        if self.token is None or self.rejected:
+            return
+        self.failure_ages = []
+        if self.observed_lifetime and now - self.issued_at >= self.observed_lifetime:
+            print(f"  ⏱  Token outlived the learned {self.observed_lifetime:.0f}s lifetime - forgetting it")
+            self.observed_lifetime = None
+    
+    def record_auth_failure(self, token):
+        """Note a 401 on the current token and learn its lifetime once 401s come at a steady age"""
+        if token != self.token or self.issued_at is None:
+            return
+        now = time.time()
+        # This token is done either way; refresh it once
+        self.expires_at = now
+        if self.rejected:
+            return
+        self.rejected = True
+        
+        age = now - self.issued_at
+        if self.claimed_lifetime and age < self.claimed_lifetime:
+            # Rejected before its JWT expiry: revoked, not expired, so nothing to learn
+            self.failure_ages = []
+            return
+        self.failure_ages = (self.failure_ages + [age])[-LEARN_AFTER_FAILURES:]
+        if len(self.failure_ages) < LEARN_AFTER_FAILURES:
+            return
+        if max(self.failure_ages) > 2 * min(self.failure_ages):
+            return
+        
+        lifetime = max(min(self.failure_ages), MIN_LEARNED_LIFETIME)
+        if lifetime != self.observed_lifetime:
+            self.observed_lifetime = lifetime
+            print(f"  ⏱  Tokens rejected after about {lifetime:.0f}s - refreshing before that from now on")
+    
+    def lifetime(self):
+        """Expected lifetime of the current token in seconds, if known"""
+        if self.expires_at is None or self.issued_at is None:
+            return None
+        return self.expires_at - self.issued_at
+    
+    def seconds_until_refresh(self):
+        """Seconds until a proactive refresh is due, or None if expiry is unknown"""
+        lifetime = self.lifetime()
+        if lifetime is None:
+            return None
+        # Leave refresh_margin of headroom, but never more than a quarter of the lifetime
+        margin = min(self.refresh_margin, lifetime * 0.25)
+        return self.expires_at - margin - time.time()
+    
+    def needs_refresh(self):
+        """True when the token is about to expire"""
+        remaining = self.seconds_until_refresh()
+        return remaining is not None and remaining <= 0
+    
+    def describe(self):
+        """Human readable expiry summary for the log"""
+        lifetime = self.lifetime()
+        if lifetime is None:
+            return "expiry unknown - will learn it from repeated 401s"
+        return f"expires in {self.expires_at - time.time():.0f}s (lifetime {lifetime:.0f}s)"
+    
+    async def refresh(self, login, seen_generation=None):
+        """
+        Single-flight refresh: only one caller runs `login`, the rest wait for it.
+        
+        `login` is an async callable returning a new token or None. If the token
+        already changed since `seen_generation`, no login is performed.
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if seen_generation is not None and seen_generation != self.generation:
+                return True
+            if self.broker:
+                entry, logged_in = await self.broker.refresh(login, self.serial)
+                if not entry:
+                    return False
+                self.adopt(entry)
+                if logged_in:
+                    self.refresh_count += 1
+                    print(f"  Token {self.describe()}")
+                else:
+                    print(f"  Token refreshed by another process - {self.describe()}")
+                return True
+            new_token = await login()
+            if not new_token:
+                return False
+            self.set_token(new_token)
+            self.refresh_count += 1
+            print(f"  Token {self.describe()}")
+            return True
+    
+    async def run_refresher(self, login):
+        """Background task: refresh just before expiry so requests never wait on a login"""
+        while True:
+            remaining = self.seconds_until_refresh()
+            if remaining is None:
+                await asyncio.sleep(self.idle_check)
+                continue
+            if remaining > 0:
+                await asyncio.sleep(min(remaining, self.idle_check))
+                continue
+            
+            generation = self.generation
+            if not await self.refresh(login, generation):
+                # Keep serving the old token; 401 retries will still catch expiry
+                await asyncio.sleep(self.idle_check)
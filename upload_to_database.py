@@ -1,33 +1,42 @@
 #!/usr/bin/env python3
+import io
 import os
 import csv
+import time
 import psycopg2
-from pathlib import Path
-from psycopg2.extras import execute_values
-from dotenv import load_dotenv
+import pandas as pd
 from datetime import datetime
-
-# Load environment variables from .env file in script directory
-env_path = Path(__file__).parent / '.env'
-load_dotenv(dotenv_path=env_path)
-
-DB_CONFIG = {
-    'host': os.getenv('SUPABASE_HOST'),
-    'dbname': os.getenv('SUPABASE_DBNAME'),
-    'user': os.getenv('SUPABASE_USER'),
-    'password': os.getenv('SUPABASE_PASSWORD'),
-    'port': os.getenv('SUPABASE_PORT'),
-    'sslmode': 'require'
-}
+from concurrent.futures import ThreadPoolExecutor
+from upload_watermark import UploadWatermark
+from db_connection import get_database, close_database, missing_credentials, env_path
+from db_schema import (ensure_schema, ensure_partitions, CURRENT_TABLE_NAME, CURRENT_COLUMNS, UPSERT_CURRENT_CONFLICT,
+                       CHANGES_TABLE_NAME, SEEN_TABLE_NAME, PRODUCTS_TABLE_NAME, LOCATIONS_TABLE_NAME,
+                       FACT_TABLE_NAME, RUNS_TABLE_NAME, STORAGE_MODE)
 
 # Debug: Check if database credentials were loaded
-if not all(DB_CONFIG.values()):
+if missing_credentials():
     print(f"⚠️  WARNING: Database credentials not found in .env file!")
     print(f"   Expected location: {env_path.absolute()}")
-    print(f"   Missing credentials: {[k for k, v in DB_CONFIG.items() if not v]}\n")
+    print(f"   Missing credentials: {missing_credentials()}\n")
 
 CSV_FILE = 'airr_product_data.csv'
 TABLE_NAME = 'airr_product_availability'
+STAGING_TABLE = 'airr_product_staging'
+
+# Columns the scraper writes, in the order it writes them
+CSV_COLUMNS = [
+    'product_code', 'product_name', 'location_name', 'location_abbreviation', 'location_id',
+    'qty_available', 'qty_in_transit', 'qty_on_hand', 'qty_on_order',
+    'scrape_status', 'error_message'
+]
+QTY_COLUMNS = ['qty_available', 'qty_in_transit', 'qty_on_hand', 'qty_on_order']
+
+# Written by the scraper since run ids were introduced; older CSVs lack them
+RUN_COLUMNS = ['run_id', 'scraped_at']
+STAGING_COLUMNS = CSV_COLUMNS + RUN_COLUMNS
+
+# Rows parsed and sent per COPY; memory use is bounded by two chunks
+CHUNK_ROWS = int(os.getenv('UPLOAD_CHUNK_ROWS', '50000'))
 
 def create_table_if_not_exists(conn):
     """
@@ -47,78 +56,114 @@ def create_table_if_not_exists(conn):
     - error_message: Error message if any
     - scraped_at: Timestamp when data was scraped
     - uploaded_at: Timestamp when data was uploaded to database
-    """
+    - run_id: Scrape run that produced the row
     
-    create_table_query = f"""
-    CREATE TABLE IF NOT EXISTS {TABLE_NAME} (
-        id SERIAL PRIMARY KEY,
-        product_code VARCHAR(50) NOT NULL,
-        product_name TEXT,
-        location_name VARCHAR(100),
-        location_abbreviation VARCHAR(20),
-        location_id VARCHAR(20),
-        qty_available INTEGER DEFAULT 0,
-        qty_in_transit INTEGER DEFAULT 0,
-        qty_on_hand INTEGER DEFAULT 0,
-        qty_on_order INTEGER DEFAULT 0,
-        scrape_status VARCHAR(20),
-        error_message TEXT,
-        scraped_at TIMESTAMP,
-        uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        UNIQUE(product_code, location_id, scraped_at)
-    );
-    
-    CREATE INDEX IF NOT EXISTS idx_product_code ON {TABLE_NAME}(product_code);
-    CREATE INDEX IF NOT EXISTS idx_location_id ON {TABLE_NAME}(location_id);
-    CREATE INDEX IF NOT EXISTS idx_scraped_at ON {TABLE_NAME}(scraped_at);
+    The table is partitioned by scraped_at (see db_schema).
     """
     
-    with conn.cursor() as cur:
-        cur.execute(create_table_query)
-        conn.commit()
+    # Partitioned by scraped_at; an older plain table is converted in place
+    ensure_schema(conn)
     
     print(f"✓ Table '{TABLE_NAME}' ready")
 
-def read_csv_data(csv_file):
+def read_csv_header(csv_file):
     """
-    Read data from CSV file.
-    Returns list of tuples ready for database insertion.
+    Column names from the CSV header and the run_id of its first row (None for
+    CSVs from before run ids). Fails early if an expected column is missing.
     """
-    data = []
-    scraped_at = datetime.now()
-    
-    with open(csv_file, 'r', encoding='utf-8') as f:
+    with open(csv_file, 'r', encoding='utf-8', newline='') as f:
         reader = csv.DictReader(f)
-        for row in reader:
-            data.append((
-                row['product_code'],
-                row['product_name'],
-                row['location_name'],
-                row['location_abbreviation'],
-                row['location_id'],
-                int(float(row['qty_available'])) if row['qty_available'] else 0,
-                int(float(row['qty_in_transit'])) if row['qty_in_transit'] else 0,
-                int(float(row['qty_on_hand'])) if row['qty_on_hand'] else 0,
-                int(float(row['qty_on_order'])) if row['qty_on_order'] else 0,
-                row['scrape_status'],
-                row['error_message'] if row['error_message'] else None,
-                scraped_at
-            ))
-    
-    return data
-
-def upload_data(conn, data):
-    """
-    Upload data to database using batch insert for performance.
-    Uses ON CONFLICT to handle duplicates (update existing records).
-    """
-    
-    insert_query = f"""
+        header = reader.fieldnames or []
+        first_row = next(reader, None) or {}
+    
+    missing = [column for column in CSV_COLUMNS if column not in header]
+    if missing:
+        raise ValueError(f"CSV file {csv_file} is missing columns: {missing}")
+    return header, first_row.get('run_id') or None
+
+def read_csv_chunks(csv_file, chunk_rows=CHUNK_ROWS, skip_rows=0):
+    """
+    Read the CSV in chunks of chunk_rows rows, converting each chunk in one go:
+    empty quantities become 0 and fractional ones are truncated. Only one
+    chunk is held in memory at a time. The first skip_rows data rows are skipped.
+    """
+    reader = pd.read_csv(csv_file, usecols=lambda column: column in STAGING_COLUMNS, dtype=str,
+                         keep_default_na=False, chunksize=chunk_rows, encoding='utf-8',
+                         skiprows=range(1, skip_rows + 1))
+    for chunk in reader:
+        for column in RUN_COLUMNS:
+            if column not in chunk:
+                chunk[column] = ''
+        chunk = chunk[STAGING_COLUMNS]
+        for column in QTY_COLUMNS:
+            chunk[column] = pd.to_numeric(chunk[column].replace('', '0')).astype('float64').astype('int64')
+        yield chunk
+
+def create_staging_table(conn):
+    """
+    Temporary copy of the CSV layout with the quantities already typed.
+    line_no keeps file order so the last row wins when a product-location
+    appears more than once.
+    """
+    columns = ",\n        ".join(
+        f"{column} {'INTEGER' if column in QTY_COLUMNS else 'TEXT'}" for column in STAGING_COLUMNS
+    )
+    with conn.cursor() as cur:
+        cur.execute(f"""
+        CREATE TEMP TABLE IF NOT EXISTS {STAGING_TABLE} (
+            line_no BIGSERIAL,
+            {columns}
+        ) ON COMMIT DROP
+        """)
+
+def copy_chunk_to_staging(conn, chunk):
+    """COPY one parsed chunk into the staging table; returns the rows copied"""
+    buffer = io.StringIO()
+    # Strings are quoted, so empty text loads as '' rather than NULL
+    chunk.to_csv(buffer, index=False, header=False, quoting=csv.QUOTE_NONNUMERIC)
+    buffer.seek(0)
+    
+    copy_query = f"COPY {STAGING_TABLE} ({', '.join(STAGING_COLUMNS)}) FROM STDIN WITH (FORMAT csv)"
+    with conn.cursor() as cur:
+        cur.copy_expert(copy_query, buffer, size=1024 * 1024)
+    return len(chunk)
+
+def staged_time_range(conn, scraped_at):
+    """Oldest and newest scraped_at among the staged rows"""
+    with conn.cursor() as cur:
+        cur.execute(f"""
+        SELECT MIN(COALESCE(NULLIF(scraped_at, '')::TIMESTAMP, %s)),
+               MAX(COALESCE(NULLIF(scraped_at, '')::TIMESTAMP, %s))
+        FROM {STAGING_TABLE}
+        """, (scraped_at, scraped_at))
+        return cur.fetchone()
+
+def merge_staging(conn, scraped_at):
+    """
+    Upsert the staged rows into the main table in one statement.
+    Uses ON CONFLICT to handle duplicates (update existing records). Rows keep
+    the scraped_at the scraper gave them, so rows already written live collide
+    instead of being inserted again; `scraped_at` only fills in for old CSVs.
+    """
+    merge_query = f"""
     INSERT INTO {TABLE_NAME} (
         product_code, product_name, location_name, location_abbreviation,
         location_id, qty_available, qty_in_transit, qty_on_hand,
-        qty_on_order, scrape_status, error_message, scraped_at
-    ) VALUES %s
+        qty_on_order, scrape_status, error_message, scraped_at, run_id
+    )
+    SELECT DISTINCT ON (product_code, location_id, scraped_at)
+            product_code, product_name, location_name, location_abbreviation, location_id,
+            qty_available, qty_in_transit, qty_on_hand, qty_on_order,
+            scrape_status, error_message, scraped_at, run_id
+    FROM (
+        SELECT line_no, product_code, product_name, location_name, location_abbreviation, location_id,
+               qty_available, qty_in_transit, qty_on_hand, qty_on_order,
+               scrape_status, NULLIF(error_message, '') AS error_message,
+               COALESCE(NULLIF(scraped_at, '')::TIMESTAMP, %s) AS scraped_at,
+               NULLIF(run_id, '') AS run_id
+        FROM {STAGING_TABLE}
+    ) staged
+    ORDER BY product_code, location_id, scraped_at, line_no DESC
     ON CONFLICT (product_code, location_id, scraped_at) 
     DO UPDATE SET
         product_name = EXCLUDED.product_name,
@@ -130,43 +175,307 @@ def upload_data(conn, data):
         qty_on_order = EXCLUDED.qty_on_order,
         scrape_status = EXCLUDED.scrape_status,
         error_message = EXCLUDED.error_message,
+        run_id = EXCLUDED.run_id,
         uploaded_at = CURRENT_TIMESTAMP
     """
     
     with conn.cursor() as cur:
-        execute_values(cur, insert_query, data)
-        conn.commit()
+        cur.execute(merge_query, (scraped_at,))
+        return cur.rowcount
+
+def update_current_from_staging(conn, scraped_at):
+    """Upsert the newest successful staged row per product-location into the current table"""
+    current_query = f"""
+    INSERT INTO {CURRENT_TABLE_NAME} ({', '.join(CURRENT_COLUMNS)})
+    SELECT DISTINCT ON (product_code, location_id)
+            product_code, location_id, product_name, location_name, location_abbreviation,
+            qty_available, qty_in_transit, qty_on_hand, qty_on_order,
+            COALESCE(NULLIF(scraped_at, '')::TIMESTAMP, %s), NULLIF(run_id, '')
+    FROM {STAGING_TABLE}
+    WHERE scrape_status = 'success' AND location_id <> ''
+    ORDER BY product_code, location_id, COALESCE(NULLIF(scraped_at, '')::TIMESTAMP, %s) DESC, line_no DESC
+    {UPSERT_CURRENT_CONFLICT}
+    """
     
-    print(f"✓ Uploaded {len(data)} rows to database")
+    with conn.cursor() as cur:
+        cur.execute(current_query, (scraped_at, scraped_at))
+        return cur.rowcount
 
-def get_latest_stats(conn):
+def merge_staging_delta(conn, scraped_at):
+    """
+    Delta mode (AIRR_STORAGE_MODE=delta): log only staged rows whose quantities
+    differ from airr_product_current, plus a zero-stock row for each location a
+    successfully scraped product no longer reports (as delta_store does), apply
+    them to it, and refresh the per-product heartbeat. Returns (changed rows,
+    products seen).
+    """
+    columns = ', '.join(CURRENT_COLUMNS)
+    delta_query = f"""
+    WITH staged AS (
+        SELECT DISTINCT ON (product_code, location_id)
+                product_code, location_id, product_name, location_name, location_abbreviation,
+                qty_available, qty_in_transit, qty_on_hand, qty_on_order,
+                COALESCE(NULLIF(scraped_at, '')::TIMESTAMP, %(scraped_at)s) AS scraped_at,
+                NULLIF(run_id, '') AS run_id
+        FROM {STAGING_TABLE}
+        WHERE scrape_status = 'success' AND location_id <> ''
+        ORDER BY product_code, location_id, COALESCE(NULLIF(scraped_at, '')::TIMESTAMP, %(scraped_at)s) DESC, line_no DESC
+    ), scraped AS (
+        SELECT DISTINCT ON (product_code)
+                product_code, product_name,
+                COALESCE(NULLIF(scraped_at, '')::TIMESTAMP, %(scraped_at)s) AS scraped_at,
+                NULLIF(run_id, '') AS run_id
+        FROM {STAGING_TABLE}
+        WHERE scrape_status = 'success'
+        ORDER BY product_code, COALESCE(NULLIF(scraped_at, '')::TIMESTAMP, %(scraped_at)s) DESC, line_no DESC
+    ), gone AS (
+        SELECT c.product_code, c.location_id, scraped.product_name, c.location_name, c.location_abbreviation,
+               0 AS qty_available, 0 AS qty_in_transit, 0 AS qty_on_hand, 0 AS qty_on_order,
+               scraped.scraped_at, scraped.run_id
+        FROM {CURRENT_TABLE_NAME} c
+        JOIN scraped USING (product_code)
+        WHERE c.scraped_at < scraped.scraped_at
+          AND (c.qty_available, c.qty_in_transit, c.qty_on_hand, c.qty_on_order) IS DISTINCT FROM (0, 0, 0, 0)
+          AND NOT EXISTS (
+              SELECT 1 FROM staged WHERE staged.product_code = c.product_code AND staged.location_id = c.location_id
+          )
+    ), changed AS (
+        SELECT staged.* FROM staged
+        LEFT JOIN {CURRENT_TABLE_NAME} c USING (product_code, location_id)
+        WHERE c.product_code IS NULL
+           OR (c.qty_available, c.qty_in_transit, c.qty_on_hand, c.qty_on_order)
+              IS DISTINCT FROM (staged.qty_available, staged.qty_in_transit, staged.qty_on_hand, staged.qty_on_order)
+        UNION ALL
+        SELECT {columns} FROM gone
+    ), logged AS (
+        INSERT INTO {CHANGES_TABLE_NAME} ({columns})
+        SELECT {columns} FROM changed
+        ON CONFLICT (product_code, location_id, scraped_at) DO NOTHING
+    )
+    INSERT INTO {CURRENT_TABLE_NAME} ({columns})
+    SELECT {columns} FROM changed
+    {UPSERT_CURRENT_CONFLICT}
+    """
+    
+    seen_query = f"""
+    INSERT INTO {SEEN_TABLE_NAME} (product_code, last_seen_at, run_id, scrape_status)
+    SELECT DISTINCT ON (product_code)
+            product_code, COALESCE(NULLIF(scraped_at, '')::TIMESTAMP, %(scraped_at)s),
+            NULLIF(run_id, ''), scrape_status
+    FROM {STAGING_TABLE}
+    ORDER BY product_code, COALESCE(NULLIF(scraped_at, '')::TIMESTAMP, %(scraped_at)s) DESC, line_no DESC
+    ON CONFLICT (product_code) DO UPDATE SET
+        last_seen_at = EXCLUDED.last_seen_at,
+        run_id = EXCLUDED.run_id,
+        scrape_status = EXCLUDED.scrape_status
+    WHERE {SEEN_TABLE_NAME}.last_seen_at <= EXCLUDED.last_seen_at
+    """
+    
+    with conn.cursor() as cur:
+        cur.execute(delta_query, {'scraped_at': scraped_at})
+        changed = cur.rowcount
+        cur.execute(seen_query, {'scraped_at': scraped_at})
+        return changed, cur.rowcount
+
+def merge_staging_normalized(conn, scraped_at):
+    """
+    Normalized mode (AIRR_STORAGE_MODE=normalized): upsert the staged products
+    and locations into the dimension tables, then insert the successful
+    staged rows as integer-keyed fact rows. Keys are resolved by joining to
+    the dimension tables rather than row by row. Returns the fact rows added.
+    """
+    products_query = f"""
+    INSERT INTO {PRODUCTS_TABLE_NAME} (product_code, product_name)
+    SELECT DISTINCT ON (product_code) product_code, product_name
+    FROM {STAGING_TABLE}
+    WHERE scrape_status = 'success' AND location_id <> ''
+    ORDER BY product_code, line_no DESC
+    ON CONFLICT (product_code) DO UPDATE SET product_name = EXCLUDED.product_name
+    WHERE {PRODUCTS_TABLE_NAME}.product_name IS DISTINCT FROM EXCLUDED.product_name
+    """
+    
+    locations_query = f"""
+    INSERT INTO {LOCATIONS_TABLE_NAME} (location_id, location_name, location_abbreviation)
+    SELECT DISTINCT ON (location_id) location_id, location_name, location_abbreviation
+    FROM {STAGING_TABLE}
+    WHERE scrape_status = 'success' AND location_id <> ''
+    ORDER BY location_id, line_no DESC
+    ON CONFLICT (location_id) DO UPDATE SET
+        location_name = EXCLUDED.location_name,
+        location_abbreviation = EXCLUDED.location_abbreviation
+    WHERE ({LOCATIONS_TABLE_NAME}.location_name, {LOCATIONS_TABLE_NAME}.location_abbreviation)
+          IS DISTINCT FROM (EXCLUDED.location_name, EXCLUDED.location_abbreviation)
+    """
+    
+    fact_query = f"""
+    INSERT INTO {FACT_TABLE_NAME}
+    (product_key, location_key, qty_available, qty_in_transit, qty_on_hand, qty_on_order, scraped_at)
+    SELECT p.product_key, l.location_key, s.qty_available, s.qty_in_transit, s.qty_on_hand, s.qty_on_order,
+           COALESCE(NULLIF(s.scraped_at, '')::TIMESTAMP, %s)
+    FROM {STAGING_TABLE} s
+    JOIN {PRODUCTS_TABLE_NAME} p ON p.product_code = s.product_code
+    JOIN {LOCATIONS_TABLE_NAME} l ON l.location_id = s.location_id
+    WHERE s.scrape_status = 'success'
+    ON CONFLICT (product_key, location_key, scraped_at) DO NOTHING
+    """
+    
+    with conn.cursor() as cur:
+        cur.execute(products_query)
+        cur.execute(locations_query)
+        cur.execute(fact_query, (scraped_at,))
+        return cur.rowcount
+
+def update_run_from_staging(conn, run_id, whole_file, uploaded_rows, upload_seconds, scraped_at):
+    """
+    Record the upload on the run's scrape_runs row. When the whole CSV was
+    staged its totals replace the run's counts (the CSV is the complete
+    record, e.g. when the scraper had no database); after a partial upload
+    the counts the live writer kept are left alone.
+    """
+    run_query = f"""
+    INSERT INTO {RUNS_TABLE_NAME} (
+        run_id, started_at, finished_at, status, sku_count, products, success_count, error_count, location_rows,
+        uploaded_rows, upload_seconds, uploaded_at
+    )
+    SELECT %(run_id)s,
+           COALESCE(MIN(NULLIF(scraped_at, '')::TIMESTAMP), %(scraped_at)s),
+           COALESCE(MAX(NULLIF(scraped_at, '')::TIMESTAMP), %(scraped_at)s),
+           'completed',
+           COUNT(DISTINCT product_code),
+           COUNT(DISTINCT product_code),
+           COUNT(DISTINCT product_code) FILTER (WHERE scrape_status = 'success'),
+           COUNT(DISTINCT product_code) FILTER (WHERE scrape_status = 'error'),
+           COUNT(*) FILTER (WHERE location_id <> ''),
+           %(uploaded_rows)s, %(upload_seconds)s, CURRENT_TIMESTAMP
+    FROM {STAGING_TABLE}
+    ON CONFLICT (run_id) DO UPDATE SET
+        products = CASE WHEN %(whole_file)s THEN EXCLUDED.products ELSE {RUNS_TABLE_NAME}.products END,
+        success_count = CASE WHEN %(whole_file)s THEN EXCLUDED.success_count ELSE {RUNS_TABLE_NAME}.success_count END,
+        error_count = CASE WHEN %(whole_file)s THEN EXCLUDED.error_count ELSE {RUNS_TABLE_NAME}.error_count END,
+        location_rows = CASE WHEN %(whole_file)s THEN EXCLUDED.location_rows ELSE {RUNS_TABLE_NAME}.location_rows END,
+        uploaded_rows = COALESCE({RUNS_TABLE_NAME}.uploaded_rows, 0) + EXCLUDED.uploaded_rows,
+        upload_seconds = COALESCE({RUNS_TABLE_NAME}.upload_seconds, 0) + EXCLUDED.upload_seconds,
+        uploaded_at = EXCLUDED.uploaded_at,
+        updated_at = CURRENT_TIMESTAMP
+    """
+    
+    with conn.cursor() as cur:
+        cur.execute(run_query, {
+            'run_id': run_id,
+            'whole_file': whole_file,
+            'uploaded_rows': uploaded_rows,
+            'upload_seconds': upload_seconds,
+            'scraped_at': scraped_at
+        })
+
+def upload_data(conn, csv_file, chunk_rows=CHUNK_ROWS, storage_mode=STORAGE_MODE):
     """
-    Get statistics about the latest upload.
+    Bulk load the CSV in one transaction: each parsed chunk is COPYed into a
+    temporary staging table on a background thread while the next chunk is
+    parsed, then everything is merged into the main table with one set-based
+    upsert. Returns the number of rows merged.
+    
+    Rows of the scrape run up to the upload watermark were already committed
+    by the scraper's live writer and are skipped. In delta storage mode only
+    changed stock is written (see merge_staging_delta); in normalized mode
+    compact fact rows (see merge_staging_normalized).
     """
+    started = time.time()
+    scraped_at = datetime.now()
+    header, run_id = read_csv_header(csv_file)
+    
+    watermark = UploadWatermark()
+    skip_rows = watermark.skip_rows(run_id, csv_file) if run_id else 0
+    if run_id:
+        print(f"Run ID: {run_id}")
+    if skip_rows:
+        print(f"✓ Skipping {skip_rows} rows already written to the database during the scrape")
+    
+    copied = 0
+    chunks = 0
+    try:
+        create_staging_table(conn)
+        
+        # One chunk on the wire while the next is parsed; waiting for the
+        # previous copy before submitting keeps memory at two chunks
+        with ThreadPoolExecutor(max_workers=1) as copier:
+            pending = None
+            for chunk in read_csv_chunks(csv_file, chunk_rows, skip_rows):
+                if pending:
+                    copied += pending.result()
+                pending = copier.submit(copy_chunk_to_staging, conn, chunk)
+                chunks += 1
+            if pending:
+                copied += pending.result()
+        
+        copy_seconds = time.time() - started
+        print(f"✓ Copied {copied} rows in {chunks} chunks into staging in {copy_seconds:.1f}s "
+              f"({copied / max(copy_seconds, 1e-6):,.0f} rows/sec)")
+        
+        if storage_mode == 'delta':
+            merged, seen = merge_staging_delta(conn, scraped_at)
+        else:
+            # History and normalized modes both partition their rows by scraped_at
+            table = FACT_TABLE_NAME if storage_mode == 'normalized' else TABLE_NAME
+            oldest, newest = staged_time_range(conn, scraped_at)
+            if oldest:
+                ensure_partitions(conn, oldest, newest, table)
+            if storage_mode == 'normalized':
+                merged = merge_staging_normalized(conn, scraped_at)
+            else:
+                merged = merge_staging(conn, scraped_at)
+            current = update_current_from_staging(conn, scraped_at)
+        if run_id:
+            update_run_from_staging(conn, run_id, skip_rows == 0, copied, time.time() - started, scraped_at)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    
+    # Everything in the file is in the database now; a rerun has nothing to send
+    if run_id:
+        watermark.mark_uploaded(run_id, csv_file, skip_rows + copied)
+    
+    elapsed = time.time() - started
+    if storage_mode == 'delta':
+        print(f"✓ Logged {merged} changed rows of {copied} in {elapsed:.1f}s "
+              f"({copied / max(elapsed, 1e-6):,.0f} rows/sec); {seen} products marked as seen")
+    else:
+        print(f"✓ Uploaded {merged} rows to database in {elapsed:.1f}s "
+              f"({merged / max(elapsed, 1e-6):,.0f} rows/sec)")
+        print(f"✓ Refreshed {current} rows in {CURRENT_TABLE_NAME}")
+    return merged
+
+def get_latest_stats(conn):
+    """Totals of the latest scrape run, from its scrape_runs row (None if no run is recorded)"""
     
     stats_query = f"""
-    SELECT 
-        COUNT(DISTINCT product_code) as total_products,
-        COUNT(DISTINCT location_id) as total_locations,
-        COUNT(*) as total_rows,
-        MAX(scraped_at) as latest_scrape,
-        SUM(CASE WHEN scrape_status = 'success' THEN 1 ELSE 0 END) as successful_rows,
-        SUM(CASE WHEN scrape_status = 'error' THEN 1 ELSE 0 END) as error_rows
-    FROM {TABLE_NAME}
-    WHERE scraped_at = (SELECT MAX(scraped_at) FROM {TABLE_NAME})
+    SELECT run_id, started_at, finished_at, status, sku_count, products, success_count, error_count,
+           location_rows, products_per_sec, reauth_count, uploaded_rows
+    FROM {RUNS_TABLE_NAME}
+    ORDER BY started_at DESC
+    LIMIT 1
     """
     
     with conn.cursor() as cur:
         cur.execute(stats_query)
         result = cur.fetchone()
     
+    if not result:
+        return None
     return {
-        'total_products': result[0],
-        'total_locations': result[1],
-        'total_rows': result[2],
-        'latest_scrape': result[3],
-        'successful_rows': result[4],
-        'error_rows': result[5]
+        'run_id': result[0],
+        'started_at': result[1],
+        'finished_at': result[2],
+        'status': result[3],
+        'sku_count': result[4],
+        'total_products': result[5],
+        'successful_products': result[6],
+        'error_products': result[7],
+        'location_rows': result[8],
+        'products_per_sec': result[9],
+        'reauth_count': result[10],
+        'uploaded_rows': result[11]
     }
 
 def main():
@@ -180,42 +489,46 @@ def main():
         return
     
     print(f"\n📁 CSV File: {CSV_FILE}")
-    print(f"🗄️  Database: {DB_CONFIG['host']}")
+    print(f"🗄️  Database: {os.getenv('SUPABASE_HOST')}")
     print(f"📊 Table: {TABLE_NAME}\n")
     
     try:
         print("Connecting to database...")
-        conn = psycopg2.connect(**DB_CONFIG)
-        print("✓ Connected to database\n")
+        database = get_database()
+        if not database:
+            print("✗ Error: database credentials are missing")
+            return
         
+        # Each step reconnects and reruns if the connection drops (they are all idempotent)
         print("Setting up database table...")
-        create_table_if_not_exists(conn)
+        database.run(create_table_if_not_exists)
         print()
         
-        print(f"Reading data from {CSV_FILE}...")
-        data = read_csv_data(CSV_FILE)
-        print(f"✓ Read {len(data)} rows from CSV\n")
-        
-        print("Uploading data to database...")
-        upload_data(conn, data)
+        print(f"Uploading data from {CSV_FILE}...")
+        database.run(lambda conn: upload_data(conn, CSV_FILE))
         print()
         
         print("Getting upload statistics...")
-        stats = get_latest_stats(conn)
-        print("\n" + "="*60)
-        print("Upload Statistics")
-        print("="*60)
-        print(f"Products uploaded: {stats['total_products']}")
-        print(f"Warehouse locations: {stats['total_locations']}")
-        print(f"Total rows: {stats['total_rows']}")
-        print(f"Successful: {stats['successful_rows']}")
-        print(f"Errors: {stats['error_rows']}")
-        print(f"Latest scrape: {stats['latest_scrape']}")
-        print("="*60)
+        stats = database.run(get_latest_stats)
+        if stats:
+            print("\n" + "="*60)
+            print("Upload Statistics")
+            print("="*60)
+            print(f"Run: {stats['run_id']} ({stats['status']})")
+            print(f"Products scraped: {stats['total_products']} of {stats['sku_count']} SKUs")
+            print(f"Successful: {stats['successful_products']}")
+            print(f"Errors: {stats['error_products']}")
+            print(f"Location rows: {stats['location_rows']}")
+            print(f"Rows uploaded: {stats['uploaded_rows']}")
+            if stats['products_per_sec']:
+                print(f"Scrape throughput: {stats['products_per_sec']:.1f} products/sec "
+                      f"({stats['reauth_count']} re-logins)")
+            print(f"Started: {stats['started_at']}  Finished: {stats['finished_at']}")
+            print("="*60)
         
-        conn.close()
+        close_database()
         print("\n✅ Upload completed successfully!")
-        
+    
     except psycopg2.Error as e:
         print(f"\n✗ Database error: {e}")
         return
@@ -0,0 +1,114 @@
+"""
+Run identifier and upload watermark shared by the scraper and the uploader.
+
+Every row the scraper produces carries the run's run_id and the product's
+scraped_at, in the CSV and in the database alike, so writing the same row
+twice hits the (product_code, location_id, scraped_at) key instead of adding
+a duplicate. The live database writer also records how many leading CSV
+rows of the run are known to be committed (the watermark); the post-scrape
+upload then only pushes the rows after it - the ones the live path missed.
+"""
+import os
+import json
+from datetime import datetime
+
+WATERMARK_FILE = 'upload_watermark.json'
+
+def new_run_id():
+    """Run identifier from the start time, e.g. 20250101-170000"""
+    return datetime.now().strftime('%Y%m%d-%H%M%S')
+
+class UploadWatermark:
+    """Persisted count of leading CSV data rows already committed to the database"""
+    
+    def __init__(self, path=WATERMARK_FILE):
+        self.path = path
+        self.run_id = None
+        self.csv_file = None
+        self.rows = 0
+        self.tracking = False
+        self.pending = {}
+        self.load()
+    
+    def load(self):
+        """Read the saved watermark, if any"""
+        try:
+            with open(self.path, 'r') as f:
+                state = json.load(f)
+            self.run_id = state.get('run_id')
+            self.csv_file = state.get('csv_file')
+            self.rows = int(state.get('rows', 0))
+        except (OSError, ValueError, TypeError):
+            pass
+    
+    def save(self):
+        """Write the watermark atomically"""
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({
+                'run_id': self.run_id,
+                'csv_file': self.csv_file,
+                'rows': self.rows,
+                'updated_at': datetime.now().isoformat()
+            }, f)
+        os.replace(tmp_path, self.path)
+    
+    def resolve_run_id(self, resuming):
+        """
+        $SCRAPE_RUN_ID if set (daily_scraper shares it with the uploader),
+        else the saved run when resuming it, else a new one.
+        """
+        run_id = os.getenv('SCRAPE_RUN_ID')
+        if run_id:
+            return run_id
+        if resuming and self.run_id:
+            return self.run_id
+        return new_run_id()
+    
+    def start(self, run_id, csv_file, existing_rows):
+        """
+        Begin tracking a scrape whose CSV already holds existing_rows data rows.
+        
+        Tracking continues from the saved position only if it covers exactly
+        those rows; otherwise the rows before are not known to be in the
+        database and the watermark stays where it is (the uploader will resend
+        them, which the unique key makes harmless).
+        """
+        same_run = self.run_id == run_id and self.csv_file == os.path.basename(csv_file)
+        if existing_rows == 0:
+            self.rows = 0
+            self.tracking = True
+        elif same_run and self.rows == existing_rows:
+            self.tracking = True
+        else:
+            self.rows = self.rows if same_run else 0
+            self.tracking = False
+        self.run_id = run_id
+        self.csv_file = os.path.basename(csv_file)
+        self.pending = {}
+        self.save()
+    
+    def committed(self, start, end):
+        """Record CSV rows [start, end) as committed; advances past contiguous ranges"""
+        if not self.tracking:
+            return
+        self.pending[start] = end
+        moved = False
+        while self.rows in self.pending:
+            self.rows = self.pending.pop(self.rows)
+            moved = True
+        if moved:
+            self.save()
+    
+    def mark_uploaded(self, run_id, csv_file, rows):
+        """Record that the first `rows` data rows of csv_file are in the database"""
+        self.run_id = run_id
+        self.csv_file = os.path.basename(csv_file)
+        self.rows = rows
+        self.save()
+    
+    def skip_rows(self, run_id, csv_file):
+        """Rows of csv_file the uploader can skip for this run"""
+        if self.run_id == run_id and self.csv_file == os.path.basename(csv_file):
+            return self.rows
+        return 0
@@ -0,0 +1,140 @@
+"""
+Shared SKU queue for spreading one run over several workers or machines.
+
+The SKUs of a run are enqueued once in scrape_queue (enqueueing again is a
+no-op, so every worker can simply enqueue the same SKU list). Workers then
+claim small batches with SELECT ... FOR UPDATE SKIP LOCKED, so concurrent
+claims never wait on each other or hand out the same SKU, and mark them
+done as they finish. A claim is a lease: SKUs claimed by a worker that
+dies are handed out again once the lease runs out, and a live worker
+renews the lease on everything it holds whenever it claims or reports.
+
+A SKU whose lease runs out while it is still being scraped can be scraped
+twice; every write path upserts, so that costs a request, not a duplicate.
+"""
+import os
+import socket
+from psycopg2.extras import execute_values
+from db_schema import QUEUE_TABLE_NAME
+
+LEASE_SECONDS = int(os.getenv('AIRR_QUEUE_LEASE_SECONDS', '300'))
+# How often a worker with nothing left to claim checks on SKUs other workers hold
+POLL_SECONDS = 2
+
+ENQUEUE_QUERY = f"""
+INSERT INTO {QUEUE_TABLE_NAME} (run_id, product_code, position)
+VALUES %s
+ON CONFLICT (run_id, product_code) DO NOTHING
+"""
+
+CLAIM_QUERY = f"""
+UPDATE {QUEUE_TABLE_NAME} q SET
+    status = 'claimed',
+    worker = %(worker)s,
+    lease_until = CURRENT_TIMESTAMP + make_interval(secs => %(lease)s),
+    attempts = q.attempts + 1
+FROM (
+    SELECT run_id, product_code FROM {QUEUE_TABLE_NAME}
+    WHERE run_id = %(run_id)s
+      AND (status = 'pending' OR (status = 'claimed' AND lease_until < CURRENT_TIMESTAMP))
+    ORDER BY position
+    LIMIT %(limit)s
+    FOR UPDATE SKIP LOCKED
+) c
+WHERE q.run_id = c.run_id AND q.product_code = c.product_code
+RETURNING q.position, q.product_code, q.attempts
+"""
+
+COMPLETE_QUERY = f"""
+UPDATE {QUEUE_TABLE_NAME} q SET
+    status = 'done',
+    scrape_status = d.scrape_status,
+    finished_at = CURRENT_TIMESTAMP,
+    lease_until = NULL
+FROM (VALUES %s) AS d(run_id, product_code, scrape_status)
+WHERE q.run_id = d.run_id AND q.product_code = d.product_code
+"""
+
+RENEW_QUERY = f"""
+UPDATE {QUEUE_TABLE_NAME} SET lease_until = CURRENT_TIMESTAMP + make_interval(secs => %s)
+WHERE run_id = %s AND worker = %s AND status = 'claimed'
+"""
+
+COUNT_QUERY = f"""
+SELECT status, COUNT(*) FILTER (WHERE worker IS DISTINCT FROM %s) AS others, COUNT(*)
+FROM {QUEUE_TABLE_NAME} WHERE run_id = %s GROUP BY status
+"""
+
+def default_worker_id():
+    """host:pid - unique per worker process, readable in the queue table"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+class WorkQueue:
+    """One worker's handle on a run's SKUs in scrape_queue"""
+    
+    def __init__(self, database, run_id, worker_id=None, lease_seconds=LEASE_SECONDS):
+        self.database = database
+        self.run_id = run_id
+        self.worker_id = worker_id or default_worker_id()
+        self.lease_seconds = lease_seconds
+        self.reclaimed = 0
+    
+    def enqueue(self, product_codes):
+        """Add the run's SKUs (positions keep the list order). Returns how many were new."""
+        rows = [(self.run_id, product_code, position) for position, product_code in enumerate(product_codes)]
+        
+        def work(conn):
+            with conn.cursor() as cur:
+                execute_values(cur, ENQUEUE_QUERY, rows, page_size=1000)
+                added = cur.rowcount
+            conn.commit()
+            return added
+        
+        return self.database.run(work) if rows else 0
+    
+    def claim(self, limit, finished=None):
+        """
+        Report `finished` (product_code, scrape_status) pairs as done, renew the
+        lease on everything still held and claim up to `limit` more SKUs, in one
+        transaction. Returns [(position, product_code)]; empty once nothing is
+        left to hand out.
+        """
+        def work(conn):
+            with conn.cursor() as cur:
+                if finished:
+                    execute_values(cur, COMPLETE_QUERY, [(self.run_id,) + tuple(pair) for pair in finished],
+                                   page_size=len(finished))
+                cur.execute(RENEW_QUERY, (self.lease_seconds, self.run_id, self.worker_id))
+                cur.execute(CLAIM_QUERY, {
+                    'worker': self.worker_id, 'lease': self.lease_seconds,
+                    'run_id': self.run_id, 'limit': limit
+                })
+                claimed = cur.fetchall()
+            conn.commit()
+            return claimed
+        
+        claimed = self.database.run(work)
+        self.reclaimed += sum(1 for _, _, attempts in claimed if attempts > 1)
+        return sorted((position, product_code) for position, product_code, _ in claimed)
+    
+    def complete(self, finished):
+        """Report (product_code, scrape_status) pairs as done without claiming more"""
+        if finished:
+            self.claim(0, finished)
+    
+    def counts(self):
+        """
+        SKUs of the run by status - {'pending': n, 'claimed': n, 'done': n} -
+        plus 'claimed_elsewhere', the claimed ones held by other workers
+        """
+        def work(conn):
+            with conn.cursor() as cur:
+                cur.execute(COUNT_QUERY, (self.worker_id, self.run_id))
+                found = {status: (others, total) for status, others, total in cur.fetchall()}
+            conn.rollback()
+            return found
+        
+        found = self.database.run(work)
+        counts = {status: found.get(status, (0, 0))[1] for status in ('pending', 'claimed', 'done')}
+        counts['claimed_elsewhere'] = found.get('claimed', (0, 0))[0]
+        return counts